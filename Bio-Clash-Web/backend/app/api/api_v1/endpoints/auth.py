@@ -5,7 +5,8 @@ Registration, Login, Token management.
 from datetime import timedelta
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.session import get_db
 from app.core.security import verify_password, get_password_hash, create_access_token
@@ -19,21 +20,21 @@ router = APIRouter(prefix="/auth", tags=["Authentication"])
 
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def register(user_data: UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: UserCreate, db: AsyncSession = Depends(get_db)):
     """
     Register a new user.
     Creates User, empty Profile, and initial Village with starter buildings.
     """
     try:
         # Check if email exists
-        if db.query(User).filter(User.email == user_data.email).first():
+        if await db.scalar(select(User).where(User.email == user_data.email)):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Email already registered"
             )
         
         # Check if username exists
-        if db.query(User).filter(User.username == user_data.username).first():
+        if await db.scalar(select(User).where(User.username == user_data.username)):
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Username already taken"
@@ -47,7 +48,7 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
             hashed_password=hashed_password
         )
         db.add(new_user)
-        db.flush()  # Get the user.id
+        await db.flush()  # Get the user.id
         
         # Create empty profile
         new_profile = Profile(user_id=new_user.id)
@@ -56,7 +57,7 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
         # Create initial village with starter buildings
         new_village = Village(user_id=new_user.id)
         db.add(new_village)
-        db.flush()
+        await db.flush()
         
         # Add starter buildings (THE CODEX: Level 1 of each)
         starter_buildings = [
@@ -69,14 +70,14 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
         ]
         db.add_all(starter_buildings)
         
-        db.commit()
-        db.refresh(new_user)
+        await db.commit()
+        await db.refresh(new_user)
         
         return new_user
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         import traceback
         print(f"❌ Registration error: {e}")
         print(traceback.format_exc())
@@ -89,13 +90,13 @@ async def register(user_data: UserCreate, db: Session = Depends(get_db)):
 @router.post("/login", response_model=Token)
 async def login(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Login and receive JWT token.
     Uses OAuth2 password flow (username field contains email).
     """
-    user = db.query(User).filter(User.email == form_data.username).first()
+    user = await db.scalar(select(User).where(User.email == form_data.username))
     
     if not user or not verify_password(form_data.password, user.hashed_password):
         raise HTTPException(
@@ -107,7 +108,7 @@ async def login(
     # Update last login
     from datetime import datetime
     user.last_login = datetime.utcnow()
-    db.commit()
+    await db.commit()
     
     # Create token
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
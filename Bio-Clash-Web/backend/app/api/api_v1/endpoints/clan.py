@@ -2,20 +2,28 @@
 Clan API Endpoints
 Clan management, wars, and chat.
 """
-from typing import List
+from typing import List, Optional, Tuple
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException, status, WebSocket, WebSocketDisconnect
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status, WebSocket, WebSocketDisconnect
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.db.session import get_db
+from app.db.session import get_db, AsyncSessionLocal
 from app.core.deps import get_current_active_user
+from app.core.security import decode_access_token
 from app.core.websocket import manager
+from app.core.chat import chat_writer, chat_history
+from app.core.roster import roster_cache
 from app.core.enums import ClanRole, WarState
 from app.models.user import User
-from app.models.clan import Clan, ClanMember, ClanWar, WarAttack, ClanMessage
+from app.models.clan import Clan, ClanMember, ClanWar, WarAttack
+from app.models.game import Village, Building
 from app.engines.clan import ClanManager, ClanWarEngine
+from app.engines.game import RaidEngine
+from app.engines.battle import BattleSimulator
+from app.engines.matchmaking import opponent_index
 from app.schemas.clan import (
-    ClanCreate, ClanResponse, ClanDetailResponse, ClanMemberResponse,
+    ClanCreate, ClanResponse, ClanDetailResponse,
     JoinClanRequest, PromoteMemberRequest,
     WarSearchResponse, ClanWarResponse, WarDetailResponse, 
     WarAttackRequest, WarAttackResponse,
@@ -32,7 +40,7 @@ router = APIRouter(prefix="/clan", tags=["Clan"])
 @router.post("/create", response_model=ClanResponse)
 async def create_clan(
     clan_data: ClanCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -40,7 +48,7 @@ async def create_clan(
     """
     try:
         manager = ClanManager(db)
-        clan = manager.create_clan(
+        clan = await manager.create_clan(
             user_id=current_user.id,
             name=clan_data.name,
             tag=clan_data.tag,
@@ -51,7 +59,6 @@ async def create_clan(
             min_trophies_required=clan_data.min_trophies_required
         )
         
-        clan.member_count = 1
         return clan
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -59,75 +66,59 @@ async def create_clan(
 
 @router.get("/search", response_model=List[ClanResponse])
 async def search_clans(
-    name: str = "",
-    min_members: int = 0,
-    db: Session = Depends(get_db)
+    name: str = Query(default="", max_length=100, description="Words to find in the name, tag or description"),
+    min_members: int = Query(default=0, ge=0),
+    has_space: bool = False,
+    sort: Optional[str] = Query(default=None, pattern="^(relevance|members|trophies|power|level|newest)$"),
+    limit: int = Query(default=20, ge=1, le=50),
+    offset: int = Query(default=0, ge=0),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Search for public clans.
+    Sorted by relevance when searching by name, by member count otherwise.
     """
-    query = db.query(Clan).filter(Clan.is_public == True)
-    
-    if name:
-        query = query.filter(Clan.name.ilike(f"%{name}%"))
-    
-    clans = query.limit(20).all()
-    
-    # Add member counts
-    result = []
-    for clan in clans:
-        member_count = db.query(ClanMember).filter(ClanMember.clan_id == clan.id).count()
-        if member_count >= min_members:
-            clan.member_count = member_count
-            result.append(clan)
-    
-    return result
+    return await ClanManager.search(
+        db,
+        text_query=name,
+        min_members=min_members,
+        has_space=has_space,
+        sort=sort,
+        limit=limit,
+        offset=offset
+    )
 
 
 @router.get("/my", response_model=ClanDetailResponse)
 async def get_my_clan(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Get current user's clan with all members.
     """
-    membership = db.query(ClanMember).filter(ClanMember.user_id == current_user.id).first()
+    clan = await db.scalar(
+        select(Clan).join(ClanMember, ClanMember.clan_id == Clan.id).where(ClanMember.user_id == current_user.id)
+    )
     
-    if not membership:
+    if not clan:
         raise HTTPException(status_code=404, detail="You are not in a clan")
     
-    clan = db.query(Clan).filter(Clan.id == membership.clan_id).first()
-    
-    # Get all members with user info
-    members = db.query(ClanMember).filter(ClanMember.clan_id == clan.id).all()
+    # Members with user info: one joined query, shared by all viewers until it changes
+    members = await roster_cache.get(db, clan.id)
     
-    member_responses = []
-    for m in members:
-        user = db.query(User).filter(User.id == m.user_id).first()
-        if user:
-            member_responses.append(ClanMemberResponse(
-                id=m.id,
-                user_id=m.user_id,
-                username=user.username,
-                role=m.role,
-                donations=m.donations,
-                war_stars_earned=m.war_stars_earned,
-                attacks_won=m.attacks_won,
-                league_tier=user.league_tier,
-                joined_at=m.joined_at
-            ))
-    
-    clan.member_count = len(members)
-    clan.members = member_responses
-    
-    return clan
+    # Build the response explicitly: assigning to the clan.members
+    # relationship would try to lazy-load it on the async session
+    return ClanDetailResponse(
+        **ClanResponse.model_validate(clan).model_dump(),
+        members=list(members)
+    )
 
 
 @router.post("/join")
 async def join_clan(
     request: JoinClanRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -135,7 +126,7 @@ async def join_clan(
     """
     try:
         manager = ClanManager(db)
-        manager.join_clan(current_user.id, request.clan_id)
+        await manager.join_clan(current_user.id, request.clan_id)
         return {"message": "Successfully joined the clan"}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -143,7 +134,7 @@ async def join_clan(
 
 @router.post("/leave")
 async def leave_clan(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -151,7 +142,7 @@ async def leave_clan(
     """
     try:
         manager = ClanManager(db)
-        manager.leave_clan(current_user.id)
+        await manager.leave_clan(current_user.id)
         return {"message": "Left the clan"}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -160,7 +151,7 @@ async def leave_clan(
 @router.post("/promote")
 async def promote_member(
     request: PromoteMemberRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -168,7 +159,7 @@ async def promote_member(
     """
     try:
         manager = ClanManager(db)
-        manager.promote_member(current_user.id, request.member_id, request.new_role)
+        await manager.promote_member(current_user.id, request.member_id, request.new_role)
         return {"message": f"Member role updated to {request.new_role.value}"}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
@@ -180,14 +171,14 @@ async def promote_member(
 
 @router.post("/war/search", response_model=WarSearchResponse)
 async def start_war_search(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Start searching for a clan war opponent.
     Only Leader/Co-Leader can start wars.
     """
-    membership = db.query(ClanMember).filter(ClanMember.user_id == current_user.id).first()
+    membership = await db.scalar(select(ClanMember).where(ClanMember.user_id == current_user.id))
     
     if not membership:
         raise HTTPException(status_code=400, detail="You are not in a clan")
@@ -197,7 +188,7 @@ async def start_war_search(
     
     try:
         engine = ClanWarEngine(db)
-        war = engine.start_war_search(membership.clan_id)
+        war = await engine.start_war_search(membership.clan_id)
         
         if war.opponent_clan_id:
             return WarSearchResponse(
@@ -217,28 +208,30 @@ async def start_war_search(
 
 @router.get("/war/current", response_model=ClanWarResponse)
 async def get_current_war(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Get current active war for user's clan.
     """
-    membership = db.query(ClanMember).filter(ClanMember.user_id == current_user.id).first()
+    membership = await db.scalar(select(ClanMember).where(ClanMember.user_id == current_user.id))
     
     if not membership:
         raise HTTPException(status_code=404, detail="You are not in a clan")
     
-    war = db.query(ClanWar).filter(
-        (ClanWar.clan_id == membership.clan_id) | (ClanWar.opponent_clan_id == membership.clan_id),
-        ClanWar.state.in_([WarState.MATCHMAKING, WarState.PREPARATION, WarState.BATTLE])
-    ).first()
+    war = await db.scalar(
+        select(ClanWar).where(
+            (ClanWar.clan_id == membership.clan_id) | (ClanWar.opponent_clan_id == membership.clan_id),
+            ClanWar.state.in_([WarState.MATCHMAKING, WarState.PREPARATION, WarState.BATTLE])
+        )
+    )
     
     if not war:
         raise HTTPException(status_code=404, detail="No active war")
     
     # Get clan names
-    clan = db.query(Clan).filter(Clan.id == war.clan_id).first()
-    opponent = db.query(Clan).filter(Clan.id == war.opponent_clan_id).first() if war.opponent_clan_id else None
+    clan = await db.get(Clan, war.clan_id)
+    opponent = await db.get(Clan, war.opponent_clan_id) if war.opponent_clan_id else None
     
     # Calculate time remaining
     now = datetime.utcnow()
@@ -266,7 +259,7 @@ async def get_current_war(
 @router.post("/war/attack", response_model=WarAttackResponse)
 async def execute_war_attack(
     request: WarAttackRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -274,15 +267,15 @@ async def execute_war_attack(
     """
     try:
         engine = ClanWarEngine(db)
-        attack = engine.execute_war_attack(
+        attack = await engine.execute_war_attack(
             war_id=request.war_id,
             attacker_id=current_user.id,
             defender_id=request.defender_id
         )
         
         # Get usernames
-        attacker = db.query(User).filter(User.id == attack.attacker_id).first()
-        defender = db.query(User).filter(User.id == attack.defender_id).first()
+        attacker = await db.get(User, attack.attacker_id)
+        defender = await db.get(User, attack.defender_id)
         
         return WarAttackResponse(
             attacker_username=attacker.username if attacker else "Unknown",
@@ -304,16 +297,17 @@ async def execute_war_attack(
 @router.websocket("/chat/{clan_id}")
 async def clan_chat_websocket(
     websocket: WebSocket,
-    clan_id: str,
-    db: Session = Depends(get_db)
+    clan_id: str
 ):
     """
     WebSocket endpoint for real-time clan chat.
+    Messages are broadcast first and persisted by the chat write buffer.
     """
     # In production, would validate token from query param
     # For now, accept connection
     
     await manager.join_clan_room(websocket, clan_id, "anonymous")
+    usernames = {}  # user_id -> username, resolved once per socket
     
     try:
         while True:
@@ -321,23 +315,27 @@ async def clan_chat_websocket(
             
             # Handle different message types
             if data.get("type") == "chat":
-                # Save to database
-                message = ClanMessage(
+                user_id = data.get("user_id", "anonymous")
+                if user_id not in usernames:
+                    async with AsyncSessionLocal() as db:
+                        usernames[user_id] = await db.scalar(
+                            select(User.username).where(User.id == user_id)
+                        ) or "Unknown"
+                
+                row = chat_writer.append(
                     clan_id=clan_id,
-                    user_id=data.get("user_id", "anonymous"),
-                    message=data.get("message", ""),
-                    message_type="chat"
+                    user_id=user_id,
+                    message=data.get("message", "")
                 )
-                db.add(message)
-                db.commit()
                 
-                # Broadcast to clan
+                # Broadcast to clan (also feeds the history rings)
                 await manager.broadcast_to_clan(clan_id, {
                     "type": "chat",
-                    "user_id": data.get("user_id"),
-                    "username": data.get("username"),
-                    "message": data.get("message"),
-                    "timestamp": datetime.utcnow().isoformat()
+                    "id": row["id"],
+                    "user_id": user_id,
+                    "username": usernames[user_id],
+                    "message": row["message"],
+                    "timestamp": row["created_at"].isoformat()
                 })
     
     except WebSocketDisconnect:
@@ -346,35 +344,48 @@ async def clan_chat_websocket(
 
 @router.get("/chat/history", response_model=List[ClanMessageResponse])
 async def get_chat_history(
-    limit: int = 50,
-    db: Session = Depends(get_db),
+    response: Response,
+    limit: int = Query(default=50, ge=1, le=100),
+    cursor: Optional[str] = Query(default=None, description="Keyset cursor from X-Next-Cursor"),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
-    Get recent clan chat messages.
+    Get recent clan chat messages, oldest first.
+    
+    Pass the X-Next-Cursor header back as `cursor` for the page of older
+    messages. Recent pages come from the in-memory history ring; older
+    ones cost one joined query.
     """
-    membership = db.query(ClanMember).filter(ClanMember.user_id == current_user.id).first()
+    membership = await db.scalar(select(ClanMember).where(ClanMember.user_id == current_user.id))
     
     if not membership:
         raise HTTPException(status_code=404, detail="You are not in a clan")
     
-    messages = db.query(ClanMessage).filter(
-        ClanMessage.clan_id == membership.clan_id
-    ).order_by(ClanMessage.created_at.desc()).limit(limit).all()
+    before = _decode_chat_cursor(cursor) if cursor else None
+    messages = await chat_history.page(db, membership.clan_id, limit, before)
     
-    result = []
-    for msg in reversed(messages):  # Oldest first
-        user = db.query(User).filter(User.id == msg.user_id).first()
-        result.append(ClanMessageResponse(
-            id=msg.id,
-            user_id=msg.user_id,
-            username=user.username if user else "Unknown",
-            message=msg.message,
-            message_type=msg.message_type,
-            created_at=msg.created_at
-        ))
+    if len(messages) == limit:
+        response.headers["X-Next-Cursor"] = _encode_chat_cursor(messages[0])
     
-    return result
+    return [ClanMessageResponse(**message) for message in messages]
+
+
+def _encode_chat_cursor(message: dict) -> str:
+    """Keyset cursor for the page before this (oldest shown) message."""
+    return f"{message['created_at'].isoformat()}_{message['id']}"
+
+
+def _decode_chat_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Parse a cursor produced by _encode_chat_cursor."""
+    try:
+        created_at, message_id = cursor.split("_", 1)
+        return datetime.fromisoformat(created_at), message_id
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
 
 
 # ============================================================
@@ -385,50 +396,115 @@ async def get_chat_history(
 async def raid_websocket(
     websocket: WebSocket,
     raid_id: str,
-    role: str = "attacker"  # attacker or defender
+    role: str = "attacker",  # attacker or defender
+    token: Optional[str] = None,
+    opponent_id: Optional[str] = None
 ):
     """
     WebSocket endpoint for real-time raid battles.
     
-    Events:
-    - troop_deployed: Attacker deploys a troop
-    - building_hit: Building takes damage
-    - spell_cast: Spell effect
-    - raid_complete: Final result
+    The attacker connects with ?token=...&opponent_id=... and sends a
+    deployment plan; the battle is resolved on the server by the battle
+    simulator and its event stream goes to both sides. The defender
+    connects with role=defender to watch.
+    
+    Client events (attacker):
+    - troop_deployed: {troop, x, y, at} (at: seconds into the battle)
+    - end_raid: resolve the battle
+    
+    The attacker is refused (close 1008) for their own base, a shielded or
+    empty base; end_raid also claims the raid cooldown (RaidEngine.start_raid).
+    
+    Server events:
+    - deployment_accepted / error: reply to a deployment (or a refused end_raid)
+    - troop_deployed, building_destroyed, troop_defeated, star_earned,
+      battle_ended: the simulated battle, in order (t: battle seconds)
+    - raid_ended: final stars, destruction and loot
     """
-    await websocket.accept()
+    if role == "defender":
+        if not await manager.watch_raid_session(raid_id, websocket):
+            return
+        try:
+            while True:
+                await websocket.receive_text()  # Closed by end_raid_session
+        except WebSocketDisconnect:
+            return
+    
+    attacker_id = decode_access_token(token) if token else None
+    if not attacker_id or not opponent_id:
+        await websocket.close(code=1008)
+        return
+    
+    # Same guards as POST /raid/attack; the cooldown is claimed at end_raid
+    # Defender's base, for validating deployments as they arrive
+    async with AsyncSessionLocal() as db:
+        try:
+            await RaidEngine(db, attacker_id).check_target(opponent_id)
+        except ValueError as e:
+            await websocket.close(code=1008, reason=str(e))
+            return
+        buildings = (await db.scalars(
+            select(Building).join(Village, Village.id == Building.village_id).where(Village.user_id == opponent_id)
+        )).all()
+    if not buildings:
+        await websocket.close(code=1008)
+        return
+    
+    await manager.start_raid_session(raid_id, websocket)
+    plan = []
     
-    # For MVP, just echo events
     try:
         while True:
             data = await websocket.receive_json()
-            
-            # Process raid events
             event_type = data.get("type")
             
             if event_type == "troop_deployed":
-                # Calculate damage based on biological power
-                await manager.send_raid_event(raid_id, {
-                    "type": "troop_deployed",
-                    "troop": data.get("troop"),
-                    "x": data.get("x"),
-                    "y": data.get("y")
-                })
+                try:
+                    if len(plan) >= BattleSimulator.MAX_TROOPS:
+                        raise ValueError(f"At most {BattleSimulator.MAX_TROOPS} troops per raid")
+                    deployment = BattleSimulator.validate_deployments(buildings, [data])[0]
+                except ValueError as e:
+                    await manager.send_raid_event(raid_id, {"type": "error", "message": str(e)}, to="attacker")
+                    continue
+                plan.append(deployment)
+                await manager.send_raid_event(raid_id, {"type": "deployment_accepted", **deployment})
             
             elif event_type == "attack_building":
-                await manager.send_raid_event(raid_id, {
-                    "type": "building_hit",
-                    "building_id": data.get("building_id"),
-                    "damage": data.get("damage", 10)
-                })
+                # Damage is no longer taken from the client
+                await manager.send_raid_event(
+                    raid_id, {"type": "error", "message": "Damage is resolved by the server"}, to="attacker"
+                )
             
             elif event_type == "end_raid":
+                async with AsyncSessionLocal() as db:
+                    raid_engine = RaidEngine(db, attacker_id)
+                    try:
+                        await raid_engine.start_raid(opponent_id)
+                        result = await raid_engine.simulate_battle(opponent_id, plan)
+                    except ValueError as e:
+                        # Shield raised meanwhile, cooldown, ...: the attacker may retry
+                        await manager.send_raid_event(raid_id, {"type": "error", "message": str(e)}, to="attacker")
+                        continue
+                    await raid_engine.apply_loot(opponent_id, result)
+                opponent_index.record_target(attacker_id, opponent_id)
+                
+                for event in result["events"]:
+                    await manager.send_raid_event(raid_id, event)
                 await manager.end_raid_session(raid_id, {
-                    "stars": data.get("stars", 0),
-                    "destruction": data.get("destruction", 0),
-                    "loot": data.get("loot", {})
+                    "victory": result["victory"],
+                    "stars": result["stars"],
+                    "destruction": result["damage_percent"],
+                    "trophies_gained": result["trophies_gained"],
+                    "loot": {
+                        "gold": result["gold_stolen"],
+                        "elixir": result["elixir_stolen"],
+                        "dark_elixir": result["dark_elixir_stolen"]
+                    }
                 })
                 break
     
     except WebSocketDisconnect:
         pass
+    finally:
+        # No-op once end_raid_session has run; otherwise nobody else removes it
+        manager.drop_raid_session(raid_id)
@@ -2,20 +2,27 @@
 Fitness API Endpoints
 Exercise library, Workout logging, Biometrics, and Stats.
 """
-from datetime import date, datetime
-from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Tuple
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
+from sqlalchemy import select, func, or_, and_
 
 from app.db.session import get_db
 from app.core.deps import get_current_active_user
 from app.core.enums import MuscleGroup
+from app.core.catalog import exercise_catalog
 from app.models.user import User
-from app.models.fitness import Exercise, WorkoutLog, WorkoutSet, DailyBiometrics
+from app.models.fitness import WorkoutLog, WorkoutSet, DailyBiometrics
+from app.engines.volume import MuscleVolumeLedger
+from app.engines.importer import WorkoutImporter
+from app.engines.game import ResourceManager, RaidEngine
+from app.engines.clan import ClanManager
 from app.schemas.fitness import (
     ExerciseResponse, ExerciseListResponse,
     WorkoutLogCreate, WorkoutLogResponse, WorkoutSummary, WorkoutSetResponse,
+    WorkoutImportReport,
     BiometricsCreate, BiometricsResponse,
     MuscleVolumeStats, UserFitnessStats
 )
@@ -30,30 +37,29 @@ router = APIRouter(prefix="/fitness", tags=["Fitness"])
 @router.get("/exercises", response_model=List[ExerciseResponse])
 async def get_all_exercises(
     muscle_group: Optional[MuscleGroup] = None,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get all exercises, optionally filtered by muscle group.
     """
-    query = db.query(Exercise)
+    catalog = await exercise_catalog.ensure_loaded(db)
     
     if muscle_group:
-        query = query.filter(Exercise.primary_muscle == muscle_group)
+        return catalog.exercises_for(muscle_group)
     
-    exercises = query.order_by(Exercise.name).all()
-    return exercises
+    return catalog.all()
 
 
 @router.get("/exercises/grouped", response_model=List[ExerciseListResponse])
-async def get_exercises_grouped(db: Session = Depends(get_db)):
+async def get_exercises_grouped(db: AsyncSession = Depends(get_db)):
     """
     Get all exercises grouped by muscle group (for UI selector).
     """
+    catalog = await exercise_catalog.ensure_loaded(db)
+    
     result = []
     for muscle in MuscleGroup:
-        exercises = db.query(Exercise).filter(
-            Exercise.primary_muscle == muscle
-        ).order_by(Exercise.name).all()
+        exercises = catalog.exercises_for(muscle)
         
         if exercises:
             result.append(ExerciseListResponse(
@@ -71,7 +77,7 @@ async def get_exercises_grouped(db: Session = Depends(get_db)):
 @router.post("/workout", response_model=WorkoutSummary)
 async def log_workout(
     workout_data: WorkoutLogCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -94,17 +100,19 @@ async def log_workout(
         workout_log.duration_minutes = int(duration)
     
     db.add(workout_log)
-    db.flush()
+    await db.flush()
     
     # Process sets and calculate volumes
     total_volume = 0.0
     total_rpe = 0.0
     rpe_count = 0
     muscles_worked = {}
+    muscle_totals = {}  # MuscleGroup -> (volume, set_count) for the ledger
+    catalog = await exercise_catalog.ensure_loaded(db)
     
     for set_data in workout_data.sets:
         # Get exercise for muscle mapping
-        exercise = db.query(Exercise).filter(Exercise.id == set_data.exercise_id).first()
+        exercise = catalog.get(set_data.exercise_id)
         if not exercise:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -139,12 +147,24 @@ async def log_workout(
         # Track volume per muscle
         muscle_key = exercise.primary_muscle.value
         muscles_worked[muscle_key] = muscles_worked.get(muscle_key, 0) + set_volume
+        
+        prev_volume, prev_sets = muscle_totals.get(exercise.primary_muscle, (0.0, 0))
+        muscle_totals[exercise.primary_muscle] = (prev_volume + set_volume, prev_sets + 1)
     
     # Update workout log aggregates
     workout_log.total_volume_kg = total_volume
     workout_log.total_sets = len(workout_data.sets)
     workout_log.avg_rpe = (total_rpe / rpe_count) if rpe_count > 0 else None
     
+    # Update the muscle volume ledger in the same transaction
+    await MuscleVolumeLedger(db, current_user.id).record_sets(muscle_totals, workout_log.date)
+    
+    # Push the workout's power delta to the user's clan total
+    attack_delta, defense_delta = RaidEngine.split_power(
+        {muscle: volume for muscle, (volume, _) in muscle_totals.items()}
+    )
+    await ClanManager.apply_power_delta(db, current_user.id, attack_delta, defense_delta)
+    
     # Calculate resources earned (THE HARVEST)
     # Gold from activity, scaled by volume
     gold_earned = int(total_volume / 10)  # 10kg = 1 gold
@@ -154,16 +174,16 @@ async def log_workout(
     
     # Update village resources
     from app.models.game import Village
-    village = db.query(Village).filter(Village.user_id == current_user.id).first()
+    village = await db.scalar(select(Village).where(Village.user_id == current_user.id))
     if village:
+        ResourceManager(db, village).settle()
         village.gold = min(village.gold + gold_earned, village.gold_capacity)
         village.elixir = min(village.elixir + elixir_earned, village.elixir_capacity)
     
     # Update user consistency (simple: +1 point per workout, scaled)
-    current_user.consistency_score = min(100, current_user.consistency_score + 2)
+    current_user.consistency_score = User.raised_consistency(2)
     
-    db.commit()
-    db.refresh(workout_log)
+    await db.commit()
     
     # Determine which buildings can now be upgraded
     buildings_unlocked = []  # Would query BUILDING_REQUIREMENTS
@@ -180,22 +200,50 @@ async def log_workout(
 
 @router.get("/workouts", response_model=List[WorkoutLogResponse])
 async def get_workout_history(
+    response: Response,
     limit: int = Query(default=10, le=50),
     offset: int = Query(default=0, ge=0),
-    db: Session = Depends(get_db),
+    cursor: Optional[str] = Query(default=None, description="Keyset cursor from X-Next-Cursor"),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
-    """Get user's workout history."""
-    workouts = db.query(WorkoutLog).filter(
+    """
+    Get user's workout history, newest first.
+    
+    Pagination:
+    - cursor (preferred): pass the X-Next-Cursor header of the previous page.
+      Seeks on (date, id), so deep pages cost the same as the first one.
+    - offset: legacy OFFSET pagination, used when no cursor is given.
+    
+    Sets are loaded with one extra query per page (selectinload).
+    """
+    query = select(WorkoutLog).options(
+        selectinload(WorkoutLog.sets)
+    ).where(
         WorkoutLog.user_id == current_user.id
-    ).order_by(WorkoutLog.date.desc()).offset(offset).limit(limit).all()
+    ).order_by(WorkoutLog.date.desc(), WorkoutLog.id.desc())
+    
+    if cursor:
+        cursor_date, cursor_id = _decode_workout_cursor(cursor)
+        query = query.where(or_(
+            WorkoutLog.date < cursor_date,
+            and_(WorkoutLog.date == cursor_date, WorkoutLog.id < cursor_id)
+        ))
+    else:
+        query = query.offset(offset)
+    
+    workouts = (await db.scalars(query.limit(limit))).all()
+    
+    if workouts and len(workouts) == limit:
+        response.headers["X-Next-Cursor"] = _encode_workout_cursor(workouts[-1])
     
     # Enrich sets with exercise names
+    catalog = await exercise_catalog.ensure_loaded(db)
     result = []
     for workout in workouts:
         sets_with_names = []
         for s in workout.sets:
-            exercise = db.query(Exercise).filter(Exercise.id == s.exercise_id).first()
+            exercise = catalog.get(s.exercise_id)
             sets_with_names.append(WorkoutSetResponse(
                 id=s.id,
                 exercise_id=s.exercise_id,
@@ -225,6 +273,49 @@ async def get_workout_history(
     return result
 
 
+def _encode_workout_cursor(workout: WorkoutLog) -> str:
+    """Keyset cursor for the page after this workout."""
+    return f"{workout.date.isoformat()}_{workout.id}"
+
+
+def _decode_workout_cursor(cursor: str) -> Tuple[date, str]:
+    """Parse a cursor produced by _encode_workout_cursor."""
+    try:
+        cursor_date, cursor_id = cursor.split("_", 1)
+        return date.fromisoformat(cursor_date), cursor_id
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+
+
+@router.post("/workouts/import", response_model=WorkoutImportReport)
+async def import_workouts(
+    request: Request,
+    format: Optional[str] = Query(default=None, pattern="^(ndjson|csv)$"),
+    db: AsyncSession = Depends(get_db),
+    current_user: User = Depends(get_current_active_user)
+):
+    """
+    Bulk import training history from another tracker.
+    
+    The request body is streamed, one set per row:
+    - NDJSON (default): {"date": "2024-01-31", "exercise_name": "Deadlift", "reps": 5, "weight_kg": 140}
+    - CSV (format=csv or Content-Type text/csv): header row with the same field names
+    
+    Consecutive rows with the same date (and optional "session") become one workout.
+    Invalid rows are skipped and reported; rewards and muscle volumes are
+    recomputed once at the end.
+    """
+    if format is None:
+        content_type = request.headers.get("content-type", "")
+        format = "csv" if content_type.startswith("text/csv") else "ndjson"
+    
+    importer = WorkoutImporter(db, current_user)
+    return await importer.run(request.stream(), format)
+
+
 # ============================================================
 # BIOMETRICS ENDPOINTS
 # ============================================================
@@ -232,7 +323,7 @@ async def get_workout_history(
 @router.post("/biometrics", response_model=BiometricsResponse)
 async def log_biometrics(
     data: BiometricsCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -242,20 +333,22 @@ async def log_biometrics(
     log_date = data.date or date.today()
     
     # Check if entry exists for today
-    existing = db.query(DailyBiometrics).filter(
-        DailyBiometrics.user_id == current_user.id,
-        DailyBiometrics.date == log_date
-    ).first()
+    existing = await db.scalar(
+        select(DailyBiometrics).where(
+            DailyBiometrics.user_id == current_user.id,
+            DailyBiometrics.date == log_date
+        )
+    )
     
     if existing:
         # Update existing entry
         for field, value in data.model_dump(exclude_unset=True, exclude={'date'}).items():
             setattr(existing, field, value)
-        db.commit()
-        db.refresh(existing)
+        await db.commit()
+        await db.refresh(existing)
         
         # Update elixir generation based on sleep
-        _update_elixir_rate(db, current_user.id, existing.sleep_hours)
+        await _update_elixir_rate(db, current_user.id, existing.sleep_hours)
         
         return existing
     
@@ -265,79 +358,69 @@ async def log_biometrics(
         **data.model_dump(exclude_unset=True)
     )
     db.add(biometrics)
-    db.commit()
-    db.refresh(biometrics)
+    await db.commit()
+    await db.refresh(biometrics)
     
     # Update elixir generation based on sleep
-    _update_elixir_rate(db, current_user.id, biometrics.sleep_hours)
+    await _update_elixir_rate(db, current_user.id, biometrics.sleep_hours)
     
     return biometrics
 
 
-def _update_elixir_rate(db: Session, user_id: str, sleep_hours: Optional[float]):
+async def _update_elixir_rate(db: AsyncSession, user_id: str, sleep_hours: Optional[float]):
     """Update village elixir generation based on sleep."""
     if sleep_hours is None:
         return
     
     from app.models.game import Village
-    village = db.query(Village).filter(Village.user_id == user_id).first()
+    village = await db.scalar(select(Village).where(Village.user_id == user_id))
     if village:
+        # Bank what was generated at the old rate first
+        ResourceManager(db, village).settle()
+        
         # Base rate 100/hr, +20% per hour of sleep over 6
         bonus_hours = max(0, sleep_hours - 6)
         village.elixir_per_hour = 100 * (1 + bonus_hours * 0.2)
-        db.commit()
+        await db.commit()
 
 
 @router.get("/stats", response_model=UserFitnessStats)
 async def get_fitness_stats(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Get aggregated fitness statistics.
     This is used for game upgrade requirements.
     """
-    # Total workout count
-    total_workouts = db.query(func.count(WorkoutLog.id)).filter(
-        WorkoutLog.user_id == current_user.id
-    ).scalar() or 0
+    # One pass over the user's workout days: (date, workouts, volume), newest first
+    daily_rows = (await db.execute(
+        select(
+            WorkoutLog.date,
+            func.count(WorkoutLog.id),
+            func.sum(WorkoutLog.total_volume_kg)
+        ).where(
+            WorkoutLog.user_id == current_user.id
+        ).group_by(WorkoutLog.date).order_by(WorkoutLog.date.desc())
+    )).all()
     
-    # Total volume
-    total_volume = db.query(func.sum(WorkoutLog.total_volume_kg)).filter(
-        WorkoutLog.user_id == current_user.id
-    ).scalar() or 0.0
+    total_workouts = sum(count for _, count, _ in daily_rows)
+    total_volume = sum(volume or 0.0 for _, _, volume in daily_rows)
+    current_streak = _current_streak([day for day, _, _ in daily_rows])
+    
+    # Volume per muscle group (THE CODEX lookups) from the ledger
+    ledger_rows = {row.muscle: row for row in await MuscleVolumeLedger(db, current_user.id).get_rows()}
     
-    # Volume per muscle group (THE CODEX lookups)
     muscle_stats = []
     for muscle in MuscleGroup:
-        # Get exercises for this muscle
-        exercise_ids = [e.id for e in db.query(Exercise).filter(
-            Exercise.primary_muscle == muscle
-        ).all()]
-        
-        if exercise_ids:
-            # Sum volume from sets of these exercises
-            volume = db.query(func.sum(WorkoutSet.volume)).filter(
-                WorkoutSet.exercise_id.in_(exercise_ids),
-                WorkoutSet.workout_log_id.in_(
-                    db.query(WorkoutLog.id).filter(WorkoutLog.user_id == current_user.id)
-                )
-            ).scalar() or 0.0
-            
-            set_count = db.query(func.count(WorkoutSet.id)).filter(
-                WorkoutSet.exercise_id.in_(exercise_ids),
-                WorkoutSet.workout_log_id.in_(
-                    db.query(WorkoutLog.id).filter(WorkoutLog.user_id == current_user.id)
-                )
-            ).scalar() or 0
-            
-            if volume > 0 or set_count > 0:
-                muscle_stats.append(MuscleVolumeStats(
-                    muscle_group=muscle,
-                    total_volume_kg=volume,
-                    total_sets=set_count,
-                    last_workout_date=None  # Could query for this
-                ))
+        row = ledger_rows.get(muscle)
+        if row and (row.total_volume > 0 or row.set_count > 0):
+            muscle_stats.append(MuscleVolumeStats(
+                muscle_group=muscle,
+                total_volume_kg=row.total_volume,
+                total_sets=row.set_count,
+                last_workout_date=row.last_date
+            ))
     
     return UserFitnessStats(
         total_workouts=total_workouts,
@@ -345,5 +428,27 @@ async def get_fitness_stats(
         avg_weekly_volume=total_volume / max(1, total_workouts / 3),  # Rough estimate
         muscle_volumes=muscle_stats,
         consistency_score=current_user.consistency_score,
-        current_streak=0  # Would need streak tracking
+        current_streak=current_streak
     )
+
+
+def _current_streak(workout_dates: List[date]) -> int:
+    """
+    Count consecutive training days ending today (or yesterday, so an
+    unfinished day does not break the streak). Dates must be newest first.
+    """
+    if not workout_dates:
+        return 0
+    
+    expected = date.today()
+    if workout_dates[0] < expected:
+        expected -= timedelta(days=1)
+    
+    streak = 0
+    for day in workout_dates:
+        if day != expected:
+            break
+        streak += 1
+        expected -= timedelta(days=1)
+    
+    return streak
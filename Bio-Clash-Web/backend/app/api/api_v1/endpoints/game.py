@@ -5,7 +5,9 @@ Village management, Building upgrades, Raids, and FairPlay status.
 from datetime import datetime
 from typing import List
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import selectinload
 
 from app.db.session import get_db
 from app.core.deps import get_current_active_user
@@ -13,6 +15,8 @@ from app.models.user import User
 from app.models.game import Village, Building, UpgradeQueue
 from app.engines.fairplay import FatigueOracle, LeagueClustering
 from app.engines.game import ResourceManager, UpgradeManager, RaidEngine
+from app.core.scheduler import effective_finish_time
+from app.engines.matchmaking import opponent_index
 from app.schemas.game import (
     VillageResponse, BuildingResponse, BuildingUpgradeRequest, BuildingUpgradeRequirement,
     ResourceSyncResponse, UpgradeQueueResponse,
@@ -29,14 +33,21 @@ router = APIRouter(prefix="/game", tags=["Game"])
 
 @router.get("/village", response_model=VillageResponse)
 async def get_village(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Get current user's village with all buildings.
-    Also syncs resources before returning.
+    
+    Read-only: balances are projected from last_resource_sync and the
+    per-hour rates. They are persisted by POST /village/sync or by the
+    next mutation (upgrade, raid, workout reward).
     """
-    village = db.query(Village).filter(Village.user_id == current_user.id).first()
+    village = await db.scalar(
+        select(Village).options(
+            selectinload(Village.buildings)
+        ).where(Village.user_id == current_user.id)
+    )
     
     if not village:
         raise HTTPException(
@@ -44,32 +55,29 @@ async def get_village(
             detail="Village not found. Please complete registration."
         )
     
-    # Sync resources
-    ResourceManager(db, village).sync_resources()
-    
-    # Get buildings
-    buildings = db.query(Building).filter(Building.village_id == village.id).all()
-    village.buildings = buildings
+    gold, elixir, dark_elixir = ResourceManager(db, village).project()
     
-    return village
+    return VillageResponse.model_validate(village).model_copy(
+        update={"gold": gold, "elixir": elixir, "dark_elixir": dark_elixir}
+    )
 
 
 @router.post("/village/sync", response_model=ResourceSyncResponse)
 async def sync_resources(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Manually sync village resources.
     Called periodically by frontend.
     """
-    village = db.query(Village).filter(Village.user_id == current_user.id).first()
+    village = await db.scalar(select(Village).where(Village.user_id == current_user.id))
     
     if not village:
         raise HTTPException(status_code=404, detail="Village not found")
     
     seconds_elapsed = (datetime.utcnow() - village.last_resource_sync).total_seconds()
-    gold_g, elixir_g, dark_g = ResourceManager(db, village).sync_resources()
+    gold_g, elixir_g, dark_g = await ResourceManager(db, village).sync_resources()
     
     return ResourceSyncResponse(
         gold=village.gold,
@@ -89,25 +97,25 @@ async def sync_resources(
 @router.get("/building/{building_id}/upgrade-requirements", response_model=BuildingUpgradeRequirement)
 async def get_upgrade_requirements(
     building_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Get requirements to upgrade a specific building.
     Shows resource costs AND fitness requirements (THE CODEX).
     """
-    building = db.query(Building).filter(Building.id == building_id).first()
+    building = await db.get(Building, building_id)
     
     if not building:
         raise HTTPException(status_code=404, detail="Building not found")
     
-    village = db.query(Village).filter(Village.id == building.village_id).first()
+    village = await db.get(Village, building.village_id)
     
     if not village or village.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not your building")
     
     manager = UpgradeManager(db, current_user.id, village)
-    can_upgrade, reason, reqs = manager.check_upgrade_requirements(building)
+    can_upgrade, reason, reqs = await manager.check_upgrade_requirements(building)
     
     return BuildingUpgradeRequirement(
         building_type=building.building_type,
@@ -127,19 +135,19 @@ async def get_upgrade_requirements(
 @router.post("/building/{building_id}/upgrade")
 async def start_building_upgrade(
     building_id: str,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Start upgrading a building.
     Requires resources AND fitness requirements to be met.
     """
-    building = db.query(Building).filter(Building.id == building_id).first()
+    building = await db.get(Building, building_id)
     
     if not building:
         raise HTTPException(status_code=404, detail="Building not found")
     
-    village = db.query(Village).filter(Village.id == building.village_id).first()
+    village = await db.get(Village, building.village_id)
     
     if not village or village.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not your building")
@@ -149,17 +157,17 @@ async def start_building_upgrade(
     
     # Check FairPlay: Shield blocks upgrades
     oracle = FatigueOracle(db, current_user.id)
-    if oracle.should_activate_shield():
+    if await oracle.should_activate_shield():
         raise HTTPException(
             status_code=400,
             detail="You are too fatigued to start upgrades. Rest and recover first."
         )
     
     manager = UpgradeManager(db, current_user.id, village)
-    upgrade = manager.start_upgrade(building)
+    upgrade = await manager.start_upgrade(building)
     
     if not upgrade:
-        _, reason, _ = manager.check_upgrade_requirements(building)
+        _, reason, _ = await manager.check_upgrade_requirements(building)
         raise HTTPException(status_code=400, detail=reason or "Cannot upgrade")
     
     return {"message": f"Upgrade started! Will complete at {upgrade.finish_time}"}
@@ -167,32 +175,36 @@ async def start_building_upgrade(
 
 @router.get("/upgrades", response_model=List[UpgradeQueueResponse])
 async def get_active_upgrades(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get all active upgrades in the queue."""
-    village = db.query(Village).filter(Village.user_id == current_user.id).first()
+    village = await db.scalar(select(Village).where(Village.user_id == current_user.id))
     
     if not village:
         raise HTTPException(status_code=404, detail="Village not found")
     
-    upgrades = db.query(UpgradeQueue).filter(UpgradeQueue.village_id == village.id).all()
+    rows = (await db.execute(
+        select(UpgradeQueue, Building.building_type)
+        .join(Building, Building.id == UpgradeQueue.building_id)
+        .where(UpgradeQueue.village_id == village.id)
+        .order_by(UpgradeQueue.finish_time)
+    )).all()
     
     now = datetime.utcnow()
     result = []
-    for u in upgrades:
-        seconds_remaining = max(0, int((u.finish_time - now).total_seconds()))
-        building = db.query(Building).filter(Building.id == u.building_id).first()
+    for u, building_type in rows:
+        finish_time = effective_finish_time(u, now)
         
         result.append(UpgradeQueueResponse(
             id=u.id,
             building_id=u.building_id,
-            building_type=building.building_type if building else None,
+            building_type=building_type,
             target_level=u.target_level,
             start_time=u.start_time,
-            finish_time=u.finish_time,
+            finish_time=finish_time,
             is_paused=u.is_paused,
-            seconds_remaining=seconds_remaining
+            seconds_remaining=max(0, int((finish_time - now).total_seconds()))
         ))
     
     return result
@@ -204,7 +216,7 @@ async def get_active_upgrades(
 
 @router.get("/raid/search", response_model=RaidSearchResponse)
 async def search_for_opponent(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -212,35 +224,37 @@ async def search_for_opponent(
     Uses FairPlay matchmaking to find someone in the same league.
     """
     # Check if user can raid (not shielded)
-    village = db.query(Village).filter(Village.user_id == current_user.id).first()
+    village = await db.scalar(select(Village).where(Village.user_id == current_user.id))
     if village and village.shield_active:
         raise HTTPException(status_code=400, detail="You have a shield active. Cannot raid.")
     
     # Find opponent using clustering
     clustering = LeagueClustering(db)
-    opponent_ids = clustering.find_opponents(current_user.id, count=1)
+    opponent_ids = await clustering.find_opponents(current_user.id, count=1)
     
     if not opponent_ids:
         raise HTTPException(status_code=404, detail="No suitable opponents found")
     
     opponent_id = opponent_ids[0]
-    opponent = db.query(User).filter(User.id == opponent_id).first()
-    opponent_village = db.query(Village).filter(Village.user_id == opponent_id).first()
+    opponent_index.record_target(current_user.id, opponent_id)
+    opponent = await db.get(User, opponent_id)
+    opponent_village = await db.scalar(select(Village).where(Village.user_id == opponent_id))
     
     if not opponent or not opponent_village:
         raise HTTPException(status_code=404, detail="Opponent data not found")
     
     # Estimate loot
+    loot_gold, loot_elixir, _ = ResourceManager(db, opponent_village).project()
     raid_engine = RaidEngine(db, current_user.id)
-    defense_power = raid_engine.calculate_defense_power(opponent_id)
+    defense_power = await raid_engine.calculate_defense_power(opponent_id)
     
     return RaidSearchResponse(
         opponent_id=opponent.id,
         opponent_username=opponent.username,
         opponent_league=opponent.league_tier,
         opponent_town_hall=opponent_village.town_hall_level,
-        estimated_loot_gold=int(opponent_village.gold * 0.2),
-        estimated_loot_elixir=int(opponent_village.elixir * 0.2),
+        estimated_loot_gold=int(loot_gold * 0.2),
+        estimated_loot_elixir=int(loot_elixir * 0.2),
         defense_power=defense_power
     )
 
@@ -248,48 +262,32 @@ async def search_for_opponent(
 @router.post("/raid/attack", response_model=RaidBattleResult)
 async def attack_opponent(
     raid_data: RaidBattleRequest,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Execute a raid attack on an opponent.
     Battle is simulated based on biological stats.
+    
+    Rejected (400) for the attacker themselves, shielded opponents and
+    within RAID_COOLDOWN_SECONDS of the attacker's previous raid.
     """
     # Validate opponent exists
-    opponent = db.query(User).filter(User.id == raid_data.opponent_id).first()
+    opponent = await db.get(User, raid_data.opponent_id)
     if not opponent:
         raise HTTPException(status_code=404, detail="Opponent not found")
     
     # Run battle simulation
     raid_engine = RaidEngine(db, current_user.id)
-    result = raid_engine.simulate_battle(raid_data.opponent_id)
+    try:
+        await raid_engine.start_raid(raid_data.opponent_id)
+        result = await raid_engine.simulate_battle(raid_data.opponent_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    opponent_index.record_target(current_user.id, raid_data.opponent_id)
     
     # Apply loot transfer
-    if result["victory"]:
-        attacker_village = db.query(Village).filter(Village.user_id == current_user.id).first()
-        defender_village = db.query(Village).filter(Village.user_id == raid_data.opponent_id).first()
-        
-        if attacker_village and defender_village:
-            # Take from defender
-            defender_village.gold -= result["gold_stolen"]
-            defender_village.elixir -= result["elixir_stolen"]
-            defender_village.dark_elixir -= result["dark_elixir_stolen"]
-            
-            # Give to attacker
-            attacker_village.gold = min(
-                attacker_village.gold + result["gold_stolen"],
-                attacker_village.gold_capacity
-            )
-            attacker_village.elixir = min(
-                attacker_village.elixir + result["elixir_stolen"],
-                attacker_village.elixir_capacity
-            )
-            attacker_village.dark_elixir = min(
-                attacker_village.dark_elixir + result["dark_elixir_stolen"],
-                attacker_village.dark_elixir_capacity
-            )
-            
-            db.commit()
+    await raid_engine.apply_loot(raid_data.opponent_id, result)
     
     return RaidBattleResult(**result)
 
@@ -300,7 +298,7 @@ async def attack_opponent(
 
 @router.get("/fairplay/recovery", response_model=RecoveryScoreResponse)
 async def get_recovery_score(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
@@ -308,23 +306,28 @@ async def get_recovery_score(
     This is the core of the anti-burnout system.
     """
     oracle = FatigueOracle(db, current_user.id)
-    score, status, recommendations = oracle.calculate_recovery_score()
+    score, status, recommendations = await oracle.calculate_recovery_score()
     
     shield_active = score < 30
     shield_reason = "Low recovery score triggered automatic protection" if shield_active else None
     
-    # Update user's recovery score
-    current_user.recovery_score = score
+    # Only write on change: a committed User update evicts the caller's auth cache entry
+    changed = False
+    if current_user.recovery_score != score:
+        current_user.recovery_score = score
+        changed = True
     
-    # Activate shield on village if needed
+    # Activate shield on village if needed (kept until it expires, as in score_all)
     if shield_active:
-        village = db.query(Village).filter(Village.user_id == current_user.id).first()
-        if village:
+        village = await db.scalar(select(Village).where(Village.user_id == current_user.id))
+        if village and not village.shield_active:
             from datetime import timedelta
             village.shield_active = True
             village.shield_end_time = datetime.utcnow() + timedelta(hours=8)
+            changed = True
     
-    db.commit()
+    if changed:
+        await db.commit()
     
     return RecoveryScoreResponse(
         recovery_percent=score,
@@ -337,24 +340,18 @@ async def get_recovery_score(
 
 @router.get("/fairplay/league", response_model=LeagueInfoResponse)
 async def get_league_info(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Get user's league information.
-    Leagues are determined by K-Means clustering of biological output.
+    Leagues are determined by K-Means clustering of biological output
+    (league_clustering job); this reads the stored tier.
     """
-    clustering = LeagueClustering(db)
-    
-    # Recalculate league
-    new_league = clustering.assign_league(current_user.id)
-    
-    if current_user.league_tier != new_league:
-        current_user.league_tier = new_league
-        db.commit()
-    
     # Count users in same league
-    users_in_league = db.query(User).filter(User.league_tier == current_user.league_tier).count()
+    users_in_league = await db.scalar(
+        select(func.count(User.id)).where(User.league_tier == current_user.league_tier)
+    )
     
     return LeagueInfoResponse(
         current_league=current_user.league_tier,
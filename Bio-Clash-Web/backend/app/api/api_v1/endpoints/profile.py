@@ -3,7 +3,8 @@ Profile API Endpoints
 Onboarding and profile management.
 """
 from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.session import get_db
 from app.core.deps import get_current_active_user
@@ -41,14 +42,14 @@ def calculate_tdee(bmr: float, activity_level: str = "moderate") -> float:
 @router.post("/onboard", response_model=ProfileResponse)
 async def complete_onboarding(
     profile_data: ProfileCreate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """
     Complete user onboarding with physical stats and goals.
     Calculates BMR and TDEE.
     """
-    profile = db.query(Profile).filter(Profile.user_id == current_user.id).first()
+    profile = await db.scalar(select(Profile).where(Profile.user_id == current_user.id))
     
     if not profile:
         raise HTTPException(
@@ -76,19 +77,19 @@ async def complete_onboarding(
     )
     profile.tdee = calculate_tdee(profile.bmr)
     
-    db.commit()
-    db.refresh(profile)
+    await db.commit()
+    await db.refresh(profile)
     
     return profile
 
 
 @router.get("/", response_model=ProfileResponse)
 async def get_profile(
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Get current user's profile."""
-    profile = db.query(Profile).filter(Profile.user_id == current_user.id).first()
+    profile = await db.scalar(select(Profile).where(Profile.user_id == current_user.id))
     
     if not profile:
         raise HTTPException(
@@ -102,11 +103,11 @@ async def get_profile(
 @router.patch("/", response_model=ProfileResponse)
 async def update_profile(
     profile_data: ProfileUpdate,
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
     current_user: User = Depends(get_current_active_user)
 ):
     """Update user profile (partial update)."""
-    profile = db.query(Profile).filter(Profile.user_id == current_user.id).first()
+    profile = await db.scalar(select(Profile).where(Profile.user_id == current_user.id))
     
     if not profile:
         raise HTTPException(
@@ -130,7 +131,7 @@ async def update_profile(
             )
             profile.tdee = calculate_tdee(profile.bmr)
     
-    db.commit()
-    db.refresh(profile)
+    await db.commit()
+    await db.refresh(profile)
     
     return profile
@@ -0,0 +1,349 @@
+"""
+Bio-Clash Management Commands
+Maintenance tasks that run outside the API process.
+
+Usage:
+    python -m app.cli rebuild-ledger [--user-id USER_ID]
+    python -m app.cli run-job JOB_NAME
+    python -m app.cli rebuild-search-index
+    python -m app.cli upgrade-schema [--check]
+    python -m app.cli benchmark-raid [--buildings N] [--troops N] [--runs N]
+    python -m app.cli benchmark-war-matchmaking [--clans N]
+    python -m app.cli check-queries [--workouts N]
+"""
+import argparse
+import asyncio
+import time
+
+from app.db.session import Base, engine, AsyncSessionLocal
+from app.db.search import ensure_search_index
+from app.db.migrate import schema_drift, upgrade_schema
+
+
+async def rebuild_ledger(args: argparse.Namespace):
+    """Backfill / rebuild the per-user muscle volume ledger from workout history."""
+    from app.engines.volume import MuscleVolumeLedger
+
+    async with AsyncSessionLocal() as db:
+        started = time.perf_counter()
+        rows = await MuscleVolumeLedger.rebuild(db, user_id=args.user_id)
+        elapsed = time.perf_counter() - started
+        scope = f"user {args.user_id}" if args.user_id else "all users"
+        print(f"✅ Rebuilt muscle volume ledger for {scope}: {rows} rows in {elapsed:.2f}s")
+
+
+async def run_job(args: argparse.Namespace):
+    """Run one background job (see app/jobs.py) immediately."""
+    from app.core.tasks import task_runner
+    from app.jobs import register_jobs
+
+    register_jobs()
+    if args.job not in task_runner.tasks:
+        raise SystemExit(f"Unknown job '{args.job}' (available: {', '.join(task_runner.tasks)})")
+    task = task_runner.tasks[args.job]
+    result = await task.run_once()
+    print(f"✅ {args.job}: {result} in {task.last_seconds:.2f}s")
+
+
+async def rebuild_search_index(args: argparse.Namespace):
+    """Refill the clan full-text index from the clans table (e.g. after VACUUM)."""
+    from app.db.search import rebuild_search_index as rebuild
+
+    started = time.perf_counter()
+    rebuild(engine)
+    print(f"✅ Rebuilt clan search index in {time.perf_counter() - started:.2f}s")
+
+
+async def upgrade_schema_command(args: argparse.Namespace):
+    """Bring an existing database up to the models, or (--check) only report the differences."""
+    if args.check:
+        drift = schema_drift(engine)
+        for difference in drift:
+            print(f"⚠️ {difference}")
+        if drift:
+            raise SystemExit(f"Schema differs from the models ({len(drift)} changes), run upgrade-schema")
+        print("✅ Schema matches the models")
+        return
+
+    Base.metadata.create_all(bind=engine)
+    applied = upgrade_schema(engine)
+    ensure_search_index(engine)
+    if schema_drift(engine):
+        raise SystemExit("Schema still differs from the models (see warnings above)")
+    print(f"✅ Schema up to date ({len(applied)} changes applied)")
+
+
+async def benchmark_raid(args: argparse.Namespace):
+    """Time the battle simulator on a synthetic base (no database access)."""
+    import math
+    import random
+    import statistics
+
+    from app.core.enums import BuildingType
+    from app.models.game import Building
+    from app.engines.battle import BattleSimulator, DEFENSE_BUILDINGS, TROOP_STATS
+
+    rng = random.Random(args.seed)
+    types = list(BuildingType)
+    defenses = sorted(DEFENSE_BUILDINGS, key=lambda t: t.value)
+    side = math.ceil(math.sqrt(args.buildings))
+
+    # Square grid, 3 tiles apart; every third building is a defense
+    buildings = [
+        Building(
+            id=f"b{i:05d}",
+            building_type=defenses[i // 3 % len(defenses)] if i % 3 == 0 else types[i % len(types)],
+            position_x=(i % side) * 3,
+            position_y=(i // side) * 3,
+            health=rng.randint(200, 800),
+            max_health=rng.randint(200, 800),
+            damage_per_second=rng.uniform(8, 30),
+            range_tiles=rng.uniform(4, 9)
+        )
+        for i in range(args.buildings)
+    ]
+    # Troops land on the four edges of the base, 4 tiles out, over 20 seconds
+    low, high = -4.0, (side - 1) * 3 + 5.0
+    troop_types = sorted(TROOP_STATS)
+    deployments = []
+    for i in range(args.troops):
+        along, edge = rng.uniform(low, high), rng.choice((low, high))
+        x, y = (along, edge) if i % 2 else (edge, along)
+        deployments.append({
+            "troop": troop_types[i % len(troop_types)],
+            "x": x,
+            "y": y,
+            "at": round(rng.uniform(0, 20), 1),
+        })
+    deployments = BattleSimulator.validate_deployments(buildings, deployments)
+
+    timings = []
+    results = []
+    for _ in range(args.runs):
+        started = time.perf_counter()
+        results.append(BattleSimulator(buildings, deployments, args.attack_power, args.defense_power).run())
+        timings.append(time.perf_counter() - started)
+
+    result = results[0]
+    deterministic = all(r["events"] == result["events"] for r in results)
+    timings.sort()
+    print(
+        f"⚔️ {args.buildings} buildings vs {args.troops} troops, {args.runs} runs: "
+        f"median {statistics.median(timings) * 1000:.1f} ms, "
+        f"p95 {timings[max(0, math.ceil(len(timings) * 0.95) - 1)] * 1000:.1f} ms, "
+        f"{result['ticks'] / statistics.median(timings):.0f} ticks/s"
+    )
+    print(
+        f"   {result['stars']} stars, {result['destruction_percent']}% destruction, "
+        f"{result['duration_seconds']}s battle ({result['reason']}), {result['ticks']} ticks, "
+        f"{result['troops_lost']} troops lost, {len(result['events'])} events, "
+        f"deterministic: {deterministic}"
+    )
+
+
+async def benchmark_war_matchmaking(args: argparse.Namespace):
+    """Time one war_matchmaking pass over a synthetic queue (temporary SQLite database)."""
+    import random
+    import tempfile
+    from datetime import datetime, timedelta
+
+    from sqlalchemy import func, select
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    from app.core.enums import WarState
+    from app.engines.clan import ClanWarEngine
+    from app.models.clan import Clan, ClanWar
+
+    rng = random.Random(args.seed)
+    now = datetime.utcnow()
+
+    with tempfile.TemporaryDirectory() as directory:
+        bench_engine = create_async_engine(f"sqlite+aiosqlite:///{directory}/matchmaking.db")
+        async with bench_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        BenchSession = async_sessionmaker(bench_engine, expire_on_commit=False)
+
+        # Every clan queued, attack power log-normal, waiting up to --max-wait minutes
+        async with BenchSession() as db:
+            for i in range(args.clans):
+                power = round(rng.lognormvariate(9.0, 1.0), 1)
+                db.add(Clan(id=f"c{i:06d}", name=f"Bench Clan {i}", tag=f"#B{i:06d}", total_attack_power=power))
+                db.add(ClanWar(
+                    clan_id=f"c{i:06d}",
+                    state=WarState.MATCHMAKING,
+                    search_power=power,
+                    preparation_start=now - timedelta(minutes=rng.uniform(0, args.max_wait))
+                ))
+            await db.commit()
+
+        async with BenchSession() as db:
+            started = time.perf_counter()
+            result = await ClanWarEngine(db).match_queue(now)
+            elapsed = time.perf_counter() - started
+
+            host = Clan.__table__.alias("host")
+            guest = Clan.__table__.alias("guest")
+            wars = (await db.execute(
+                select(ClanWar.clan_id, ClanWar.opponent_clan_id, host.c.total_attack_power, guest.c.total_attack_power)
+                .join(host, host.c.id == ClanWar.clan_id)
+                .join(guest, guest.c.id == ClanWar.opponent_clan_id)
+                .where(ClanWar.state == WarState.PREPARATION)
+            )).all()
+            waiting = await db.scalar(
+                select(func.count(ClanWar.id)).where(ClanWar.state == WarState.MATCHMAKING)
+            )
+        await bench_engine.dispose()
+
+    clans_at_war = [clan_id for war in wars for clan_id in war[:2]]
+    max_gap = max((abs(a - b) / max(a, b) for _, _, a, b in wars), default=0.0)
+    print(
+        f"⚔️ {args.clans} queued clans: {result['matched']} wars in {elapsed:.2f}s "
+        f"({args.clans / elapsed:.0f} clans/s), {waiting} still waiting"
+    )
+    print(
+        f"   each clan in at most one war: {len(clans_at_war) == len(set(clans_at_war))}, "
+        f"largest relative power gap {max_gap:.3f}"
+    )
+
+
+# Statements GET /fitness/stats may issue, whatever the training history
+# (daily GROUP BY + muscle volume ledger; the auth lookup is not counted)
+STATS_MAX_STATEMENTS = 2
+
+
+async def check_queries(args: argparse.Namespace):
+    """Count the SQL statements of GET /fitness/stats for a new and a long-trained user (temporary SQLite database)."""
+    import tempfile
+    from datetime import date, timedelta
+
+    from sqlalchemy import event
+    from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+    from app.api.api_v1.endpoints.fitness import get_fitness_stats
+    from app.core.enums import ExerciseCategory, MuscleGroup
+    from app.engines.volume import MuscleVolumeLedger
+    from app.models.fitness import Exercise, WorkoutLog, WorkoutSet
+    from app.models.user import User
+
+    today = date.today()
+
+    with tempfile.TemporaryDirectory() as directory:
+        check_engine = create_async_engine(f"sqlite+aiosqlite:///{directory}/queries.db")
+        async with check_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        CheckSession = async_sessionmaker(check_engine, expire_on_commit=False)
+
+        # One user with a single workout, one with --workouts daily workouts over every muscle group
+        async with CheckSession() as db:
+            exercises = [
+                Exercise(name=f"Check {muscle.value}", primary_muscle=muscle, category=ExerciseCategory.STRENGTH)
+                for muscle in MuscleGroup
+            ]
+            users = [
+                User(email=f"{name}@check.local", username=f"check_{name}", hashed_password="-")
+                for name in ("new", "trained")
+            ]
+            db.add_all(exercises + users)
+            await db.flush()
+
+            for user, workouts in zip(users, (1, args.workouts)):
+                for day in range(workouts):
+                    log = WorkoutLog(user_id=user.id, date=today - timedelta(days=day))
+                    db.add(log)
+                    await db.flush()
+                    db.add_all(
+                        WorkoutSet(
+                            workout_log_id=log.id, exercise_id=exercise.id,
+                            set_number=1, reps=10, weight_kg=50.0, volume=500.0
+                        )
+                        for exercise in exercises
+                    )
+            await db.commit()
+            await MuscleVolumeLedger.rebuild(db)
+
+        statements = []
+        event.listen(check_engine.sync_engine, "before_cursor_execute", lambda *_: statements.append(1))
+
+        counts = {}
+        for user in users:
+            async with CheckSession() as db:
+                statements.clear()
+                stats = await get_fitness_stats(db=db, current_user=user)
+                counts[user.username] = (len(statements), stats.total_workouts)
+        await check_engine.dispose()
+
+    for username, (count, workouts) in counts.items():
+        print(f"   GET /fitness/stats for {username} ({workouts} workouts): {count} statements")
+
+    worst = max(count for count, _ in counts.values())
+    if len({count for count, _ in counts.values()}) > 1 or worst > STATS_MAX_STATEMENTS:
+        raise SystemExit(
+            f"GET /fitness/stats issues more statements than expected "
+            f"(at most {STATS_MAX_STATEMENTS}, independent of history)"
+        )
+    print(f"✅ GET /fitness/stats runs in {worst} statements")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m app.cli", description="Bio-Clash management commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    ledger_parser = subparsers.add_parser(
+        "rebuild-ledger", help="Recompute user_muscle_volume from WorkoutSet history"
+    )
+    ledger_parser.add_argument("--user-id", default=None, help="Only rebuild this user")
+    ledger_parser.set_defaults(func=rebuild_ledger)
+
+    job_parser = subparsers.add_parser("run-job", help="Run a background job once")
+    job_parser.add_argument("job", help="Job name, e.g. resource_tick")
+    job_parser.set_defaults(func=run_job)
+
+    search_parser = subparsers.add_parser(
+        "rebuild-search-index", help="Refill the clan full-text search index"
+    )
+    search_parser.set_defaults(func=rebuild_search_index)
+
+    schema_parser = subparsers.add_parser(
+        "upgrade-schema", help="Add new columns/indexes to an existing database"
+    )
+    schema_parser.add_argument(
+        "--check", action="store_true", help="Only report differences from the models (exit 1 if any)"
+    )
+    schema_parser.set_defaults(func=upgrade_schema_command, prepare=False)
+
+    bench_parser = subparsers.add_parser("benchmark-raid", help="Time the raid battle simulator")
+    bench_parser.add_argument("--buildings", type=int, default=120)
+    bench_parser.add_argument("--troops", type=int, default=250)
+    bench_parser.add_argument("--runs", type=int, default=20)
+    bench_parser.add_argument("--attack-power", type=float, default=20000.0)
+    bench_parser.add_argument("--defense-power", type=float, default=20000.0)
+    bench_parser.add_argument("--seed", type=int, default=7)
+    bench_parser.set_defaults(func=benchmark_raid)
+
+    war_bench_parser = subparsers.add_parser(
+        "benchmark-war-matchmaking", help="Time the war matchmaking job on a synthetic queue"
+    )
+    war_bench_parser.add_argument("--clans", type=int, default=10000)
+    war_bench_parser.add_argument("--max-wait", type=float, default=10.0, help="Minutes queued, at most")
+    war_bench_parser.add_argument("--seed", type=int, default=7)
+    war_bench_parser.set_defaults(func=benchmark_war_matchmaking, prepare=False)
+
+    queries_parser = subparsers.add_parser(
+        "check-queries", help="Check that GET /fitness/stats runs a fixed number of statements"
+    )
+    queries_parser.add_argument("--workouts", type=int, default=200, help="Workouts of the long-trained user")
+    queries_parser.set_defaults(func=check_queries, prepare=False)
+
+    args = parser.parse_args(argv)
+
+    # Make sure newly added tables and columns exist before running a command
+    if getattr(args, "prepare", True):
+        Base.metadata.create_all(bind=engine)
+        upgrade_schema(engine)
+        ensure_search_index(engine)
+
+    asyncio.run(args.func(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+"""
+Authenticated User Cache
+Bounded TTL/LRU cache of access token -> User column snapshot.
+
+get_current_user() consults it before decoding the JWT and loading the
+caller's row. Cached snapshots are re-attached to the request's session
+as persistent objects, so endpoints can still modify and commit them.
+A snapshot can miss up to ttl_seconds of other workers' commits, so
+endpoints must not read-modify-write its columns: assign a SQL
+expression instead (e.g. User.raised_consistency()), which the UPDATE
+evaluates against the stored row.
+
+Invalidation: any committed ORM insert/update/delete of a User drops that
+user's entries. Bulk UPDATE statements bypass the ORM and must call
+user_cache.clear() (or invalidate()) themselves.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Set
+
+from jose import jwt
+from sqlalchemy import inspect
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
+
+from app.core.config import settings
+from app.core.invalidation import on_commit
+from app.models.user import User
+
+
+class UserCache:
+    """
+    LRU of token -> (user_id, column snapshot, expires_at).
+
+    Entries expire after ttl_seconds or when the token itself expires,
+    whichever comes first.
+    """
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._tokens_by_user: Dict[str, Set[str]] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    def get(self, token: str, db: AsyncSession) -> Optional[User]:
+        """
+        Return a User for a cached token, attached to `db` without a query.
+        Returns None on a miss.
+        """
+        if not self.enabled:
+            return None
+
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            user_id, snapshot, expires_at = entry
+            if expires_at <= now:
+                self._remove(token)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(token)
+            self.hits += 1
+
+        # The request may already hold this user (e.g. loaded by another dependency)
+        user = db.identity_map.get(inspect(User).identity_key_from_primary_key((user_id,)))
+        if user is not None:
+            return user
+
+        user = User(**snapshot)
+        make_transient_to_detached(user)
+        db.add(user)
+        return user
+
+    def put(self, token: str, user: User):
+        """Cache a freshly loaded user for this token."""
+        if not self.enabled:
+            return
+
+        expires_at = time.monotonic() + self.ttl_seconds
+        token_exp = jwt.get_unverified_claims(token).get("exp")
+        if token_exp is not None:
+            expires_at = min(expires_at, time.monotonic() + (token_exp - time.time()))
+
+        snapshot = {
+            attr.key: getattr(user, attr.key)
+            for attr in inspect(User).column_attrs
+        }
+
+        with self._lock:
+            self._remove(token)
+            self._entries[token] = (user.id, snapshot, expires_at)
+            self._tokens_by_user.setdefault(user.id, set()).add(token)
+
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, user_id: str):
+        """Drop every cached token of a user."""
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+            self.invalidations += 1
+
+    def clear(self):
+        """Drop everything (after bulk updates to the users table)."""
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+            self.invalidations += 1
+
+    def _remove(self, token: str):
+        entry = self._entries.pop(token, None)
+        if entry is None:
+            return
+        tokens = self._tokens_by_user.get(entry[0])
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[entry[0]]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+# Global authenticated user cache
+user_cache = UserCache(
+    max_entries=settings.AUTH_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.AUTH_CACHE_TTL_SECONDS
+)
+
+
+# ============================================================
+# INVALIDATION
+# Committed changes to a User row drop that user's snapshots.
+# ============================================================
+
+def _changed_user(session, obj):
+    return (obj.id,) if isinstance(obj, User) else ()
+
+
+def _invalidate_users(user_ids):
+    for user_id in user_ids:
+        user_cache.invalidate(user_id)
+
+
+on_commit("auth_cache_user_ids", _changed_user, _invalidate_users)
@@ -0,0 +1,142 @@
+"""
+Exercise Catalog
+In-process cache of the exercise library (seeded from data/exercises.json).
+
+The catalog is effectively static, so it is loaded once at startup and
+served from memory. Any committed change to an Exercise row invalidates it;
+the next caller of ensure_loaded() reloads it.
+"""
+import threading
+from dataclasses import dataclass
+from typing import Dict, Iterable, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.core.enums import MuscleGroup, ExerciseCategory
+from app.core.invalidation import on_commit
+from app.models.fitness import Exercise
+
+
+@dataclass(frozen=True)
+class CatalogExercise:
+    """Detached, read-only snapshot of an Exercise row."""
+    id: str
+    name: str
+    primary_muscle: MuscleGroup
+    secondary_muscles: Optional[str]
+    category: ExerciseCategory
+    description: Optional[str]
+    equipment_needed: Optional[str]
+    difficulty: int
+    video_url: Optional[str]
+
+
+class ExerciseCatalog:
+    """
+    Lookup tables over the exercise library.
+
+    - by_id / by_name: exercise snapshots
+    - by_muscle: exercises per MuscleGroup (sorted by name)
+    - ids_by_muscle: precomputed exercise id tuples per MuscleGroup
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self.by_id: Dict[str, CatalogExercise] = {}
+        self.by_name: Dict[str, CatalogExercise] = {}
+        self.by_muscle: Dict[MuscleGroup, Tuple[CatalogExercise, ...]] = {}
+        self.ids_by_muscle: Dict[MuscleGroup, Tuple[str, ...]] = {}
+        self._all: Tuple[CatalogExercise, ...] = ()
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._loaded
+
+    def load(self, db: Session) -> "ExerciseCatalog":
+        """
+        (Re)load the whole catalog with a single query.
+        Takes a sync Session; async callers go through ensure_loaded().
+        """
+        exercises = tuple(
+            CatalogExercise(
+                id=e.id,
+                name=e.name,
+                primary_muscle=e.primary_muscle,
+                secondary_muscles=e.secondary_muscles,
+                category=e.category,
+                description=e.description,
+                equipment_needed=e.equipment_needed,
+                difficulty=e.difficulty,
+                video_url=e.video_url
+            )
+            for e in db.query(Exercise).order_by(Exercise.name).all()
+        )
+
+        by_muscle = {
+            muscle: tuple(e for e in exercises if e.primary_muscle == muscle)
+            for muscle in MuscleGroup
+        }
+
+        with self._lock:
+            self.by_id = {e.id: e for e in exercises}
+            self.by_name = {e.name: e for e in exercises}
+            self.by_muscle = by_muscle
+            self.ids_by_muscle = {
+                muscle: tuple(e.id for e in group) for muscle, group in by_muscle.items()
+            }
+            self._all = exercises
+            self._loaded = True
+
+        return self
+
+    def invalidate(self):
+        """Drop the cached catalog; it is reloaded on next ensure_loaded()."""
+        with self._lock:
+            self._loaded = False
+
+    async def ensure_loaded(self, db: AsyncSession) -> "ExerciseCatalog":
+        """Return the catalog, loading it first if it was invalidated."""
+        if not self._loaded:
+            await db.run_sync(self.load)
+        return self
+
+    # ============================================================
+    # LOOKUPS
+    # ============================================================
+
+    def all(self) -> Tuple[CatalogExercise, ...]:
+        """All exercises, sorted by name."""
+        return self._all
+
+    def get(self, exercise_id: str) -> Optional[CatalogExercise]:
+        return self.by_id.get(exercise_id)
+
+    def get_by_name(self, name: str) -> Optional[CatalogExercise]:
+        return self.by_name.get(name)
+
+    def exercises_for(self, muscle: MuscleGroup) -> Tuple[CatalogExercise, ...]:
+        return self.by_muscle.get(muscle, ())
+
+    def ids_for(self, muscle: MuscleGroup) -> Tuple[str, ...]:
+        return self.ids_by_muscle.get(muscle, ())
+
+    def ids_for_muscles(self, muscles: Iterable[MuscleGroup]) -> Tuple[str, ...]:
+        return tuple(exercise_id for muscle in muscles for exercise_id in self.ids_for(muscle))
+
+
+# Global exercise catalog instance
+exercise_catalog = ExerciseCatalog()
+
+
+# ============================================================
+# INVALIDATION
+# Any committed insert/update/delete of an Exercise drops the cache.
+# ============================================================
+
+def _changed_exercise(session, obj):
+    return (True,) if isinstance(obj, Exercise) else ()
+
+
+on_commit("exercise_catalog_dirty", _changed_exercise, lambda keys: exercise_catalog.invalidate())
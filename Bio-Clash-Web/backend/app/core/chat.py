@@ -0,0 +1,360 @@
+"""
+Clan Chat Persistence
+Group-commit write buffer and recent-history ring buffers for clan chat.
+
+The chat socket broadcasts a message first and then hands it to the
+ChatWriter, which appends it to an in-memory buffer. A writer task flushes
+the buffer with one multi-row INSERT per batch (CHAT_FLUSH_BATCH_SIZE rows)
+whenever a batch is full or CHAT_FLUSH_INTERVAL_MS has passed, so a busy
+room costs one transaction per flush instead of one per message.
+
+Unflushed messages are lost if the process dies; they are flushed on a
+normal shutdown. A failed flush is retried with the batch kept at the
+front of the buffer (bounded by CHAT_MAX_BACKLOG); rows rejected by the
+database (integrity errors) are dropped one by one instead of the batch.
+
+ChatHistory keeps the last CHAT_HISTORY_SIZE messages of recently viewed
+clans in memory (usernames resolved), fed by the clans' chat broadcasts.
+"""
+import asyncio
+import json
+import time
+import uuid
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, insert, or_, and_
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.websocket import manager
+from app.db.session import AsyncSessionLocal
+from app.models.clan import ClanMessage
+from app.models.user import User
+
+
+class ChatWriter:
+    """Buffers chat rows and writes them in batches."""
+
+    def __init__(self, batch_size: int, interval_ms: float, max_backlog: int):
+        self.batch_size = batch_size
+        self.interval = interval_ms / 1000
+        self.max_backlog = max_backlog
+        self._buffer: Deque[Dict[str, Any]] = deque()
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+        self.appended = 0
+        self.written = 0
+        self.flushes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.dropped = 0
+        self.max_backlog_seen = 0
+        self.total_flush_seconds = 0.0
+        self.max_flush_seconds = 0.0
+        self.last_error: Optional[str] = None
+
+    def append(
+        self, clan_id: str, user_id: str, message: str, message_type: str = "chat"
+    ) -> Dict[str, Any]:
+        """Queue a message for the next flush. Returns the row (id, created_at)."""
+        row = {
+            "id": str(uuid.uuid4()),
+            "clan_id": clan_id,
+            "user_id": user_id,
+            "message": message,
+            "message_type": message_type,
+            "created_at": datetime.utcnow(),
+        }
+
+        if len(self._buffer) >= self.max_backlog:
+            # Database unreachable for a while; keep the newest messages
+            self._buffer.popleft()
+            self.dropped += 1
+        self._buffer.append(row)
+        self.appended += 1
+        self.max_backlog_seen = max(self.max_backlog_seen, len(self._buffer))
+
+        if len(self._buffer) >= self.batch_size and self._wake is not None:
+            self._wake.set()
+        return row
+
+    # ============================================================
+    # FLUSHING
+    # ============================================================
+
+    async def flush(self) -> int:
+        """Write what is buffered when called (later rows wait for the next flush)."""
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+
+        written = 0
+        async with self._lock:
+            remaining = len(self._buffer)
+            while remaining > 0 and self._buffer:
+                batch = [self._buffer.popleft() for _ in range(min(self.batch_size, remaining, len(self._buffer)))]
+                remaining -= len(batch)
+                started = time.perf_counter()
+                try:
+                    written += await self._write(batch)
+                except Exception as e:
+                    # Retry on the next flush, oldest first
+                    self._buffer.extendleft(reversed(batch))
+                    while len(self._buffer) > self.max_backlog:
+                        self._buffer.popleft()
+                        self.dropped += 1
+                    self.failures += 1
+                    self.last_error = str(e)
+                    print(f"❌ Chat flush failed ({len(self._buffer)} buffered): {e}")
+                    break
+
+                elapsed = time.perf_counter() - started
+                self.flushes += 1
+                self.total_flush_seconds += elapsed
+                self.max_flush_seconds = max(self.max_flush_seconds, elapsed)
+                self.last_error = None
+
+        self.written += written
+        return written
+
+    async def _write(self, batch: List[Dict[str, Any]]) -> int:
+        """One multi-row INSERT; falls back to row-by-row if a row is rejected."""
+        async with AsyncSessionLocal() as db:
+            try:
+                await db.execute(insert(ClanMessage.__table__).values(batch))
+                await db.commit()
+                return len(batch)
+            except IntegrityError:
+                await db.rollback()
+
+            written = 0
+            for row in batch:
+                try:
+                    await db.execute(insert(ClanMessage.__table__).values(row))
+                    await db.commit()
+                    written += 1
+                except IntegrityError:
+                    await db.rollback()
+                    self.rejected += 1
+            return written
+
+    # ============================================================
+    # LOOP
+    # ============================================================
+
+    def start(self):
+        if self._task is None:
+            self._wake = asyncio.Event()
+            self._lock = asyncio.Lock()
+            self._task = asyncio.create_task(self._loop(), name="chat_writer")
+
+    async def stop(self):
+        """Stop the writer task and flush what is left (shutdown)."""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+            self._wake = None
+        written = await self.flush()
+        if written:
+            print(f"💬 Flushed {written} buffered chat messages")
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "backlog": len(self._buffer),
+            "max_backlog": self.max_backlog_seen,
+            "appended": self.appended,
+            "written": self.written,
+            "flushes": self.flushes,
+            "avg_rows_per_flush": round(self.written / self.flushes, 2) if self.flushes else 0.0,
+            "avg_flush_ms": round(self.total_flush_seconds / self.flushes * 1000, 3) if self.flushes else 0.0,
+            "max_flush_ms": round(self.max_flush_seconds * 1000, 3),
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+            "last_error": self.last_error,
+        }
+
+
+# ============================================================
+# RECENT HISTORY
+# ============================================================
+
+ChatKey = Tuple[datetime, str]  # (created_at, id): history order and keyset cursor
+
+
+def _key(entry: Dict[str, Any]) -> ChatKey:
+    return entry["created_at"], entry["id"]
+
+
+class _Ring:
+    def __init__(self, size: int):
+        self.messages: Deque[Dict[str, Any]] = deque(maxlen=size)
+        self.loading = True
+        self.exhaustive = False  # Holds the clan's whole history
+
+    def add(self, entry: Dict[str, Any]):
+        if len(self.messages) == self.messages.maxlen:
+            self.exhaustive = False
+        if self.messages and _key(entry) < _key(self.messages[-1]):
+            # Out of order (another worker's clock); rare, keep the ring sorted
+            merged = sorted([*self.messages, entry], key=_key)
+            self.messages.clear()
+            self.messages.extend(merged)
+        else:
+            self.messages.append(entry)
+
+
+class ChatHistory:
+    """
+    LRU of clan_id -> ring of the newest messages, oldest first.
+
+    A clan's ring is loaded by its first history request (after flushing
+    this worker's chat buffer) and then kept current from the clan's chat
+    broadcasts, which every worker receives through the pub/sub broker.
+    Pages the ring cannot answer are read with one joined keyset query on
+    (clan_id, created_at, id).
+    """
+
+    def __init__(self, size: int, max_clans: int):
+        self.size = size
+        self.max_clans = max_clans
+        self._rings: "OrderedDict[str, _Ring]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.loads = 0
+        self.evictions = 0
+
+    async def page(
+        self, db: AsyncSession, clan_id: str, limit: int, before: Optional[ChatKey] = None
+    ) -> List[Dict[str, Any]]:
+        """Up to `limit` messages older than `before` (newest page if None), oldest first."""
+        ring = self._rings.get(clan_id)
+        if ring is None and self.size > 0:
+            ring = await self._load(db, clan_id)
+
+        if ring is not None and not ring.loading:
+            self._rings.move_to_end(clan_id)
+            entries = [e for e in ring.messages if before is None or _key(e) < before]
+            if len(entries) >= limit or ring.exhaustive:
+                self.hits += 1
+                return entries[-limit:] if limit else []
+
+        self.misses += 1
+        return await self._query(db, clan_id, limit, before)
+
+    async def _query(
+        self, db: AsyncSession, clan_id: str, limit: int, before: Optional[ChatKey]
+    ) -> List[Dict[str, Any]]:
+        """One joined query (message + username), newest first, returned oldest first."""
+        query = (
+            select(ClanMessage, User.username)
+            .outerjoin(User, User.id == ClanMessage.user_id)
+            .where(ClanMessage.clan_id == clan_id)
+            .order_by(ClanMessage.created_at.desc(), ClanMessage.id.desc())
+            .limit(limit)
+        )
+        if before is not None:
+            created_at, message_id = before
+            query = query.where(or_(
+                ClanMessage.created_at < created_at,
+                and_(ClanMessage.created_at == created_at, ClanMessage.id < message_id)
+            ))
+
+        rows = (await db.execute(query)).all()
+        return [
+            {
+                "id": message.id,
+                "user_id": message.user_id,
+                "username": username or "Unknown",
+                "message": message.message,
+                "message_type": message.message_type,
+                "created_at": message.created_at,
+            }
+            for message, username in reversed(rows)
+        ]
+
+    async def _load(self, db: AsyncSession, clan_id: str) -> _Ring:
+        # Registered first so broadcasts arriving during the query are kept
+        ring = _Ring(self.size)
+        self._rings[clan_id] = ring
+        while len(self._rings) > self.max_clans:
+            self._rings.popitem(last=False)
+            self.evictions += 1
+
+        try:
+            await chat_writer.flush()
+            rows = await self._query(db, clan_id, self.size, None)
+        except Exception:
+            self._rings.pop(clan_id, None)
+            raise
+
+        seen = {row["id"] for row in rows}
+        merged = sorted([*rows, *(e for e in ring.messages if e["id"] not in seen)], key=_key)
+        ring.messages.clear()
+        ring.messages.extend(merged)
+        ring.exhaustive = len(rows) < self.size
+        ring.loading = False
+        self.loads += 1
+        return ring
+
+    def on_clan_broadcast(self, clan_id: str, payloads: List[str]):
+        """ConnectionManager listener: append chat broadcasts to a loaded ring."""
+        ring = self._rings.get(clan_id)
+        if ring is None:
+            return
+
+        for payload in payloads:
+            if not payload.startswith('{"type":"chat"'):
+                continue
+            message = json.loads(payload)
+            if "id" not in message:
+                continue
+            ring.add({
+                "id": message["id"],
+                "user_id": message.get("user_id") or "anonymous",
+                "username": message.get("username") or "Unknown",
+                "message": message.get("message") or "",
+                "message_type": "chat",
+                "created_at": datetime.fromisoformat(message["timestamp"]),
+            })
+
+    def invalidate(self, clan_id: str):
+        self._rings.pop(clan_id, None)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            "clans": len(self._rings),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
+
+
+# Global chat write buffer
+chat_writer = ChatWriter(
+    batch_size=settings.CHAT_FLUSH_BATCH_SIZE,
+    interval_ms=settings.CHAT_FLUSH_INTERVAL_MS,
+    max_backlog=settings.CHAT_MAX_BACKLOG
+)
+
+# Global recent-history cache
+chat_history = ChatHistory(size=settings.CHAT_HISTORY_SIZE, max_clans=settings.CHAT_HISTORY_MAX_CLANS)
+manager.add_listener("clan", chat_history.on_clan_broadcast)
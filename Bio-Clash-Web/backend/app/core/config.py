@@ -13,22 +13,78 @@ class Settings:
     
     # Database
     DATABASE_URL: str = os.getenv("DATABASE_URL", "sqlite:///./bioclash.db")
+    # Async driver URL for the API; derived from DATABASE_URL when empty
+    ASYNC_DATABASE_URL: str = os.getenv("ASYNC_DATABASE_URL", "")
+    
+    # Connection profile (app/db/profile.py)
+    SQLITE_JOURNAL_MODE: str = os.getenv("SQLITE_JOURNAL_MODE", "WAL")
+    SQLITE_SYNCHRONOUS: str = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+    SQLITE_BUSY_TIMEOUT_MS: int = int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+    SQLITE_MMAP_SIZE: int = int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024)))
+    SQLITE_CACHE_SIZE: int = int(os.getenv("SQLITE_CACHE_SIZE", "-65536"))  # Negative = KiB (64 MB)
+    DB_POOL_SIZE: int = int(os.getenv("DB_POOL_SIZE", "5"))
+    DB_MAX_OVERFLOW: int = int(os.getenv("DB_MAX_OVERFLOW", "10"))
+    DB_POOL_TIMEOUT: int = int(os.getenv("DB_POOL_TIMEOUT", "30"))  # Seconds to wait for a checkout
+    DB_POOL_RECYCLE: int = int(os.getenv("DB_POOL_RECYCLE", "1800"))  # Seconds before reconnecting
+    DB_POOL_PRE_PING: bool = os.getenv("DB_POOL_PRE_PING", "False").lower() == "true"
     
     # Security
     SECRET_KEY: str = os.getenv("SECRET_KEY", "bio-clash-super-secret-key-change-in-production")
     ALGORITHM: str = "HS256"
     ACCESS_TOKEN_EXPIRE_MINUTES: int = 60 * 24 * 7  # 7 days
+    AUTH_CACHE_TTL_SECONDS: int = int(os.getenv("AUTH_CACHE_TTL_SECONDS", "60"))  # 0 disables the cache
+    AUTH_CACHE_MAX_ENTRIES: int = int(os.getenv("AUTH_CACHE_MAX_ENTRIES", "10000"))
     
     # FairPlay Engine Thresholds
     FATIGUE_SHIELD_THRESHOLD: int = 30  # Recovery % below this triggers forced shield
     FATIGUE_BOOST_THRESHOLD: int = 80   # Recovery % above this gives builder boost
+    RECOVERY_CACHE_MAX_ENTRIES: int = int(os.getenv("RECOVERY_CACHE_MAX_ENTRIES", "10000"))  # 0 disables the memo
+    FATIGUE_SCORING_INTERVAL_SECONDS: int = int(os.getenv("FATIGUE_SCORING_INTERVAL_SECONDS", "3600"))  # Batch recovery scoring job
+    
+    # WebSocket fan-out (app/core/websocket.py)
+    WS_SEND_QUEUE_SIZE: int = int(os.getenv("WS_SEND_QUEUE_SIZE", "256"))  # Outbound messages buffered per connection
+    WS_SLOW_CONSUMER_POLICY: str = os.getenv("WS_SLOW_CONSUMER_POLICY", "disconnect")  # disconnect | drop
+    WS_LATENCY_SAMPLES: int = int(os.getenv("WS_LATENCY_SAMPLES", "1024"))  # Per room
+    WS_STATS_MAX_ROOMS: int = int(os.getenv("WS_STATS_MAX_ROOMS", "20"))  # Slowest rooms listed in /metrics
+    
+    # Cross-worker room pub/sub (app/core/pubsub.py)
+    PUBSUB_BACKEND: str = os.getenv("PUBSUB_BACKEND", "memory")  # memory | redis
+    PUBSUB_URL: str = os.getenv("PUBSUB_URL", "redis://localhost:6379")  # or unix:///path/to/redis.sock
+    PUBSUB_CHANNEL_PREFIX: str = os.getenv("PUBSUB_CHANNEL_PREFIX", "bioclash:")
+    PUBSUB_LINGER_MS: float = float(os.getenv("PUBSUB_LINGER_MS", "0"))  # Extra wait to grow publish batches
+    PUBSUB_MAX_BATCH: int = int(os.getenv("PUBSUB_MAX_BATCH", "1000"))  # Messages per pipelined write
+    PUBSUB_MAX_PENDING: int = int(os.getenv("PUBSUB_MAX_PENDING", "10000"))  # Oldest dropped beyond this
+    
+    # Clan chat write buffer (app/core/chat.py)
+    CHAT_FLUSH_BATCH_SIZE: int = int(os.getenv("CHAT_FLUSH_BATCH_SIZE", "500"))  # Rows per multi-row INSERT
+    CHAT_FLUSH_INTERVAL_MS: float = float(os.getenv("CHAT_FLUSH_INTERVAL_MS", "200"))  # Max time a message waits unwritten
+    CHAT_MAX_BACKLOG: int = int(os.getenv("CHAT_MAX_BACKLOG", "50000"))  # Oldest dropped beyond this while the DB is failing
+    CHAT_HISTORY_SIZE: int = int(os.getenv("CHAT_HISTORY_SIZE", "200"))  # Recent messages kept per clan; 0 disables
+    CHAT_HISTORY_MAX_CLANS: int = int(os.getenv("CHAT_HISTORY_MAX_CLANS", "1000"))
+    
+    # Clan roster snapshots (app/core/roster.py)
+    ROSTER_CACHE_MAX_CLANS: int = int(os.getenv("ROSTER_CACHE_MAX_CLANS", "1000"))  # 0 disables the cache
+    ROSTER_CACHE_TTL_SECONDS: int = int(os.getenv("ROSTER_CACHE_TTL_SECONDS", "60"))  # Bounds staleness across workers
     
     # Game Constants
     BUILDER_COUNT_DEFAULT: int = 2
     SHIELD_DURATION_HOURS: int = 8
-    RESOURCE_SYNC_INTERVAL_SECONDS: int = 60
+    RAID_COOLDOWN_SECONDS: int = int(os.getenv("RAID_COOLDOWN_SECONDS", "60"))  # Between two raids of one attacker
+    RESOURCE_SYNC_INTERVAL_SECONDS: int = int(os.getenv("RESOURCE_SYNC_INTERVAL_SECONDS", "60"))  # Resource tick job
+    
+    # Background jobs (app/jobs.py); disable on all but one worker
+    BACKGROUND_JOBS_ENABLED: bool = os.getenv("BACKGROUND_JOBS_ENABLED", "True").lower() == "true"
+    WAR_LIFECYCLE_INTERVAL_SECONDS: int = int(os.getenv("WAR_LIFECYCLE_INTERVAL_SECONDS", "60"))
+    WAR_MATCHMAKING_INTERVAL_SECONDS: int = int(os.getenv("WAR_MATCHMAKING_INTERVAL_SECONDS", "30"))
+    CLAN_POWER_RECONCILE_INTERVAL_SECONDS: int = int(os.getenv("CLAN_POWER_RECONCILE_INTERVAL_SECONDS", "3600"))
+    UPGRADE_BATCH_SIZE: int = int(os.getenv("UPGRADE_BATCH_SIZE", "500"))  # Upgrades completed per transaction
+    UPGRADE_RESYNC_SECONDS: int = int(os.getenv("UPGRADE_RESYNC_SECONDS", "300"))  # Heap rebuild from the DB
     
     # Clustering (Leagues)
     NUM_LEAGUES: int = 5  # Bronze, Silver, Gold, Crystal, Titan
+    OPPONENT_RECENT_TARGETS: int = int(os.getenv("OPPONENT_RECENT_TARGETS", "10"))  # Skipped by raid search
+    OPPONENT_RECENT_TARGET_SECONDS: int = int(os.getenv("OPPONENT_RECENT_TARGET_SECONDS", "3600"))
+    OPPONENT_INDEX_TTL_SECONDS: int = int(os.getenv("OPPONENT_INDEX_TTL_SECONDS", "60"))  # Full rebuild; bounds staleness across workers
+    LEAGUE_CLUSTERING_INTERVAL_SECONDS: int = int(os.getenv("LEAGUE_CLUSTERING_INTERVAL_SECONDS", "3600"))
 
 settings = Settings()
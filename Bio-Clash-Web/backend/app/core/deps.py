@@ -4,10 +4,11 @@ FastAPI dependencies for protecting routes.
 """
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.db.session import get_db
 from app.core.security import decode_access_token
+from app.core.auth_cache import user_cache
 from app.models.user import User
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
@@ -15,11 +16,13 @@ oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/api/v1/auth/login")
 
 async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> User:
     """
     Dependency to get the current authenticated user.
     Raises 401 if token is invalid or user not found.
+    
+    Repeat tokens are served from the user cache without a query.
     """
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -27,14 +30,19 @@ async def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    user = user_cache.get(token, db)
+    if user is not None:
+        return user
+    
     user_id = decode_access_token(token)
     if user_id is None:
         raise credentials_exception
     
-    user = db.query(User).filter(User.id == user_id).first()
+    user = await db.get(User, user_id)
     if user is None:
         raise credentials_exception
     
+    user_cache.put(token, user)
     return user
 
 
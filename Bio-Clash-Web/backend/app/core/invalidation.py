@@ -0,0 +1,75 @@
+"""
+Commit-Time Cache Invalidation
+One set of Session listeners shared by every in-process cache.
+
+A cache registers a CommitHook with two callables:
+
+- extract(session, obj): the keys a flushed ORM insert/update/delete of
+  `obj` affects (empty for objects the cache does not care about).
+- apply(keys): drop those keys from the cache.
+
+Keys are collected in session.info on after_flush, applied once on
+after_commit and discarded on after_rollback, so a cache only ever sees
+committed changes. Core statements that bypass the ORM flush add their
+keys with hook.add(session, keys).
+"""
+from typing import Any, Callable, Iterable, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class CommitHook:
+    """Pending keys of one cache, kept under session.info[name]."""
+
+    def __init__(
+        self,
+        name: str,
+        extract: Optional[Callable[[Session, Any], Iterable[Any]]],
+        apply: Callable[[set], None]
+    ):
+        self.name = name
+        self.extract = extract
+        self.apply = apply
+
+    def add(self, session: Session, keys: Iterable[Any]):
+        """Apply `keys` when `session` commits (nothing happens on rollback)."""
+        session.info.setdefault(self.name, set()).update(keys)
+
+
+_hooks: List[CommitHook] = []
+
+
+def on_commit(
+    name: str,
+    extract: Optional[Callable[[Session, Any], Iterable[Any]]],
+    apply: Callable[[set], None]
+) -> CommitHook:
+    """Register a cache's key extractor and invalidation callback."""
+    hook = CommitHook(name, extract, apply)
+    _hooks.append(hook)
+    return hook
+
+
+@event.listens_for(Session, "after_flush")
+def _collect_keys(session, flush_context):
+    extracting = [hook for hook in _hooks if hook.extract is not None]
+    for obj in (*session.new, *session.dirty, *session.deleted):
+        for hook in extracting:
+            keys = hook.extract(session, obj)
+            if keys:
+                hook.add(session, keys)
+
+
+@event.listens_for(Session, "after_commit")
+def _apply_keys(session):
+    for hook in _hooks:
+        keys = session.info.pop(hook.name, None)
+        if keys:
+            hook.apply(keys)
+
+
+@event.listens_for(Session, "after_rollback")
+def _discard_keys(session):
+    for hook in _hooks:
+        session.info.pop(hook.name, None)
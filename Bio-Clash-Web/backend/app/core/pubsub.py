@@ -0,0 +1,332 @@
+"""
+Room Pub/Sub
+Carries clan, war and user messages between API workers.
+
+The ConnectionManager publishes every broadcast to a broker channel
+("clan:<id>", "war:<id>", "user:<id>"); each worker delivers what it
+receives to its own sockets. "upgrade:<id>" carries new upgrade timers
+to the upgrade scheduler (app/core/scheduler.py). Backends (PUBSUB_BACKEND):
+
+- memory: single process; publish() delivers straight to the local handler.
+- redis:  Redis protocol (RESP) over asyncio streams, TCP or a unix socket.
+          Local sockets are served immediately; messages published in the
+          same loop tick are batched per channel into one PUBLISH and the
+          batch is pipelined in a single write. Every worker PSUBSCRIBEs to
+          the channel prefix and skips its own messages.
+
+Delivery is best effort, like the sockets themselves: messages published
+while the broker is unreachable are dropped and the connection retried.
+"""
+import asyncio
+import time
+import uuid
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import urlparse, unquote
+
+from app.core.config import settings
+
+
+# handler(channel, payloads, exclude) -> None
+Handler = Callable[..., None]
+
+
+class Broker:
+    """Publish/subscribe interface used by the ConnectionManager."""
+
+    def __init__(self, handler: Handler):
+        self.handler = handler
+        self.published = 0
+
+    def publish(self, channel: str, payload: str, exclude: Any = None):
+        """Deliver a serialized message locally and to the other workers."""
+        raise NotImplementedError
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {"backend": self.name, "published": self.published}
+
+
+class InProcessBroker(Broker):
+    """Single-worker backend."""
+
+    name = "memory"
+
+    def publish(self, channel: str, payload: str, exclude: Any = None):
+        self.published += 1
+        self.handler(channel, [payload], exclude)
+
+
+class BrokerError(Exception):
+    """Error reply from the Redis server."""
+
+
+def encode_command(*args: str) -> bytes:
+    """RESP array of bulk strings."""
+    parts = [b"*%d\r\n" % len(args)]
+    for arg in args:
+        data = arg.encode()
+        parts.append(b"$%d\r\n%s\r\n" % (len(data), data))
+    return b"".join(parts)
+
+
+async def read_reply(reader: asyncio.StreamReader) -> Any:
+    """Read one RESP reply (error replies are returned as BrokerError)."""
+    line = await reader.readuntil(b"\r\n")
+    kind, rest = line[:1], line[1:-2]
+    if kind == b"+":
+        return rest.decode()
+    if kind == b"-":
+        return BrokerError(rest.decode())
+    if kind == b":":
+        return int(rest)
+    if kind == b"$":
+        length = int(rest)
+        if length < 0:
+            return None
+        return (await reader.readexactly(length + 2))[:-2]
+    if kind == b"*":
+        length = int(rest)
+        if length < 0:
+            return None
+        return [await read_reply(reader) for _ in range(length)]
+    raise BrokerError(f"Unexpected reply {line!r}")
+
+
+class RedisBroker(Broker):
+    """Cross-worker backend speaking RESP (Redis or any compatible server)."""
+
+    name = "redis"
+    RECONNECT_SECONDS = (0.5, 1, 2, 5)
+
+    def __init__(
+        self, handler: Handler, url: str, prefix: str,
+        linger_ms: float = 0, max_batch: int = 1000, max_pending: int = 10000
+    ):
+        super().__init__(handler)
+        self.url = url
+        self.prefix = prefix
+        self.linger = linger_ms / 1000
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.origin = uuid.uuid4().hex[:12]
+
+        self._pending: Deque[Tuple[str, str]] = deque()
+        self._in_flight = 0
+        self._wake: Optional[asyncio.Event] = None
+        self._tasks: List[asyncio.Task] = []
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._reader: Optional[asyncio.StreamReader] = None
+
+        self.batches = 0
+        self.batched = 0
+        self.commands = 0
+        self.received = 0
+        self.dropped = 0
+        self.errors = 0
+        self.subscribed = False
+        self.max_flush_seconds = 0.0
+        self.last_error: Optional[str] = None
+
+    # ============================================================
+    # CONNECTION
+    # ============================================================
+
+    async def _connect(self) -> Tuple[asyncio.StreamReader, asyncio.StreamWriter]:
+        """Open a connection for redis://[:password@]host[:port] or unix:///path."""
+        parsed = urlparse(self.url)
+        if parsed.scheme == "unix":
+            reader, writer = await asyncio.open_unix_connection(parsed.path)
+        else:
+            reader, writer = await asyncio.open_connection(parsed.hostname or "localhost", parsed.port or 6379)
+
+        if parsed.password:
+            writer.write(encode_command("AUTH", unquote(parsed.password)))
+            await writer.drain()
+            reply = await read_reply(reader)
+            if isinstance(reply, BrokerError):
+                writer.close()
+                raise reply
+        return reader, writer
+
+    def _display_url(self) -> str:
+        parsed = urlparse(self.url)
+        return parsed.path if parsed.scheme == "unix" else f"{parsed.hostname}:{parsed.port or 6379}"
+
+    def _failed(self, error: Exception):
+        self.errors += 1
+        self.last_error = str(error) or type(error).__name__
+        print(f"⚠️ Pub/sub broker error: {self.last_error}")
+
+    async def start(self):
+        if not self._tasks:
+            self._wake = asyncio.Event()
+            self._tasks = [
+                asyncio.create_task(self._publish_loop(), name="pubsub_publish"),
+                asyncio.create_task(self._subscribe_loop(), name="pubsub_subscribe"),
+            ]
+
+    async def stop(self):
+        """Stop both loops, flush what is pending, then close."""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+        if self._pending and self._writer is not None:
+            try:
+                await self._flush()
+            except Exception as e:
+                self._failed(e)
+        self._close_publisher()
+        self._wake = None
+
+    def _close_publisher(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    # ============================================================
+    # PUBLISH
+    # ============================================================
+
+    def publish(self, channel: str, payload: str, exclude: Any = None):
+        self.published += 1
+        self.handler(channel, [payload], exclude)
+
+        if self._wake is None:
+            return  # Not started (CLI, tests): local delivery only
+
+        if len(self._pending) >= self.max_pending:
+            # Broker unreachable or too slow; realtime messages are disposable
+            self._pending.popleft()
+            self.dropped += 1
+        self._pending.append((channel, payload))
+        self._wake.set()
+
+    async def _publish_loop(self):
+        while True:
+            await self._wake.wait()
+            if self.linger:
+                await asyncio.sleep(self.linger)
+            self._wake.clear()
+
+            try:
+                if self._writer is None:
+                    self._reader, self._writer = await self._connect()
+                while self._pending:
+                    await self._flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failed(e)
+                self._close_publisher()
+                self.dropped += len(self._pending) + self._in_flight
+                self._pending.clear()
+                self._in_flight = 0
+                await asyncio.sleep(self.RECONNECT_SECONDS[0])
+
+    async def _flush(self):
+        """Send up to max_batch pending messages as one pipelined write."""
+        batch = [self._pending.popleft() for _ in range(min(self.max_batch, len(self._pending)))]
+        self._in_flight = len(batch)
+
+        # One PUBLISH per channel: origin line, then one message per line
+        # (serialized JSON never contains a raw newline)
+        by_channel: Dict[str, List[str]] = {}
+        for channel, payload in batch:
+            by_channel.setdefault(channel, []).append(payload)
+
+        started = time.perf_counter()
+        self._writer.write(b"".join(
+            encode_command("PUBLISH", self.prefix + channel, "\n".join([self.origin, *payloads]))
+            for channel, payloads in by_channel.items()
+        ))
+        await self._writer.drain()
+        for _ in by_channel:
+            reply = await read_reply(self._reader)
+            if isinstance(reply, BrokerError):
+                raise reply
+
+        self._in_flight = 0
+        self.batches += 1
+        self.batched += len(batch)
+        self.commands += len(by_channel)
+        self.max_flush_seconds = max(self.max_flush_seconds, time.perf_counter() - started)
+
+    # ============================================================
+    # SUBSCRIBE
+    # ============================================================
+
+    async def _subscribe_loop(self):
+        attempt = 0
+        while True:
+            writer = None
+            try:
+                reader, writer = await self._connect()
+                writer.write(encode_command("PSUBSCRIBE", self.prefix + "*"))
+                await writer.drain()
+
+                while True:
+                    reply = await read_reply(reader)
+                    if isinstance(reply, BrokerError):
+                        raise reply
+                    kind = reply[0]
+                    if kind == b"psubscribe":
+                        self.subscribed = True
+                        attempt = 0
+                        print(f"📡 Pub/sub subscribed to {self.prefix}* ({self._display_url()})")
+                    elif kind == b"pmessage":
+                        self._receive(reply[2].decode(), reply[3].decode())
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self._failed(e)
+            finally:
+                self.subscribed = False
+                if writer is not None:
+                    writer.close()
+
+            await asyncio.sleep(self.RECONNECT_SECONDS[min(attempt, len(self.RECONNECT_SECONDS) - 1)])
+            attempt += 1
+
+    def _receive(self, channel: str, data: str):
+        origin, *payloads = data.split("\n")
+        if origin == self.origin:
+            return  # Already delivered locally
+        self.received += len(payloads)
+        self.handler(channel[len(self.prefix):], payloads, None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            **super().stats(),
+            "subscribed": self.subscribed,
+            "pending": len(self._pending),
+            "batches": self.batches,
+            "commands": self.commands,
+            "avg_batch_messages": round(self.batched / self.batches, 2) if self.batches else 0.0,
+            "max_flush_ms": round(self.max_flush_seconds * 1000, 3),
+            "received": self.received,
+            "dropped": self.dropped,
+            "errors": self.errors,
+            "last_error": self.last_error,
+        }
+
+
+def create_broker(handler: Handler) -> Broker:
+    """Broker for PUBSUB_BACKEND."""
+    if settings.PUBSUB_BACKEND == "redis":
+        return RedisBroker(
+            handler,
+            url=settings.PUBSUB_URL,
+            prefix=settings.PUBSUB_CHANNEL_PREFIX,
+            linger_ms=settings.PUBSUB_LINGER_MS,
+            max_batch=settings.PUBSUB_MAX_BATCH,
+            max_pending=settings.PUBSUB_MAX_PENDING
+        )
+    return InProcessBroker(handler)
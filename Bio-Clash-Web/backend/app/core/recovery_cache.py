@@ -0,0 +1,126 @@
+"""
+Recovery Score Memo
+Per-user cache of FatigueOracle.calculate_recovery_score() results.
+
+Entries are keyed on the inputs they were computed from: the row count
+and latest change (DailyBiometrics.updated_at, WorkoutLog.created_at) of
+the user's biometrics and workouts in the scoring windows, plus the date
+(the 3-day / 7-day windows move at midnight). FatigueOracle reads the
+current key with one aggregate query and an entry is only served when it
+matches, so writes made by other workers, edits of an existing day's
+biometrics and deletions are all picked up on the next lookup.
+
+Committed ORM inserts/updates/deletes of DailyBiometrics or WorkoutLog
+rows in this process also drop that user's entry right away, as does
+invalidate() after bulk inserts that bypass the ORM. A result computed
+while an invalidation happened is not stored.
+"""
+import threading
+from collections import OrderedDict
+from datetime import date, datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from app.core.config import settings
+from app.core.invalidation import on_commit
+from app.models.fitness import DailyBiometrics, WorkoutLog
+
+
+# (biometrics rows, latest biometrics change, workouts, latest workout, date)
+RecoveryKey = Tuple[int, Optional[datetime], int, Optional[datetime], date]
+RecoveryResult = Tuple[float, str, List[str]]
+
+
+class RecoveryCache:
+    """LRU of user_id -> (key, (score, status, recommendations))."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[RecoveryKey, RecoveryResult]]" = OrderedDict()
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, user_id: str, key: RecoveryKey) -> Optional[RecoveryResult]:
+        """Return the memoized result if it was computed from the same inputs, or None on a miss."""
+        if self.max_entries <= 0:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] != key:
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(user_id)
+            self.hits += 1
+            return entry[1]
+
+    def generation(self, user_id: str) -> int:
+        """Token to pass to put(); it changes whenever the user is invalidated."""
+        with self._lock:
+            return self._generations.get(user_id, 0)
+
+    def put(self, user_id: str, key: RecoveryKey, result: RecoveryResult, generation: int):
+        """Store a freshly computed result unless its inputs changed meanwhile."""
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            if self._generations.get(user_id, 0) != generation:
+                return
+
+            self._entries[user_id] = (key, result)
+            self._entries.move_to_end(user_id)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, user_id: str):
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._generations[user_id] = self._generations.get(user_id, 0) + 1
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            for user_id in self._generations:
+                self._generations[user_id] += 1
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+# Global recovery score memo
+recovery_cache = RecoveryCache(max_entries=settings.RECOVERY_CACHE_MAX_ENTRIES)
+
+
+# ============================================================
+# INVALIDATION
+# Committed biometrics / workout changes drop that user's memo.
+# ============================================================
+
+def _changed_inputs(session, obj):
+    return (obj.user_id,) if isinstance(obj, (DailyBiometrics, WorkoutLog)) else ()
+
+
+def _invalidate_scores(user_ids):
+    for user_id in user_ids:
+        recovery_cache.invalidate(user_id)
+
+
+on_commit("recovery_cache_user_ids", _changed_inputs, _invalidate_scores)
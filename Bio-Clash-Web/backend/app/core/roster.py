@@ -0,0 +1,203 @@
+"""
+Clan Roster Cache
+Per-clan snapshot of the member list shown on the clan screen.
+
+A roster is loaded with one query (members joined to their users) and
+then shared by every member who opens the clan until it changes.
+
+Invalidation: any committed ORM insert/update/delete of a ClanMember
+(join, leave, promote, war stats) drops that clan's roster, as does a
+committed change to a member's username or league tier. Bulk UPDATEs
+(league clustering) call invalidate_users() themselves. Entries also
+expire after ROSTER_CACHE_TTL_SECONDS, which bounds how stale another
+worker's copy can get. A roster loaded while an invalidation happened
+is not stored.
+"""
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import inspect, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.invalidation import on_commit
+from app.models.clan import ClanMember
+from app.models.user import User
+from app.schemas.clan import ClanMemberResponse
+
+
+Roster = Tuple[ClanMemberResponse, ...]
+
+
+async def load_roster(db: AsyncSession, clan_id: str) -> Roster:
+    """Members of a clan with their usernames and leagues (one joined query)."""
+    rows = (await db.execute(
+        select(ClanMember, User.username, User.league_tier)
+        .join(User, User.id == ClanMember.user_id)
+        .where(ClanMember.clan_id == clan_id)
+        .order_by(ClanMember.joined_at, ClanMember.id)
+    )).all()
+
+    return tuple(
+        ClanMemberResponse(
+            id=member.id,
+            user_id=member.user_id,
+            username=username,
+            role=member.role,
+            donations=member.donations,
+            war_stars_earned=member.war_stars_earned,
+            attacks_won=member.attacks_won,
+            league_tier=league_tier,
+            joined_at=member.joined_at
+        )
+        for member, username, league_tier in rows
+    )
+
+
+class RosterCache:
+    """LRU of clan_id -> (roster, expires_at), with a user_id -> clan_id index."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[Roster, float]]" = OrderedDict()
+        self._clan_by_user: Dict[str, str] = {}
+        self._generations: Dict[str, int] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 and self.ttl_seconds > 0
+
+    async def get(self, db: AsyncSession, clan_id: str) -> Roster:
+        """The clan's roster, from the cache or loaded (and cached) on a miss."""
+        roster = self._lookup(clan_id)
+        if roster is not None:
+            return roster
+
+        generation = self._generation(clan_id)
+        roster = await load_roster(db, clan_id)
+        self._put(clan_id, roster, generation)
+        return roster
+
+    def _lookup(self, clan_id: str) -> Optional[Roster]:
+        if not self.enabled:
+            return None
+
+        with self._lock:
+            entry = self._entries.get(clan_id)
+            if entry is None or entry[1] <= time.monotonic():
+                if entry is not None:
+                    self._remove(clan_id)
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(clan_id)
+            self.hits += 1
+            return entry[0]
+
+    def _generation(self, clan_id: str) -> int:
+        with self._lock:
+            return self._generations.get(clan_id, 0)
+
+    def _put(self, clan_id: str, roster: Roster, generation: int):
+        if not self.enabled:
+            return
+
+        with self._lock:
+            if self._generations.get(clan_id, 0) != generation:
+                return
+
+            self._remove(clan_id)
+            self._entries[clan_id] = (roster, time.monotonic() + self.ttl_seconds)
+            for member in roster:
+                self._clan_by_user[member.user_id] = clan_id
+
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate(self, clan_id: str):
+        with self._lock:
+            self._remove(clan_id)
+            self._generations[clan_id] = self._generations.get(clan_id, 0) + 1
+            self.invalidations += 1
+
+    def invalidate_users(self, user_ids: Iterable[str]):
+        """Drop the cached rosters these users appear in."""
+        with self._lock:
+            clan_ids = {self._clan_by_user.get(user_id) for user_id in user_ids}
+        for clan_id in clan_ids - {None}:
+            self.invalidate(clan_id)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._clan_by_user.clear()
+            for clan_id in self._generations:
+                self._generations[clan_id] += 1
+            self.invalidations += 1
+
+    def _remove(self, clan_id: str):
+        entry = self._entries.pop(clan_id, None)
+        if entry is None:
+            return
+        for member in entry[0]:
+            if self._clan_by_user.get(member.user_id) == clan_id:
+                del self._clan_by_user[member.user_id]
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "clans": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+# Global clan roster cache
+roster_cache = RosterCache(
+    max_entries=settings.ROSTER_CACHE_MAX_CLANS,
+    ttl_seconds=settings.ROSTER_CACHE_TTL_SECONDS
+)
+
+
+# ============================================================
+# INVALIDATION
+# Committed membership changes drop that clan's roster; committed
+# username / league changes drop the roster the user appears in.
+# ============================================================
+
+ROSTER_USER_FIELDS = ("username", "league_tier")
+
+
+def _changed_membership(session, obj):
+    return (obj.clan_id,) if isinstance(obj, ClanMember) else ()
+
+
+def _changed_member_user(session, obj):
+    if not isinstance(obj, User) or obj in session.new:
+        return ()
+    state = inspect(obj)
+    if obj in session.deleted or any(state.attrs[field].history.has_changes() for field in ROSTER_USER_FIELDS):
+        return (obj.id,)
+    return ()
+
+
+def _invalidate_clans(clan_ids):
+    for clan_id in clan_ids:
+        roster_cache.invalidate(clan_id)
+
+
+on_commit("roster_cache_clan_ids", _changed_membership, _invalidate_clans)
+on_commit("roster_cache_user_ids", _changed_member_user, roster_cache.invalidate_users)
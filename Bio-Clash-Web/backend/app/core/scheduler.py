@@ -0,0 +1,258 @@
+"""
+Upgrade Scheduler
+Completes building upgrades when their timers run out.
+
+An in-process min-heap of (due time, upgrade id) is rebuilt from the
+upgrade_queue.finish_time index at startup and periodically after that.
+UpgradeManager.start_upgrade() publishes each new upgrade on the room
+pub/sub broker ("upgrade:<id>", app/core/pubsub.py); the worker running
+the scheduler loop pushes it and wakes up, wherever the upgrade was
+started. Workers without the loop (BACKGROUND_JOBS_ENABLED=false) keep
+no heap. The loop sleeps until the earliest due time; the periodic
+rebuild catches anything the best-effort broker dropped.
+
+Due upgrades are completed in batched transactions (UPGRADE_BATCH_SIZE
+per commit). Each batch re-reads its rows, so heap entries that are
+stale (paused, already completed, rescheduled) are harmless.
+"""
+import asyncio
+import heapq
+import time
+import traceback
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import select, delete
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.enums import BuildingType
+from app.core.websocket import manager
+from app.db.session import AsyncSessionLocal
+from app.models.game import Village, Building, UpgradeQueue
+
+
+def effective_finish_time(upgrade: UpgradeQueue, now: Optional[datetime] = None) -> datetime:
+    """
+    finish_time pushed back by time spent paused.
+    A paused upgrade's timer is frozen at pause_start_time.
+    """
+    finish = upgrade.finish_time + timedelta(seconds=upgrade.accumulated_pause_seconds or 0)
+    if upgrade.is_paused and upgrade.pause_start_time:
+        finish += (now or datetime.utcnow()) - upgrade.pause_start_time
+    return finish
+
+
+class UpgradeScheduler:
+    """Min-heap of upgrade due times driving batched completion."""
+
+    def __init__(self, batch_size: int, resync_seconds: float):
+        self.batch_size = batch_size
+        self.resync_seconds = resync_seconds
+        self._heap: List[Tuple[datetime, str]] = []
+        self._wake: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self._last_rebuild = 0.0
+        self.completed = 0
+        self.batches = 0
+        self.deferred = 0
+        self.rebuilds = 0
+        self.failures = 0
+        self.total_batch_seconds = 0.0
+        self.max_batch_seconds = 0.0
+        self.max_lag_seconds = 0.0
+        self.last_error: Optional[str] = None
+
+    def schedule(self, upgrade_id: str, due: datetime):
+        """Announce a new upgrade (called after it is committed) to the scheduler loop on any worker."""
+        manager.broker.publish(f"upgrade:{upgrade_id}", due.isoformat())
+
+    def on_scheduled(self, upgrade_id: str, payloads: List[str]):
+        """Pub/sub listener for "upgrade" messages from schedule()."""
+        for payload in payloads:
+            self._track(upgrade_id, datetime.fromisoformat(payload))
+
+    def _track(self, upgrade_id: str, due: datetime):
+        if self._task is None:
+            return  # Loop not running on this worker; start() rebuilds from the DB
+        heapq.heappush(self._heap, (due, upgrade_id))
+        self._wake.set()
+
+    # ============================================================
+    # HEAP
+    # ============================================================
+
+    async def rebuild(self, db: AsyncSession) -> int:
+        """Reload the heap with every running (unpaused) upgrade."""
+        rows = (await db.execute(
+            select(UpgradeQueue.id, UpgradeQueue.finish_time, UpgradeQueue.accumulated_pause_seconds)
+            .where(UpgradeQueue.is_paused == False)
+            .order_by(UpgradeQueue.finish_time)
+        )).all()
+
+        # Rows arrive sorted by finish_time; pauses only shift some of them
+        heap = [
+            (finish + timedelta(seconds=paused or 0), upgrade_id)
+            for upgrade_id, finish, paused in rows
+        ]
+        heapq.heapify(heap)
+        self._heap = heap
+        self._last_rebuild = time.monotonic()
+        self.rebuilds += 1
+        return len(heap)
+
+    def _pop_due(self, now: datetime) -> List[str]:
+        ids = []
+        while self._heap and self._heap[0][0] <= now and len(ids) < self.batch_size:
+            due, upgrade_id = heapq.heappop(self._heap)
+            self.max_lag_seconds = max(self.max_lag_seconds, (now - due).total_seconds())
+            ids.append(upgrade_id)
+        return list(dict.fromkeys(ids))
+
+    # ============================================================
+    # COMPLETION
+    # ============================================================
+
+    async def complete(self, db: AsyncSession, upgrade_ids: List[str], now: Optional[datetime] = None) -> int:
+        """
+        Complete the given upgrades that are due, in one transaction.
+        Upgrades that are paused or not yet due (pause time added) are
+        left in the queue; unpaused ones are pushed back onto the heap.
+        """
+        now = now or datetime.utcnow()
+        rows = (await db.execute(
+            select(UpgradeQueue, Building, Village)
+            .join(Building, Building.id == UpgradeQueue.building_id)
+            .join(Village, Village.id == UpgradeQueue.village_id)
+            .where(UpgradeQueue.id.in_(upgrade_ids), UpgradeQueue.is_paused == False)
+        )).all()
+
+        done = []
+        notices = []
+        for upgrade, building, village in rows:
+            due = effective_finish_time(upgrade, now)
+            if due > now:
+                self._track(upgrade.id, due)
+                self.deferred += 1
+                continue
+
+            building.level = max(building.level, upgrade.target_level)
+            building.is_upgrading = False
+            if building.building_type == BuildingType.TOWN_HALL:
+                village.town_hall_level = max(village.town_hall_level, upgrade.target_level)
+
+            done.append(upgrade.id)
+            notices.append((village.user_id, {
+                "type": "upgrade_complete",
+                "upgrade_id": upgrade.id,
+                "building_id": building.id,
+                "building_type": building.building_type.value,
+                "level": building.level,
+                "timestamp": now.isoformat()
+            }))
+
+        if not done:
+            return 0
+
+        await db.execute(
+            delete(UpgradeQueue).where(UpgradeQueue.id.in_(done)),
+            execution_options={"synchronize_session": False}
+        )
+        await db.commit()
+
+        await asyncio.gather(*(manager.send_to_user(user_id, notice) for user_id, notice in notices))
+        return len(done)
+
+    async def run_due(self, now: Optional[datetime] = None) -> int:
+        """Complete everything due on the heap, one transaction per batch."""
+        total = 0
+        while True:
+            ids = self._pop_due(now or datetime.utcnow())
+            if not ids:
+                return total
+
+            started = time.perf_counter()
+            async with AsyncSessionLocal() as db:
+                count = await self.complete(db, ids, now)
+
+            elapsed = time.perf_counter() - started
+            self.batches += 1
+            self.completed += count
+            self.total_batch_seconds += elapsed
+            self.max_batch_seconds = max(self.max_batch_seconds, elapsed)
+            total += count
+
+    # ============================================================
+    # LOOP
+    # ============================================================
+
+    async def start(self) -> int:
+        """Rebuild the heap and start the timer loop. Returns the pending count."""
+        if self._task is None:
+            async with AsyncSessionLocal() as db:
+                await self.rebuild(db)
+            self._wake = asyncio.Event()
+            self._task = asyncio.create_task(self._loop(), name="upgrade_scheduler")
+        return len(self._heap)
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        self._wake = None
+
+    async def _loop(self):
+        while True:
+            try:
+                if time.monotonic() - self._last_rebuild >= self.resync_seconds:
+                    async with AsyncSessionLocal() as db:
+                        await self.rebuild(db)
+                await self.run_due()
+                self.last_error = None
+            except Exception as e:
+                # Lost entries are recovered by the next rebuild
+                self.failures += 1
+                self.last_error = str(e)
+                print(f"❌ Upgrade scheduler batch failed: {e}")
+                print(traceback.format_exc())
+
+            await self._sleep()
+
+    async def _sleep(self):
+        """Sleep until the next due time, a new schedule(), or the next resync."""
+        timeout = max(0.0, self.resync_seconds - (time.monotonic() - self._last_rebuild))
+        if self._heap:
+            until_due = (self._heap[0][0] - datetime.utcnow()).total_seconds()
+            timeout = min(timeout, max(0.0, until_due))
+
+        self._wake.clear()
+        try:
+            await asyncio.wait_for(self._wake.wait(), timeout=timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "running": self._task is not None,
+            "heap_size": len(self._heap),
+            "next_due": self._heap[0][0].isoformat() if self._heap else None,
+            "completed": self.completed,
+            "batches": self.batches,
+            "deferred": self.deferred,
+            "rebuilds": self.rebuilds,
+            "failures": self.failures,
+            "avg_batch_ms": round(self.total_batch_seconds / self.batches * 1000, 3) if self.batches else 0.0,
+            "max_batch_ms": round(self.max_batch_seconds * 1000, 3),
+            "max_lag_ms": round(self.max_lag_seconds * 1000, 3),
+            "last_error": self.last_error,
+        }
+
+
+# Global upgrade scheduler instance
+upgrade_scheduler = UpgradeScheduler(
+    batch_size=settings.UPGRADE_BATCH_SIZE,
+    resync_seconds=settings.UPGRADE_RESYNC_SECONDS
+)
+manager.add_listener("upgrade", upgrade_scheduler.on_scheduled)
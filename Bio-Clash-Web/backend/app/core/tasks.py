@@ -0,0 +1,101 @@
+"""
+Background Task Runner
+Runs periodic jobs on the API's event loop and records their timings.
+
+Jobs are registered in app/jobs.py and started from the app lifespan.
+"""
+import asyncio
+import time
+import traceback
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+class PeriodicTask:
+    """A coroutine function run every `interval` seconds, with run statistics."""
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable[Any]]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.runs = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        self.max_seconds = 0.0
+        self.last_seconds = 0.0
+        self.last_result: Any = None
+        self.last_error: Optional[str] = None
+        self.last_run_at: Optional[float] = None
+
+    async def run_once(self) -> Any:
+        """Run the job once, recording duration and outcome."""
+        started = time.perf_counter()
+        try:
+            self.last_result = await self.func()
+            self.last_error = None
+            return self.last_result
+        except Exception as e:
+            self.failures += 1
+            self.last_error = str(e)
+            print(f"❌ Background job '{self.name}' failed: {e}")
+            print(traceback.format_exc())
+        finally:
+            elapsed = time.perf_counter() - started
+            self.runs += 1
+            self.total_seconds += elapsed
+            self.max_seconds = max(self.max_seconds, elapsed)
+            self.last_seconds = elapsed
+            self.last_run_at = time.time()
+
+    async def loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            await self.run_once()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "interval_seconds": self.interval,
+            "runs": self.runs,
+            "failures": self.failures,
+            "avg_ms": round(self.total_seconds / self.runs * 1000, 3) if self.runs else 0.0,
+            "max_ms": round(self.max_seconds * 1000, 3),
+            "last_ms": round(self.last_seconds * 1000, 3),
+            "last_result": self.last_result,
+            "last_error": self.last_error,
+        }
+
+
+class TaskRunner:
+    """Owns the periodic jobs and their asyncio tasks."""
+
+    def __init__(self):
+        self.tasks: Dict[str, PeriodicTask] = {}
+        self._running: Dict[str, asyncio.Task] = {}
+
+    def add(self, name: str, interval: float, func: Callable[[], Awaitable[Any]]) -> PeriodicTask:
+        """Register a job. Non-positive intervals register it but never schedule it."""
+        task = PeriodicTask(name, interval, func)
+        self.tasks[name] = task
+        return task
+
+    def start(self):
+        for name, task in self.tasks.items():
+            if task.interval > 0 and name not in self._running:
+                self._running[name] = asyncio.create_task(task.loop(), name=f"job:{name}")
+
+    async def stop(self):
+        running = list(self._running.values())
+        self._running.clear()
+        for task in running:
+            task.cancel()
+        await asyncio.gather(*running, return_exceptions=True)
+
+    async def run(self, name: str) -> Any:
+        """Run one job immediately (CLI / admin use)."""
+        return await self.tasks[name].run_once()
+
+    def stats(self) -> Dict[str, Any]:
+        return {name: task.stats() for name, task in self.tasks.items()}
+
+
+# Global task runner instance
+task_runner = TaskRunner()
@@ -1,11 +1,113 @@
 """
 WebSocket Manager
 Handles real-time connections for raids, chat, and war updates.
+
+Every chat/war/user connection owns a bounded outbound queue drained by
+its own writer task, so broadcasts never wait on a socket: a message is
+serialized once and enqueued to each member. A connection whose queue is
+full is a slow consumer (WS_SLOW_CONSUMER_POLICY: "disconnect" closes it,
+"drop" skips the message for it); a stuck send shows up the same way.
+Connections whose send fails are closed and pruned from their rooms.
+
+Clan, war and user messages go through the pub/sub broker
+(app/core/pubsub.py) so that every API worker delivers them to its own
+sockets; the default in-process broker delivers locally only.
 """
-from typing import Dict, List, Set
+import asyncio
+import json
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Set, Tuple
 from fastapi import WebSocket
 from datetime import datetime
-import json
+
+from app.core.config import settings
+from app.core.pubsub import Broker, InProcessBroker
+
+
+def _serialize(message: dict) -> str:
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def _percentile(ordered: List[float], q: float) -> float:
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0.0
+
+
+class Room:
+    """Members of one room plus its delivery statistics."""
+    
+    def __init__(self, key: str):
+        self.key = key
+        self.members: Dict[WebSocket, "Connection"] = {}
+        self.latencies: Deque[float] = deque(maxlen=settings.WS_LATENCY_SAMPLES)
+        self.sent = 0
+        self.dropped = 0
+    
+    def stats(self) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+        return {
+            "room": self.key,
+            "members": len(self.members),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "p50_ms": round(_percentile(ordered, 0.50) * 1000, 3),
+            "p95_ms": round(_percentile(ordered, 0.95) * 1000, 3),
+            "p99_ms": round(_percentile(ordered, 0.99) * 1000, 3),
+        }
+
+
+class Connection:
+    """One WebSocket with its bounded outbound queue and writer task."""
+    
+    def __init__(self, websocket: WebSocket, manager: "ConnectionManager"):
+        self.websocket = websocket
+        self.manager = manager
+        self.rooms: Set[str] = set()
+        self.closed = False
+        self._queue: "asyncio.Queue[Tuple[str, float, Room]]" = asyncio.Queue(maxsize=settings.WS_SEND_QUEUE_SIZE)
+        self._writer = asyncio.create_task(self._write())
+    
+    def offer(self, payload: str, room: Room) -> bool:
+        """Queue a serialized message; False if the queue is full."""
+        if self.closed:
+            return True
+        try:
+            self._queue.put_nowait((payload, time.perf_counter(), room))
+            return True
+        except asyncio.QueueFull:
+            return False
+    
+    async def _write(self):
+        while True:
+            payload, queued_at, room = await self._queue.get()
+            try:
+                await self.websocket.send_text(payload)
+            except Exception:
+                # Dead socket
+                self.manager.dead_pruned += 1
+                self.manager.drop_connection(self)
+                await self._close_socket(1011)
+                return
+            
+            room.latencies.append(time.perf_counter() - queued_at)
+            room.sent += 1
+            self.manager.sent += 1
+    
+    async def close(self, code: int = 1000):
+        """Stop the writer and close the socket (pending messages are discarded)."""
+        if self.closed:
+            return
+        self.closed = True
+        if self._writer is not asyncio.current_task():
+            self._writer.cancel()
+        await self._close_socket(code)
+    
+    async def _close_socket(self, code: int):
+        self.closed = True
+        try:
+            await self.websocket.close(code=code)
+        except Exception:
+            pass  # Already closed
 
 
 class ConnectionManager:
@@ -19,23 +121,134 @@ class ConnectionManager:
     """
     
     def __init__(self):
-        # Map of room_id -> set of WebSocket connections
-        self.clan_rooms: Dict[str, List[WebSocket]] = {}
-        self.war_rooms: Dict[str, List[WebSocket]] = {}
+        # Map of room_id -> Room (members keyed by WebSocket)
+        self.clan_rooms: Dict[str, Room] = {}
+        self.war_rooms: Dict[str, Room] = {}
         self.raid_sessions: Dict[str, Dict[str, WebSocket]] = {}  # raid_id -> {attacker, defender}
         
-        # Map user_id -> WebSocket for direct messaging
-        self.user_connections: Dict[str, WebSocket] = {}
+        # Map user_id -> Connection for direct messaging
+        self.user_connections: Dict[str, Connection] = {}
+        self.direct = Room("user")
+        
+        self.sent = 0
+        self.dropped = 0
+        self.slow_disconnects = 0
+        self.dead_pruned = 0
+        
+        # Cross-worker delivery (replaced at startup by use_broker)
+        self.broker: Broker = InProcessBroker(self.dispatch)
+        
+        # Channel kind -> callbacks(key, payloads) seeing every delivered message
+        self.listeners: Dict[str, List[Callable[[str, List[str]], None]]] = {}
     
     async def connect_user(self, websocket: WebSocket, user_id: str):
         """Connect a user for general notifications."""
         await websocket.accept()
-        self.user_connections[user_id] = websocket
+        previous = self.user_connections.get(user_id)
+        connection = Connection(websocket, self)
+        connection.rooms.add(f"user:{user_id}")
+        self.user_connections[user_id] = connection
+        if previous:
+            await previous.close()
     
     def disconnect_user(self, user_id: str):
         """Disconnect a user."""
-        if user_id in self.user_connections:
-            del self.user_connections[user_id]
+        connection = self.user_connections.pop(user_id, None)
+        if connection:
+            asyncio.create_task(connection.close())
+    
+    # ============================================================
+    # ROOMS
+    # ============================================================
+    
+    def _join(self, rooms: Dict[str, Room], prefix: str, room_id: str, websocket: WebSocket) -> Connection:
+        room = rooms.get(room_id)
+        if room is None:
+            room = rooms[room_id] = Room(f"{prefix}:{room_id}")
+        connection = Connection(websocket, self)
+        connection.rooms.add(room.key)
+        room.members[websocket] = connection
+        return connection
+    
+    def _leave(self, rooms: Dict[str, Room], room_id: str, websocket: WebSocket):
+        room = rooms.get(room_id)
+        if room is None:
+            return
+        connection = room.members.pop(websocket, None)
+        if connection:
+            asyncio.create_task(connection.close())
+        if not room.members:
+            del rooms[room_id]
+    
+    def drop_connection(self, connection: Connection):
+        """Prune a closed connection from every room it is in."""
+        for key in connection.rooms:
+            kind, _, room_id = key.partition(":")
+            if kind == "user":
+                if self.user_connections.get(room_id) is connection:
+                    del self.user_connections[room_id]
+                continue
+            rooms = self.clan_rooms if kind == "clan" else self.war_rooms
+            room = rooms.get(room_id)
+            if room and room.members.get(connection.websocket) is connection:
+                del room.members[connection.websocket]
+                if not room.members:
+                    del rooms[room_id]
+    
+    def _deliver(self, room: Room, connection: Connection, payload: str):
+        if connection.offer(payload, room):
+            return
+        
+        room.dropped += 1
+        self.dropped += 1
+        if settings.WS_SLOW_CONSUMER_POLICY == "disconnect":
+            # Client reconnects and re-syncs (chat history, war state)
+            self.slow_disconnects += 1
+            self.drop_connection(connection)
+            asyncio.create_task(connection.close(code=1013))
+    
+    def _fanout(self, room: Optional[Room], payload: str, exclude: WebSocket = None):
+        """Queue a serialized message to every member; never waits on a socket."""
+        if room is None:
+            return
+        
+        for websocket, connection in list(room.members.items()):
+            if websocket is not exclude:
+                self._deliver(room, connection, payload)
+    
+    # ============================================================
+    # PUB/SUB
+    # ============================================================
+    
+    async def use_broker(self, broker: Broker):
+        """Swap in the configured broker (app startup)."""
+        previous, self.broker = self.broker, broker
+        await previous.stop()
+        await broker.start()
+    
+    def add_listener(self, kind: str, callback: Callable[[str, List[str]], None]):
+        """Observe every message of a channel kind ("clan", "war", "user", "upgrade") this worker receives."""
+        self.listeners.setdefault(kind, []).append(callback)
+    
+    def dispatch(self, channel: str, payloads: List[str], exclude: WebSocket = None):
+        """Broker handler: deliver a channel's messages to this worker's sockets."""
+        kind, _, key = channel.partition(":")
+        for listener in self.listeners.get(kind, ()):
+            listener(key, payloads)
+        
+        if kind == "user":
+            connection = self.user_connections.get(key)
+            if connection:
+                for payload in payloads:
+                    self._deliver(self.direct, connection, payload)
+            return
+        
+        rooms = {"clan": self.clan_rooms, "war": self.war_rooms}.get(kind)
+        if rooms is None:
+            return  # Listener-only channel (e.g. "upgrade")
+        room = rooms.get(key)
+        for payload in payloads:
+            self._fanout(room, payload, exclude)
     
     # ============================================================
     # CLAN CHAT
@@ -44,11 +257,7 @@ class ConnectionManager:
     async def join_clan_room(self, websocket: WebSocket, clan_id: str, user_id: str):
         """Join clan chat room."""
         await websocket.accept()
-        
-        if clan_id not in self.clan_rooms:
-            self.clan_rooms[clan_id] = []
-        
-        self.clan_rooms[clan_id].append(websocket)
+        self._join(self.clan_rooms, "clan", clan_id, websocket)
         
         # Notify others
         await self.broadcast_to_clan(clan_id, {
@@ -59,25 +268,14 @@ class ConnectionManager:
     
     def leave_clan_room(self, websocket: WebSocket, clan_id: str):
         """Leave clan chat room."""
-        if clan_id in self.clan_rooms:
-            if websocket in self.clan_rooms[clan_id]:
-                self.clan_rooms[clan_id].remove(websocket)
-            if not self.clan_rooms[clan_id]:
-                del self.clan_rooms[clan_id]
+        self._leave(self.clan_rooms, clan_id, websocket)
     
     async def broadcast_to_clan(
         self, clan_id: str, message: dict, exclude: WebSocket = None
     ):
-        """Broadcast message to all clan members."""
-        if clan_id not in self.clan_rooms:
-            return
-        
-        for connection in self.clan_rooms[clan_id]:
-            if connection != exclude:
-                try:
-                    await connection.send_json(message)
-                except:
-                    pass  # Connection might be closed
+        """Broadcast message to all clan members (on every worker)."""
+        self.broker.publish(f"clan:{clan_id}", _serialize(message), exclude)
+        await asyncio.sleep(0)  # Let the writers drain between bursts
     
     # ============================================================
     # WAR ROOM
@@ -86,30 +284,16 @@ class ConnectionManager:
     async def join_war_room(self, websocket: WebSocket, war_id: str, user_id: str):
         """Join war battle room for live updates."""
         await websocket.accept()
-        
-        if war_id not in self.war_rooms:
-            self.war_rooms[war_id] = []
-        
-        self.war_rooms[war_id].append(websocket)
+        self._join(self.war_rooms, "war", war_id, websocket)
     
     def leave_war_room(self, websocket: WebSocket, war_id: str):
         """Leave war room."""
-        if war_id in self.war_rooms:
-            if websocket in self.war_rooms[war_id]:
-                self.war_rooms[war_id].remove(websocket)
-            if not self.war_rooms[war_id]:
-                del self.war_rooms[war_id]
+        self._leave(self.war_rooms, war_id, websocket)
     
     async def broadcast_war_update(self, war_id: str, update: dict):
-        """Broadcast war update to all participants."""
-        if war_id not in self.war_rooms:
-            return
-        
-        for connection in self.war_rooms[war_id]:
-            try:
-                await connection.send_json(update)
-            except:
-                pass
+        """Broadcast war update to all participants (on every worker)."""
+        self.broker.publish(f"war:{war_id}", _serialize(update))
+        await asyncio.sleep(0)
     
     # ============================================================
     # REAL-TIME RAIDS
@@ -146,6 +330,26 @@ class ConnectionManager:
                 "role": "defender"
             })
     
+    async def watch_raid_session(self, raid_id: str, defender_ws: WebSocket) -> bool:
+        """Attach the defender to a running raid; closes the socket if there is none."""
+        session = self.raid_sessions.get(raid_id)
+        if session is None:
+            await defender_ws.close(code=1008)
+            return False
+        
+        await defender_ws.accept()
+        session["defender"] = defender_ws
+        await defender_ws.send_json({
+            "type": "raid_started",
+            "raid_id": raid_id,
+            "role": "defender"
+        })
+        return True
+    
+    def drop_raid_session(self, raid_id: str):
+        """Forget a raid that ended without a result (attacker left, error)."""
+        self.raid_sessions.pop(raid_id, None)
+    
     async def send_raid_event(self, raid_id: str, event: dict, to: str = "both"):
         """
         Send a raid event to attacker, defender, or both.
@@ -209,16 +413,44 @@ class ConnectionManager:
     # ============================================================
     
     async def send_to_user(self, user_id: str, message: dict):
-        """Send a message directly to a user."""
-        if user_id in self.user_connections:
-            try:
-                await self.user_connections[user_id].send_json(message)
-            except:
-                pass
+        """Send a message directly to a user (on whichever worker holds their socket)."""
+        self.broker.publish(f"user:{user_id}", _serialize(message))
     
     def get_online_users(self) -> Set[str]:
         """Get set of online user IDs."""
         return set(self.user_connections.keys())
+    
+    async def close_all(self):
+        """Stop the broker and close every queued connection (shutdown)."""
+        await self.broker.stop()
+        connections = list(self.user_connections.values())
+        for rooms in (self.clan_rooms, self.war_rooms):
+            for room in rooms.values():
+                connections.extend(room.members.values())
+        self.user_connections.clear()
+        self.clan_rooms.clear()
+        self.war_rooms.clear()
+        await asyncio.gather(*(c.close(code=1001) for c in connections), return_exceptions=True)
+    
+    def stats(self) -> Dict[str, Any]:
+        """Delivery counters and latency percentiles (enqueue -> sent), slowest rooms first."""
+        rooms = [*self.clan_rooms.values(), *self.war_rooms.values(), self.direct]
+        all_latencies = sorted(latency for room in rooms for latency in room.latencies)
+        per_room = sorted((room.stats() for room in rooms if room.latencies), key=lambda r: r["p99_ms"], reverse=True)
+        return {
+            "connections": sum(len(room.members) for room in rooms) + len(self.user_connections),
+            "clan_rooms": len(self.clan_rooms),
+            "war_rooms": len(self.war_rooms),
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "slow_disconnects": self.slow_disconnects,
+            "dead_pruned": self.dead_pruned,
+            "p50_ms": round(_percentile(all_latencies, 0.50) * 1000, 3),
+            "p95_ms": round(_percentile(all_latencies, 0.95) * 1000, 3),
+            "p99_ms": round(_percentile(all_latencies, 0.99) * 1000, 3),
+            "rooms": per_room[:settings.WS_STATS_MAX_ROOMS],
+            "broker": self.broker.stats(),
+        }
 
 
 # Global connection manager instance
@@ -1,2 +1,2 @@
 # DB module exports
-from app.db.session import Base, engine, SessionLocal, get_db
+from app.db.session import Base, engine, SessionLocal, async_engine, AsyncSessionLocal, get_db
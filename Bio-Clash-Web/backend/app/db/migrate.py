@@ -0,0 +1,224 @@
+"""
+Schema Upgrades
+In-place changes that create_all() cannot make to an existing database.
+
+Base.metadata.create_all() only creates missing tables: a table that
+already exists keeps its old columns and constraints, and model indexes
+are only created together with their table. There is no migration
+framework, so upgrade_schema() (run at startup after create_all, and by
+`python -m app.cli upgrade-schema`) applies the changes the models need.
+Each step looks at the live schema first, so it is a no-op once applied:
+
+- daily_biometrics: updated_at column (recovery score memo key),
+  backfilled from created_at.
+- clan_wars: search_power column and a nullable opponent_clan_id (queued
+  wars have no opponent yet). SQLite cannot drop NOT NULL in place, so
+  the table is rebuilt (create, copy, drop, rename) in one transaction.
+- clans: member_count column, backfilled from clan_members.
+- villages: last_raid_at column (raid cooldown).
+- Every model index missing from an existing table is created.
+
+schema_drift() compares the database with the models (missing tables,
+columns, indexes, NOT NULL mismatches); `upgrade-schema --check` reports
+it without changing anything.
+"""
+from typing import Callable, List, Optional, Tuple
+
+from sqlalchemy import MetaData, Table, inspect, text
+from sqlalchemy.engine import Engine, Inspector
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import CreateTable
+
+import app.models  # noqa: F401  (register all models)
+from app.db.session import Base
+from app.models.clan import ClanWar
+
+
+# ============================================================
+# SCHEMA DRIFT
+# ============================================================
+
+def schema_drift(engine: Engine) -> List[str]:
+    """Differences between the database and the models, one line each."""
+    inspector = inspect(engine)
+    drift = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            drift.append(f"{table.name}: table missing")
+            continue
+
+        columns = {column["name"]: column for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            existing = columns.get(column.name)
+            if existing is None:
+                drift.append(f"{table.name}.{column.name}: column missing")
+            elif column.nullable and not existing["nullable"] and not column.primary_key:
+                drift.append(f"{table.name}.{column.name}: NOT NULL in the database, nullable in the model")
+
+        drift.extend(f"{table.name}: index {index.name} missing" for index in _missing_indexes(inspector, table))
+    return drift
+
+
+def _missing_indexes(inspector: Inspector, table: Table) -> list:
+    existing = {index["name"] for index in inspector.get_indexes(table.name)}
+    return [index for index in table.indexes if index.name not in existing]
+
+
+def _column(inspector: Inspector, table: str, name: str) -> Optional[dict]:
+    return next((column for column in inspector.get_columns(table) if column["name"] == name), None)
+
+
+# ============================================================
+# UPGRADE STEPS
+# Each step: (needed(inspector) -> bool, apply(engine), description)
+# ============================================================
+
+def _biometrics_updated_at_needed(inspector: Inspector) -> bool:
+    return inspector.has_table("daily_biometrics") and _column(inspector, "daily_biometrics", "updated_at") is None
+
+
+def _upgrade_biometrics_updated_at(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE daily_biometrics ADD COLUMN updated_at DATETIME"))
+        conn.execute(text("UPDATE daily_biometrics SET updated_at = created_at"))
+
+
+def _clan_war_queue_needed(inspector: Inspector) -> bool:
+    if not inspector.has_table("clan_wars"):
+        return False
+    opponent = _column(inspector, "clan_wars", "opponent_clan_id")
+    return _column(inspector, "clan_wars", "search_power") is None or not opponent["nullable"]
+
+
+def _upgrade_clan_war_queue(engine: Engine):
+    if engine.dialect.name == "sqlite":
+        _rebuild_sqlite_table(engine, ClanWar.__table__)
+        return
+
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        if _column(inspector, "clan_wars", "search_power") is None:
+            conn.execute(text("ALTER TABLE clan_wars ADD COLUMN search_power FLOAT"))
+        conn.execute(text("ALTER TABLE clan_wars ALTER COLUMN opponent_clan_id DROP NOT NULL"))
+
+
+def _clan_member_count_needed(inspector: Inspector) -> bool:
+    return inspector.has_table("clans") and _column(inspector, "clans", "member_count") is None
+
+
+def _upgrade_clan_member_count(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE clans ADD COLUMN member_count INTEGER NOT NULL DEFAULT 0"))
+        # Same correlated count as ClanManager.reconcile_member_counts()
+        conn.execute(text(
+            "UPDATE clans SET member_count = "
+            "(SELECT count(*) FROM clan_members WHERE clan_members.clan_id = clans.id)"
+        ))
+
+
+def _village_last_raid_needed(inspector: Inspector) -> bool:
+    return inspector.has_table("villages") and _column(inspector, "villages", "last_raid_at") is None
+
+
+def _upgrade_village_last_raid(engine: Engine):
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE villages ADD COLUMN last_raid_at DATETIME"))
+
+
+UPGRADE_STEPS: List[Tuple[Callable[[Inspector], bool], Callable[[Engine], None], str]] = [
+    (
+        _biometrics_updated_at_needed, _upgrade_biometrics_updated_at,
+        "daily_biometrics: add updated_at (from created_at)"
+    ),
+    (
+        _clan_war_queue_needed, _upgrade_clan_war_queue,
+        "clan_wars: add search_power, make opponent_clan_id nullable"
+    ),
+    (
+        _clan_member_count_needed, _upgrade_clan_member_count,
+        "clans: add member_count (backfilled from clan_members)"
+    ),
+    (
+        _village_last_raid_needed, _upgrade_village_last_raid,
+        "villages: add last_raid_at"
+    ),
+]
+
+
+def _rebuild_sqlite_table(engine: Engine, table: Table):
+    """
+    Recreate a SQLite table from its model, keeping the rows of every
+    column the old and new definitions share. The table's indexes are
+    dropped with it; upgrade_schema() recreates them afterwards.
+    """
+    staging = f"{table.name}_rebuild"
+    metadata = MetaData()
+    for referenced in {fk.column.table for fk in table.foreign_keys}:
+        referenced.to_metadata(metadata)  # So REFERENCES clauses compile
+    new_table = table.to_metadata(metadata, name=staging)
+
+    old_columns = {column["name"] for column in inspect(engine).get_columns(table.name)}
+    shared = ", ".join(f'"{column.name}"' for column in table.columns if column.name in old_columns)
+    create = str(CreateTable(new_table).compile(dialect=engine.dialect)).strip()
+
+    # Explicit BEGIN/COMMIT: pysqlite would otherwise autocommit each DDL statement
+    raw = engine.raw_connection()
+    try:
+        sqlite = raw.driver_connection
+        try:
+            sqlite.executescript(
+                "PRAGMA foreign_keys=OFF;"
+                "BEGIN;"
+                f"DROP TABLE IF EXISTS {staging};"
+                f"{create};"
+                f"INSERT INTO {staging} ({shared}) SELECT {shared} FROM {table.name};"
+                f"DROP TABLE {table.name};"
+                f"ALTER TABLE {staging} RENAME TO {table.name};"
+                "COMMIT;"
+            )
+        except Exception:
+            if sqlite.in_transaction:
+                sqlite.execute("ROLLBACK")
+            raise
+    finally:
+        raw.close()
+
+
+# ============================================================
+# ENTRY POINT
+# ============================================================
+
+def upgrade_schema(engine: Engine) -> List[str]:
+    """
+    Apply every pending upgrade step, then create missing model indexes.
+    Returns the changes made; anything still differing from the models is
+    printed as a warning.
+    """
+    applied = []
+    for needed, apply, description in UPGRADE_STEPS:
+        if needed(inspect(engine)):
+            apply(engine)
+            applied.append(description)
+            print(f"🛠️ Schema upgraded: {description}")
+
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        columns = {column["name"] for column in inspector.get_columns(table.name)}
+        for index in _missing_indexes(inspector, table):
+            if any(column.name not in columns for column in index.columns):
+                continue  # Needs a column no upgrade step adds yet (reported below)
+            try:
+                with engine.begin() as conn:
+                    index.create(conn)
+            except IntegrityError as e:
+                # Unique index over rows that already violate it; fix the data and re-run
+                print(f"⚠️ Index {index.name} not created: {e.orig}")
+                continue
+            applied.append(f"{table.name}: create index {index.name}")
+            print(f"🛠️ Schema upgraded: created index {index.name}")
+
+    for difference in schema_drift(engine):
+        print(f"⚠️ Schema differs from models: {difference}")
+    return applied
@@ -0,0 +1,152 @@
+"""
+Connection Profile
+Engine options, SQLite pragmas and pool checkout metrics, driven by Settings.
+
+- SQLite: WAL journal, synchronous=NORMAL, busy_timeout, mmap_size and
+  cache_size are applied to every new DBAPI connection (connect event),
+  so several workers can share one database file without
+  "database is locked" errors on concurrent writes.
+- Pooled engines: pool_size / max_overflow / pool_timeout / pool_recycle
+  come from Settings, and the time spent waiting for a checkout is
+  recorded per engine (see pool_stats).
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Dict, Type
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.pool import Pool, QueuePool, AsyncAdaptedQueuePool
+
+from app.core.config import settings
+
+
+class PoolStats:
+    """Checkout wait-time counters for one engine's connection pool."""
+
+    WINDOW = 1024  # Recent waits kept for percentiles
+
+    def __init__(self, name: str):
+        self.name = name
+        self.pool: Pool = None
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        self._recent = deque(maxlen=self.WINDOW)
+
+    def record_wait(self, seconds: float):
+        with self._lock:
+            self.checkouts += 1
+            self.total_wait += seconds
+            self.max_wait = max(self.max_wait, seconds)
+            self._recent.append(seconds)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            recent = sorted(self._recent)
+            checkouts = self.checkouts
+            total_wait = self.total_wait
+            max_wait = self.max_wait
+
+        result = {
+            "checkouts": checkouts,
+            "avg_wait_ms": round(total_wait / checkouts * 1000, 3) if checkouts else 0.0,
+            "p95_wait_ms": round(recent[int(len(recent) * 0.95) - 1] * 1000, 3) if recent else 0.0,
+            "max_wait_ms": round(max_wait * 1000, 3),
+        }
+
+        if isinstance(self.pool, QueuePool):
+            result.update(
+                size=self.pool.size(),
+                checked_out=self.pool.checkedout(),
+                overflow=self.pool.overflow()
+            )
+
+        return result
+
+
+# Pool statistics per engine ("sync", "async")
+pool_stats: Dict[str, PoolStats] = {}
+
+
+def _timed_pool_class(base: Type[QueuePool], stats: PoolStats) -> Type[QueuePool]:
+    """
+    Subclass a QueuePool so every checkout records how long it waited.
+    Pool.recreate() (engine.dispose()) reuses the class, so stats carry over.
+    """
+    def __init__(self, *args, **kwargs):
+        base.__init__(self, *args, **kwargs)
+        stats.pool = self
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return base._do_get(self)
+        finally:
+            stats.record_wait(time.perf_counter() - started)
+
+    return type(f"Timed{base.__name__}", (base,), {"__init__": __init__, "_do_get": _do_get})
+
+
+def _is_sqlite_memory(url) -> bool:
+    return url.database in (None, "", ":memory:") or url.query.get("mode") == "memory"
+
+
+def engine_options(database_url: str, name: str, is_async: bool = False) -> Dict[str, Any]:
+    """
+    Keyword arguments for create_engine / create_async_engine.
+    Registers a PoolStats under `name` for pooled engines.
+    """
+    url = make_url(database_url)
+    options: Dict[str, Any] = {}
+
+    if url.get_backend_name() == "sqlite":
+        if not is_async:
+            options["connect_args"] = {"check_same_thread": False}
+        if _is_sqlite_memory(url):
+            # In-memory databases keep SQLAlchemy's single-connection pools
+            return options
+
+    stats = pool_stats.setdefault(name, PoolStats(name))
+    options.update(
+        poolclass=_timed_pool_class(AsyncAdaptedQueuePool if is_async else QueuePool, stats),
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING
+    )
+    return options
+
+
+def sqlite_pragmas() -> Dict[str, Any]:
+    """PRAGMA name -> value applied to each new SQLite connection."""
+    return {
+        "journal_mode": settings.SQLITE_JOURNAL_MODE,
+        "synchronous": settings.SQLITE_SYNCHRONOUS,
+        "busy_timeout": settings.SQLITE_BUSY_TIMEOUT_MS,
+        "mmap_size": settings.SQLITE_MMAP_SIZE,
+        "cache_size": settings.SQLITE_CACHE_SIZE,
+    }
+
+
+def apply_connection_profile(engine: Engine):
+    """
+    Install the connect-event hooks for an engine.
+    For async engines pass engine.sync_engine.
+    """
+    if engine.dialect.name != "sqlite":
+        return
+
+    pragmas = sqlite_pragmas()
+
+    @event.listens_for(engine, "connect")
+    def _set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            for pragma, value in pragmas.items():
+                cursor.execute(f"PRAGMA {pragma}={value}")
+        finally:
+            cursor.close()
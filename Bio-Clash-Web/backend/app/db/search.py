@@ -0,0 +1,100 @@
+"""
+Full-Text Search Index
+SQLite FTS5 index over clans.name / tag / description.
+
+clans_fts is an external-content FTS5 table (the text stays in clans)
+using the trigram tokenizer, so the substring searches players type
+("drag" finds "Iron Dragons") are answered from the index instead of a
+LIKE '%...%' scan. Triggers keep it in sync with clans; power and member
+count updates do not touch it (AFTER UPDATE OF name, tag, description).
+
+The index is keyed by clans.rowid, which VACUUM may renumber: run
+`python -m app.cli rebuild-search-index` after a VACUUM.
+
+Other databases, and SQLite builds without FTS5/trigram (< 3.34), keep
+the plain ILIKE search (see clan_search_enabled).
+"""
+from typing import List
+
+from sqlalchemy import text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import OperationalError
+
+
+CLAN_FTS_TABLE = "clans_fts"
+
+_CLAN_FTS_TRIGGERS = [
+    """
+    CREATE TRIGGER IF NOT EXISTS clans_fts_insert AFTER INSERT ON clans BEGIN
+        INSERT INTO clans_fts(rowid, name, tag, description)
+        VALUES (new.rowid, new.name, new.tag, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS clans_fts_delete AFTER DELETE ON clans BEGIN
+        INSERT INTO clans_fts(clans_fts, rowid, name, tag, description)
+        VALUES ('delete', old.rowid, old.name, old.tag, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS clans_fts_update AFTER UPDATE OF name, tag, description ON clans BEGIN
+        INSERT INTO clans_fts(clans_fts, rowid, name, tag, description)
+        VALUES ('delete', old.rowid, old.name, old.tag, old.description);
+        INSERT INTO clans_fts(rowid, name, tag, description)
+        VALUES (new.rowid, new.name, new.tag, new.description);
+    END
+    """,
+]
+
+# Set by ensure_search_index() for this process
+clan_search_enabled = False
+
+
+def ensure_search_index(engine: Engine) -> bool:
+    """
+    Create the clan FTS table and its triggers if missing (after create_all).
+    A newly created index is filled from the existing clans.
+    """
+    global clan_search_enabled
+    if engine.dialect.name != "sqlite":
+        return False
+
+    try:
+        with engine.begin() as conn:
+            exists = conn.scalar(
+                text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"),
+                {"name": CLAN_FTS_TABLE}
+            )
+            if not exists:
+                conn.execute(text(
+                    "CREATE VIRTUAL TABLE clans_fts USING fts5("
+                    "name, tag, description, content='clans', content_rowid='rowid', tokenize='trigram')"
+                ))
+                conn.execute(text("INSERT INTO clans_fts(clans_fts) VALUES ('rebuild')"))
+                print("🔎 Clan search index built")
+            for trigger in _CLAN_FTS_TRIGGERS:
+                conn.execute(text(trigger))
+    except OperationalError as e:
+        print(f"⚠️ Clan search index unavailable, using LIKE search: {e.orig}")
+        return False
+
+    clan_search_enabled = True
+    return True
+
+
+def rebuild_search_index(engine: Engine):
+    """Re-read every clan into the index (after VACUUM or manual edits)."""
+    with engine.begin() as conn:
+        conn.execute(text("INSERT INTO clans_fts(clans_fts) VALUES ('rebuild')"))
+
+
+def fts_match_query(search: str) -> str:
+    """
+    FTS5 MATCH expression for a user search: every word must appear as a
+    substring (quoted, so FTS syntax in the input is taken literally).
+    Returns "" when a word is shorter than a trigram; callers use LIKE then.
+    """
+    terms: List[str] = search.split()
+    if not terms or any(len(term) < 3 for term in terms):
+        return ""
+    return " ".join('"' + term.replace('"', '""') + '"' for term in terms)
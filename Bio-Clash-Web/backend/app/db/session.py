@@ -1,33 +1,78 @@
 """
 Database Session Configuration
 SQLAlchemy engine and session management.
+
+- async_engine / AsyncSessionLocal: used by the API (routes, engines, background jobs)
+- engine / SessionLocal: blocking variant for scripts and interactive use
+
+Pool sizing and SQLite pragmas come from the connection profile (app/db/profile.py).
 """
 from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker, AsyncSession
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
 from app.core.config import settings
+from app.db.profile import engine_options, apply_connection_profile
+
+# Default async driver per backend when DATABASE_URL names a sync driver
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+# Drivers create_async_engine() accepts as they are
+ASYNC_CAPABLE_DRIVERS = {"aiosqlite", "asyncpg", "psycopg", "psycopg_async", "aiomysql", "asyncmy"}
 
-# Create engine
-engine = create_engine(
-    settings.DATABASE_URL,
-    connect_args={"check_same_thread": False} if "sqlite" in settings.DATABASE_URL else {}
+
+def get_async_database_url(url: str) -> str:
+    """
+    Derive an async driver URL from DATABASE_URL.
+    URLs that already name an async driver (e.g. postgresql+asyncpg://) are
+    kept as-is; sync drivers (sqlite+pysqlite://, postgresql+psycopg2://,
+    mysql+pymysql://) are swapped for the backend's async driver.
+    """
+    parsed = make_url(url)
+    backend, _, driver = parsed.drivername.partition("+")
+    if driver in ASYNC_CAPABLE_DRIVERS:
+        return url
+
+    async_driver = ASYNC_DRIVERS.get(backend)
+    if async_driver is None:
+        raise ValueError(f"No async driver known for '{parsed.drivername}', set ASYNC_DATABASE_URL")
+
+    return parsed.set(drivername=async_driver).render_as_string(hide_password=False)
+
+
+ASYNC_DATABASE_URL = settings.ASYNC_DATABASE_URL or get_async_database_url(settings.DATABASE_URL)
+
+# Create engines
+engine = create_engine(settings.DATABASE_URL, **engine_options(settings.DATABASE_URL, "sync"))
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL, "async", is_async=True)
 )
+apply_connection_profile(engine)
+apply_connection_profile(async_engine.sync_engine)
 
-# Create session factory
+# Create session factories
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False  # Attributes stay readable after commit without lazy IO
+)
 
 # Base class for models
 Base = declarative_base()
 
 
-def get_db():
+async def get_db():
     """
-    Dependency that yields a database session.
+    Dependency that yields an async database session.
     Use with FastAPI Depends().
     """
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
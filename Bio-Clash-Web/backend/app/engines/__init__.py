@@ -1,3 +1,5 @@
 # Engines package exports
 from app.engines.fairplay import FatigueOracle, LeagueClustering
 from app.engines.game import ResourceManager, UpgradeManager, RaidEngine
+from app.engines.volume import MuscleVolumeLedger
+from app.engines.importer import WorkoutImporter
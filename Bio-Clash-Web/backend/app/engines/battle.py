@@ -0,0 +1,440 @@
+"""
+Battle Simulator
+Deterministic fixed-timestep raid resolution with NumPy.
+
+Buildings and troops are stored as parallel arrays (struct-of-arrays:
+position, hit points, damage per second, range, target ...) and each
+tick of DT seconds is a handful of vectorized steps over all of them:
+
+1. Troops whose deployment time has come enter the battle.
+2. Troops without a live target pick the nearest building they prefer
+   (giants: defenses, goblins: resources, else any building).
+3. Troops out of range walk toward their target; the rest hit it.
+4. Each defense keeps its troop while it is alive and in range, otherwise
+   locks onto the nearest troop in range. Splash defenses damage every
+   troop within SPLASH_RADIUS of their target.
+5. Damage is applied to both sides at once; deaths become events.
+
+There is no randomness and ties go to the lowest index, so the same base,
+army and powers always give the same result: the server's resolution is
+authoritative and a replay of the event stream matches it exactly.
+
+Simplifications: buildings are points with BUILDING_RADIUS, troops walk
+in straight lines, and walls are ignored (no pathing, no destruction).
+"""
+import math
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from app.core.enums import BuildingType
+
+
+# ============================================================
+# UNIT STATS
+# ============================================================
+
+# Base troop stats; hit points and damage scale with the attacker's power
+TROOP_STATS = {
+    #            hit points, dps,  range, tiles/s, preferred target
+    "barbarian": {"hit_points": 45.0, "dps": 9.0, "range": 0.6, "speed": 2.0, "prefers": "any"},
+    "archer": {"hit_points": 20.0, "dps": 7.0, "range": 3.5, "speed": 2.4, "prefers": "any"},
+    "giant": {"hit_points": 300.0, "dps": 11.0, "range": 1.0, "speed": 1.5, "prefers": "defense"},
+    "goblin": {"hit_points": 25.0, "dps": 11.0, "range": 0.6, "speed": 3.2, "prefers": "resource"},
+}
+
+DEFENSE_BUILDINGS = {
+    BuildingType.CANNON, BuildingType.ARCHER_TOWER, BuildingType.MORTAR,
+    BuildingType.WIZARD_TOWER, BuildingType.INFERNO_TOWER, BuildingType.HIDDEN_TESLA,
+    BuildingType.X_BOW, BuildingType.EAGLE_ARTILLERY, BuildingType.AIR_DEFENSE,
+}
+RESOURCE_BUILDINGS = {
+    BuildingType.GOLD_MINE, BuildingType.ELIXIR_COLLECTOR, BuildingType.DARK_ELIXIR_DRILL,
+}
+SPLASH_RADIUS = {
+    BuildingType.MORTAR: 1.5,
+    BuildingType.WIZARD_TOWER: 1.0,
+    BuildingType.EAGLE_ARTILLERY: 2.0,
+}
+MIN_RANGE = {
+    BuildingType.MORTAR: 4.0,  # Cannot hit troops at its foot
+}
+
+_PREFERENCES = {"any": 0, "defense": 1, "resource": 2}
+_KIND_OTHER, _KIND_DEFENSE, _KIND_RESOURCE = 0, 1, 2
+
+
+def _distance2(x1: np.ndarray, y1: np.ndarray, x2: np.ndarray, y2: np.ndarray) -> np.ndarray:
+    """Squared distances between two point sets, len(x1) x len(x2) (in place, no sqrt)."""
+    dx = np.subtract.outer(x1, x2)
+    dx *= dx
+    dy = np.subtract.outer(y1, y2)
+    dy *= dy
+    dx += dy
+    return dx
+
+
+def power_multiplier(power: float) -> float:
+    """Stat multiplier for a side's biological power (1.0 at zero, slowly rising)."""
+    return 1.0 + math.log1p(max(power, 0.0) / BattleSimulator.POWER_SCALE)
+
+
+class BattleSimulator:
+    """
+    One raid: a defender's buildings against a list of troop deployments.
+
+    deployments: [{"troop": str, "x": float, "y": float, "at": seconds}, ...]
+    (validate_deployments() checks client input). run() resolves the whole
+    battle and returns stars, destruction and the event stream.
+    """
+
+    DT = 0.1                   # Seconds per tick
+    MAX_DURATION = 180.0       # Seconds; the battle ends at the time limit
+    BUILDING_RADIUS = 1.0      # Tiles; troop range is measured to the edge
+    POWER_SCALE = 5000.0       # Volume (kg) for +69% stats (log1p(1))
+    MAX_TROOPS = 300           # Deployments accepted per battle
+    DEPLOY_MARGIN = 10.0       # Tiles around the base where troops may land
+    DEPLOY_CLEARANCE = 1.5     # Tiles from any building (no dropping inside the base)
+
+    def __init__(
+        self,
+        buildings: Sequence[Any],
+        deployments: Sequence[Dict[str, Any]],
+        attack_power: float = 0.0,
+        defense_power: float = 0.0
+    ):
+        # --- Buildings (walls excluded), in id order for determinism ---
+        buildings = sorted(
+            (b for b in buildings if b.building_type != BuildingType.WALLS),
+            key=lambda b: b.id
+        )
+        defense_scale = power_multiplier(defense_power)
+        self.building_ids = [b.id for b in buildings]
+        self.building_types = [BuildingType(b.building_type).value for b in buildings]
+        self.bx = np.array([b.position_x + 0.5 for b in buildings], dtype=np.float32)
+        self.by = np.array([b.position_y + 0.5 for b in buildings], dtype=np.float32)
+        self.b_hp = np.array([b.max_health or b.health or 1 for b in buildings], dtype=float) * defense_scale
+        self.b_kind = np.array([
+            _KIND_DEFENSE if b.building_type in DEFENSE_BUILDINGS
+            else _KIND_RESOURCE if b.building_type in RESOURCE_BUILDINGS
+            else _KIND_OTHER
+            for b in buildings
+        ], dtype=np.int8)
+        self.b_dps = np.array([b.damage_per_second or 0.0 for b in buildings], dtype=float) * defense_scale
+        self.b_range2 = np.array([b.range_tiles or 0.0 for b in buildings], dtype=np.float32) ** 2
+        self.b_min_range2 = np.array([MIN_RANGE.get(b.building_type, 0.0) for b in buildings], dtype=np.float32) ** 2
+        self.b_splash2 = np.array([SPLASH_RADIUS.get(b.building_type, 0.0) for b in buildings], dtype=np.float32) ** 2
+        self.b_armed = (self.b_kind == _KIND_DEFENSE) & (self.b_dps > 0)
+        self.b_alive = np.ones(len(buildings), dtype=bool)
+        self.b_target = np.full(len(buildings), -1, dtype=np.int64)
+        self.b_next_scan = np.zeros(len(buildings), dtype=np.int64)  # Idle defenses: next tick a troop can be in range
+        self.town_hall = next(
+            (i for i, b in enumerate(buildings) if b.building_type == BuildingType.TOWN_HALL), None
+        )
+
+        # --- Troops, in deployment order ---
+        attack_scale = power_multiplier(attack_power)
+        order = sorted(range(len(deployments)), key=lambda i: (float(deployments[i].get("at", 0.0)), i))
+        deployments = [deployments[i] for i in order]
+        stats = [TROOP_STATS[d["troop"]] for d in deployments]
+        self.troop_types = [d["troop"] for d in deployments]
+        self.tx = np.array([float(d["x"]) for d in deployments], dtype=np.float32)
+        self.ty = np.array([float(d["y"]) for d in deployments], dtype=np.float32)
+        self.t_hp = np.array([s["hit_points"] for s in stats], dtype=float) * attack_scale
+        self.t_dps = np.array([s["dps"] for s in stats], dtype=float) * attack_scale
+        self.t_reach = np.array([s["range"] + self.BUILDING_RADIUS for s in stats], dtype=np.float32)
+        self.t_step = np.array([s["speed"] * self.DT for s in stats], dtype=np.float32)
+        self.t_prefers = np.array([_PREFERENCES[s["prefers"]] for s in stats], dtype=np.int8)
+        self.t_deploy_tick = np.array(
+            [int(round(float(d.get("at", 0.0)) / self.DT)) for d in deployments], dtype=np.int64
+        )
+        self.t_alive = np.zeros(len(deployments), dtype=bool)
+        self.max_step = float(self.t_step.max()) if len(deployments) else 0.0
+        self.t_target = np.full(len(deployments), -1, dtype=np.int64)
+
+        self.events: List[Dict[str, Any]] = []
+        self.stars = 0
+        self.destroyed = 0
+
+    # ============================================================
+    # INPUT
+    # ============================================================
+
+    @classmethod
+    def validate_deployments(cls, buildings: Sequence[Any], raw: Sequence[Any]) -> List[Dict[str, Any]]:
+        """
+        Check client-sent deployments and return them normalized.
+        Raises ValueError for unknown troops, bad positions or times.
+        """
+        if len(raw) > cls.MAX_TROOPS:
+            raise ValueError(f"At most {cls.MAX_TROOPS} troops per raid")
+
+        deployments = []
+        for item in raw:
+            troop = item.get("troop") if isinstance(item, dict) else None
+            if troop not in TROOP_STATS:
+                raise ValueError(f"Unknown troop {troop!r}")
+            try:
+                x, y, at = float(item["x"]), float(item["y"]), float(item.get("at", 0.0))
+            except (KeyError, TypeError, ValueError):
+                raise ValueError("Deployments need numeric x, y and at")
+            if not all(map(math.isfinite, (x, y, at))) or not 0 <= at < cls.MAX_DURATION:
+                raise ValueError(f"Deployment time must be within {cls.MAX_DURATION:.0f}s")
+            deployments.append({"troop": troop, "x": x, "y": y, "at": at})
+
+        if not deployments or not buildings:
+            return deployments
+
+        # Inside the deploy area, but not on top of the base
+        bx = np.array([b.position_x + 0.5 for b in buildings], dtype=float)
+        by = np.array([b.position_y + 0.5 for b in buildings], dtype=float)
+        x = np.array([d["x"] for d in deployments])
+        y = np.array([d["y"] for d in deployments])
+        outside = (
+            (x < bx.min() - cls.DEPLOY_MARGIN) | (x > bx.max() + cls.DEPLOY_MARGIN)
+            | (y < by.min() - cls.DEPLOY_MARGIN) | (y > by.max() + cls.DEPLOY_MARGIN)
+        )
+        if outside.any():
+            raise ValueError("Troops must be deployed near the base")
+        nearest = np.hypot(x[:, None] - bx[None, :], y[:, None] - by[None, :]).min(axis=1)
+        if (nearest < cls.DEPLOY_CLEARANCE).any():
+            raise ValueError("Troops cannot be deployed on top of buildings")
+        return deployments
+
+    @classmethod
+    def default_army(cls, buildings: Sequence[Any], attack_power: float) -> List[Dict[str, Any]]:
+        """
+        Army for raids without a deployment plan (REST raids, war attacks):
+        size grows with attack power, deployed in waves around the base.
+        """
+        size = min(cls.MAX_TROOPS, 10 + int(math.sqrt(max(attack_power, 0.0)) / 2))
+        composition = ["barbarian"] * 5 + ["archer"] * 3 + ["giant", "goblin"]
+
+        if buildings:
+            xs = [b.position_x + 0.5 for b in buildings]
+            ys = [b.position_y + 0.5 for b in buildings]
+            cx, cy = (min(xs) + max(xs)) / 2, (min(ys) + max(ys)) / 2
+            radius = max(max(xs) - min(xs), max(ys) - min(ys)) / 2 + cls.DEPLOY_CLEARANCE + 1.0
+        else:
+            cx = cy = 0.0
+            radius = cls.DEPLOY_CLEARANCE + 1.0
+
+        sides = 8  # Deploy points on a circle around the base
+        return [
+            {
+                "troop": composition[i % len(composition)],
+                "x": cx + radius * math.cos(2 * math.pi * (i % sides) / sides),
+                "y": cy + radius * math.sin(2 * math.pi * (i % sides) / sides),
+                "at": (i // sides) * 0.5,
+            }
+            for i in range(size)
+        ]
+
+    # ============================================================
+    # SIMULATION
+    # ============================================================
+
+    def run(self) -> Dict[str, Any]:
+        """Resolve the battle; returns the result and its event stream."""
+        n_buildings = len(self.building_ids)
+        n_troops = len(self.troop_types)
+        max_ticks = int(round(self.MAX_DURATION / self.DT))
+        deployed = 0
+        tick = 0
+        reason = "time_up"
+
+        if n_buildings == 0:
+            reason = "no_buildings"  # Nothing to destroy, nothing earned
+        else:
+            for tick in range(max_ticks):
+                # 1. Deployments due this tick (sorted by tick)
+                due = int(np.searchsorted(self.t_deploy_tick, tick, side="right"))
+                if due > deployed:
+                    self.t_alive[deployed:due] = True
+                    self.b_next_scan[:] = tick  # New troops may land in range
+                    for i in range(deployed, due):
+                        self._event(tick, "troop_deployed", troop=i, troop_type=self.troop_types[i],
+                                    x=round(float(self.tx[i]), 2), y=round(float(self.ty[i]), 2))
+                    deployed = due
+
+                active = np.flatnonzero(self.t_alive)
+                if active.size == 0:
+                    if deployed == n_troops:
+                        reason = "army_defeated"
+                        break
+                    continue
+
+                self._acquire_targets(active)
+                building_damage = self._troops_act(active)
+                troop_damage = self._defenses_act(tick, active, n_troops)
+
+                # 5. Simultaneous damage
+                self.b_hp -= building_damage
+                self.t_hp -= troop_damage
+                self._resolve_deaths(tick, active)
+
+                if self.destroyed == n_buildings:
+                    reason = "all_destroyed"
+                    break
+            else:
+                tick = max_ticks
+
+        duration = round(tick * self.DT, 2)
+        destruction = self.destruction_percent()
+        self._event(tick, "battle_ended", reason=reason, stars=self.stars, destruction=destruction)
+        return {
+            "stars": self.stars,
+            "destruction_percent": destruction,
+            "town_hall_destroyed": self.town_hall is not None and not self.b_alive[self.town_hall],
+            "reason": reason,
+            "duration_seconds": duration,
+            "ticks": tick,
+            "troops_deployed": deployed,
+            "troops_lost": int(deployed - self.t_alive.sum()),
+            "buildings_destroyed": self.destroyed,
+            "buildings_total": n_buildings,
+            "events": self.events,
+        }
+
+    def _acquire_targets(self, active: np.ndarray):
+        """2. Nearest preferred live building for troops without a live target."""
+        current = self.t_target[active]
+        needs = active[(current < 0) | ~self.b_alive[np.maximum(current, 0)]]
+        if needs.size == 0:
+            return
+
+        distance2 = _distance2(self.tx[needs], self.ty[needs], self.bx, self.by)
+        prefers = self.t_prefers[needs, None]
+        allowed = self.b_alive & ((prefers == 0) | (self.b_kind == prefers))
+        # Preferred kind all destroyed: any building will do
+        allowed[~allowed.any(axis=1)] = self.b_alive
+        distance2[~allowed] = np.inf
+        self.t_target[needs] = distance2.argmin(axis=1)
+
+    def _troops_act(self, active: np.ndarray) -> np.ndarray:
+        """3. Move toward targets or hit them; returns damage per building."""
+        target = self.t_target[active]
+        dx = self.bx[target] - self.tx[active]
+        dy = self.by[target] - self.ty[active]
+        distance = np.sqrt(dx * dx + dy * dy)
+        reach = self.t_reach[active]
+        in_range = distance <= reach
+
+        walking = ~in_range
+        if walking.any():
+            movers = active[walking]
+            step = np.minimum(self.t_step[movers], distance[walking] - reach[walking])
+            scale = step / distance[walking]
+            self.tx[movers] += dx[walking] * scale
+            self.ty[movers] += dy[walking] * scale
+
+        return np.bincount(
+            target[in_range], weights=self.t_dps[active[in_range]] * self.DT, minlength=len(self.building_ids)
+        )
+
+    def _defenses_act(self, tick: int, active: np.ndarray, n_troops: int) -> np.ndarray:
+        """
+        4. Defenses keep or pick a troop in range and fire; returns damage per troop.
+        A defense with nothing in range skips the scan until the nearest troop,
+        walking at full speed, could have reached its range.
+        """
+        damage = np.zeros(n_troops)
+        defenses = np.flatnonzero(self.b_alive & self.b_armed)
+        if defenses.size == 0:
+            return damage
+        bx, by = self.bx[defenses], self.by[defenses]
+        range2, min_range2 = self.b_range2[defenses], self.b_min_range2[defenses]
+
+        # Keep the current target while it is alive and in range
+        target = self.b_target[defenses]
+        current = np.maximum(target, 0)
+        dx, dy = bx - self.tx[current], by - self.ty[current]
+        distance2 = dx * dx + dy * dy
+        keep = (target >= 0) & self.t_alive[current] & (distance2 <= range2) & (distance2 >= min_range2)
+
+        # The others lock onto the nearest troop in range (defenses x troops)
+        retarget = np.flatnonzero(~keep & (self.b_next_scan[defenses] <= tick))
+        target[~keep] = -1
+        if retarget.size:
+            distance2 = _distance2(bx[retarget], by[retarget], self.tx[active], self.ty[active])
+            closest2 = distance2.min(axis=1)
+            reachable = distance2 <= range2[retarget, None]
+            if min_range2[retarget].any():
+                reachable &= distance2 >= min_range2[retarget, None]
+            distance2[~reachable] = np.inf
+            nearest = distance2.argmin(axis=1)
+            found = reachable[np.arange(retarget.size), nearest]
+            target[retarget] = np.where(found, active[nearest], -1)
+
+            idle = ~found
+            if idle.any() and self.max_step > 0:
+                gap = np.sqrt(closest2[idle]) - np.sqrt(range2[retarget[idle]])
+                wait = np.maximum(np.floor(gap / self.max_step), 1).astype(np.int64)
+                self.b_next_scan[defenses[retarget[idle]]] = tick + wait
+        self.b_target[defenses] = target
+
+        firing = target >= 0
+        if not firing.any():
+            return damage
+
+        shots = self.b_dps[defenses[firing]] * self.DT
+        splash2 = self.b_splash2[defenses[firing]]
+        hit = target[firing]
+
+        single = splash2 == 0
+        damage += np.bincount(hit[single], weights=shots[single], minlength=n_troops)
+
+        if not single.all():
+            # Every troop within the splash radius of the target takes the hit
+            # (bincount sums in a fixed order, unlike a BLAS product)
+            center = hit[~single]
+            inside = _distance2(self.tx[center], self.ty[center], self.tx[active], self.ty[active]) <= splash2[~single, None]
+            rows, columns = inside.nonzero()
+            damage[active] += np.bincount(columns, weights=shots[~single][rows], minlength=active.size)
+        return damage
+
+    def _resolve_deaths(self, tick: int, active: np.ndarray):
+        for i in np.flatnonzero(self.b_alive & (self.b_hp <= 0)):
+            self.b_alive[i] = False
+            self.destroyed += 1
+            self._event(tick, "building_destroyed", building_id=self.building_ids[i],
+                        building_type=self.building_types[i], destruction=self.destruction_percent())
+            self._award_stars(tick)
+
+        dead = active[self.t_hp[active] <= 0]
+        if dead.size:
+            self.t_alive[dead] = False
+            for i in dead:
+                self._event(tick, "troop_defeated", troop=int(i), troop_type=self.troop_types[i])
+
+    def _award_stars(self, tick: int):
+        """One star each: 50% destruction, town hall destroyed, 100% destruction."""
+        everything = self.destroyed == len(self.building_ids)
+        earned = (
+            int(self.destroyed * 2 >= len(self.building_ids))
+            + int(everything if self.town_hall is None else not self.b_alive[self.town_hall])
+            + int(everything)
+        )
+        while self.stars < earned:
+            self.stars += 1
+            self._event(tick, "star_earned", stars=self.stars)
+
+    def destruction_percent(self) -> float:
+        if not self.building_ids:
+            return 0.0
+        return round(100.0 * self.destroyed / len(self.building_ids), 1)
+
+    def _event(self, tick: int, kind: str, **data: Any):
+        self.events.append({"type": kind, "t": round(tick * self.DT, 2), **data})
+
+
+def simulate(
+    buildings: Sequence[Any],
+    deployments: Optional[Sequence[Dict[str, Any]]],
+    attack_power: float,
+    defense_power: float
+) -> Dict[str, Any]:
+    """Resolve a raid; without deployments the default army attacks."""
+    if deployments is None:
+        deployments = BattleSimulator.default_army(buildings, attack_power)
+    return BattleSimulator(buildings, deployments, attack_power, defense_power).run()
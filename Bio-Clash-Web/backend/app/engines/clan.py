@@ -3,13 +3,17 @@ Clan Engine
 Handles clan management, war matchmaking, and war battles.
 """
 from datetime import datetime, timedelta
-from typing import List, Optional, Tuple
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import select, update, delete, func, bindparam, or_, text, table, literal_column
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.enums import ClanRole, WarState
+from app.core.websocket import manager
+from app.db import search as search_index
 from app.models.clan import Clan, ClanMember, ClanWar, WarAttack
 from app.models.user import User
+from app.models.fitness import UserMuscleVolume
 from app.engines.game import RaidEngine
 
 
@@ -18,19 +22,22 @@ class ClanManager:
     Manages clan creation, membership, and stats.
     """
     
-    def __init__(self, db: Session):
+    POWER_DRIFT_TOLERANCE = 1e-6  # Relative; float rounding is not drift
+    
+    def __init__(self, db: AsyncSession):
         self.db = db
     
-    def create_clan(self, user_id: str, name: str, tag: str, **kwargs) -> Clan:
+    async def create_clan(self, user_id: str, name: str, tag: str, **kwargs) -> Clan:
         """
         Create a new clan with the user as leader.
         """
         # Check if user is already in a clan
-        existing = self.db.query(ClanMember).filter(ClanMember.user_id == user_id).first()
+        existing = await self.db.scalar(select(ClanMember).where(ClanMember.user_id == user_id))
         if existing:
             raise ValueError("You must leave your current clan first")
         
-        # Create clan
+        # Create clan, starting from the leader's power
+        attack, defense = await RaidEngine(self.db, user_id).calculate_power(user_id)
         clan = Clan(
             name=name,
             tag=tag.upper(),
@@ -38,10 +45,17 @@ class ClanManager:
             badge_icon=kwargs.get("badge_icon", "shield"),
             badge_color=kwargs.get("badge_color", "#FFD700"),
             is_public=kwargs.get("is_public", True),
-            min_trophies_required=kwargs.get("min_trophies_required", 0)
+            min_trophies_required=kwargs.get("min_trophies_required", 0),
+            total_attack_power=attack,
+            total_defense_power=defense,
+            member_count=1
         )
         self.db.add(clan)
-        self.db.flush()
+        try:
+            await self.db.flush()
+        except IntegrityError:
+            await self.db.rollback()
+            raise ValueError("Clan name or tag is already taken")
         
         # Add creator as leader
         leader = ClanMember(
@@ -50,90 +64,109 @@ class ClanManager:
             role=ClanRole.LEADER
         )
         self.db.add(leader)
-        self.db.commit()
+        await self._commit_membership()
         
         return clan
     
-    def join_clan(self, user_id: str, clan_id: str) -> ClanMember:
+    async def join_clan(self, user_id: str, clan_id: str) -> ClanMember:
         """
         Join a clan.
         """
         # Check if already in a clan
-        existing = self.db.query(ClanMember).filter(ClanMember.user_id == user_id).first()
+        existing = await self.db.scalar(select(ClanMember).where(ClanMember.user_id == user_id))
         if existing:
             raise ValueError("You must leave your current clan first")
         
-        # Get clan
-        clan = self.db.query(Clan).filter(Clan.id == clan_id).first()
-        if not clan:
-            raise ValueError("Clan not found")
-        
-        if not clan.is_public:
-            raise ValueError("This clan is invite-only")
-        
-        # Check member count
-        member_count = self.db.query(ClanMember).filter(ClanMember.clan_id == clan_id).count()
-        if member_count >= clan.max_members:
+        # Claim a seat: one conditional UPDATE, so concurrent joins cannot
+        # overfill the clan between a count and the insert
+        claimed = await self.db.scalar(
+            update(Clan)
+            .where(Clan.id == clan_id, Clan.is_public == True, Clan.member_count < Clan.max_members)
+            .values(member_count=Clan.member_count + 1)
+            .returning(Clan.id)
+        )
+        if claimed is None:
+            clan = await self.db.get(Clan, clan_id)
+            if not clan:
+                raise ValueError("Clan not found")
+            if not clan.is_public:
+                raise ValueError("This clan is invite-only")
             raise ValueError("Clan is full")
         
-        # Add member
+        # Add member and their power in one transaction
         member = ClanMember(
             clan_id=clan_id,
             user_id=user_id,
             role=ClanRole.MEMBER
         )
         self.db.add(member)
-        self.db.commit()
         
-        # Update clan power
-        self._recalculate_clan_power(clan_id)
+        attack, defense = await RaidEngine(self.db, user_id).calculate_power(user_id)
+        await self._adjust_clan_power(clan_id, attack, defense)
+        await self._commit_membership()
         
         return member
     
-    def leave_clan(self, user_id: str) -> bool:
+    async def leave_clan(self, user_id: str) -> bool:
         """
         Leave current clan.
         """
-        member = self.db.query(ClanMember).filter(ClanMember.user_id == user_id).first()
+        member = await self.db.scalar(select(ClanMember).where(ClanMember.user_id == user_id))
         if not member:
             return False
         
         clan_id = member.clan_id
+        clan_deleted = False
         
         # Leaders can't leave, must transfer leadership first
         if member.role == ClanRole.LEADER:
-            other_members = self.db.query(ClanMember).filter(
-                ClanMember.clan_id == clan_id,
-                ClanMember.user_id != user_id
-            ).count()
+            other_members = await self.db.scalar(
+                select(func.count(ClanMember.id)).where(
+                    ClanMember.clan_id == clan_id,
+                    ClanMember.user_id != user_id
+                )
+            )
             
             if other_members > 0:
                 raise ValueError("Transfer leadership before leaving")
             else:
-                # Last member, delete clan
-                self.db.query(Clan).filter(Clan.id == clan_id).delete()
+                # Last member, delete clan (and its matchmaking entry)
+                await self.db.execute(
+                    delete(ClanWar).where(ClanWar.clan_id == clan_id, ClanWar.state == WarState.MATCHMAKING)
+                )
+                await self.db.execute(delete(Clan).where(Clan.id == clan_id))
+                clan_deleted = True
+        
+        await self.db.delete(member)
         
-        self.db.delete(member)
-        self.db.commit()
+        # Remove the member and their power from the clan totals
+        if not clan_deleted:
+            attack, defense = await RaidEngine(self.db, user_id).calculate_power(user_id)
+            await self._adjust_clan_power(clan_id, -attack, -defense, members=-1)
         
-        # Recalculate power if clan still exists
-        clan = self.db.query(Clan).filter(Clan.id == clan_id).first()
-        if clan:
-            self._recalculate_clan_power(clan_id)
+        await self.db.commit()
         
         return True
     
-    def promote_member(self, leader_id: str, member_id: str, new_role: ClanRole) -> bool:
+    async def _commit_membership(self):
+        """Commit a new membership; the unique user_id index rejects a second clan."""
+        try:
+            await self.db.commit()
+        except IntegrityError:
+            await self.db.rollback()
+            raise ValueError("You must leave your current clan first")
+    
+    async def promote_member(self, leader_id: str, member_id: str, new_role: ClanRole) -> bool:
         """
         Promote/demote a clan member.
         """
         # Get leader's membership
-        leader_member = self.db.query(ClanMember).filter(ClanMember.user_id == leader_id).first()
+        leader_member = await self.db.scalar(select(ClanMember).where(ClanMember.user_id == leader_id))
         if not leader_member or leader_member.role not in [ClanRole.LEADER, ClanRole.CO_LEADER]:
             raise ValueError("Insufficient permissions")
         
         # Get target member
-        target = self.db.query(ClanMember).filter(ClanMember.id == member_id).first()
+        target = await self.db.get(ClanMember, member_id)
         if not target or target.clan_id != leader_member.clan_id:
             raise ValueError("Member not found in your clan")
         
@@ -142,31 +175,180 @@ class ClanManager:
             raise ValueError("Use transfer leadership for leader role")
         
         target.role = new_role
-        self.db.commit()
+        await self.db.commit()
         return True
     
-    def _recalculate_clan_power(self, clan_id: str):
+    # ============================================================
+    # CLAN SEARCH
+    # ============================================================
+    
+    SEARCH_SORTS = ("relevance", "members", "trophies", "power", "level", "newest")
+    
+    @staticmethod
+    async def search(
+        db: AsyncSession,
+        text_query: str = "",
+        min_members: int = 0,
+        has_space: bool = False,
+        sort: Optional[str] = None,
+        limit: int = 20,
+        offset: int = 0
+    ) -> List[Clan]:
         """
-        Recalculate total clan attack and defense power.
-        Aggregates biological stats from all members.
+        Public clans matching a name/tag/description search, filtered,
+        ordered and paginated in one query. Text search uses the FTS index
+        (app/db/search.py) when available, otherwise name/tag ILIKE.
         """
-        clan = self.db.query(Clan).filter(Clan.id == clan_id).first()
-        if not clan:
+        query = select(Clan).where(Clan.is_public == True)
+        if min_members > 0:
+            query = query.where(Clan.member_count >= min_members)
+        if has_space:
+            query = query.where(Clan.member_count < Clan.max_members)
+        
+        rank = None
+        text_query = text_query.strip()
+        if text_query:
+            match = search_index.fts_match_query(text_query) if search_index.clan_search_enabled else ""
+            if match:
+                # bm25 weights: name 10, tag 5, description 1 (lower is better)
+                hits = (
+                    select(
+                        literal_column("clans_fts.rowid").label("clan_rowid"),
+                        literal_column("bm25(clans_fts, 10.0, 5.0, 1.0)").label("rank")
+                    )
+                    .select_from(table(search_index.CLAN_FTS_TABLE))
+                    .where(text("clans_fts MATCH :match").bindparams(match=match))
+                    .subquery()
+                )
+                query = query.join(hits, hits.c.clan_rowid == literal_column("clans.rowid"))
+                rank = hits.c.rank
+            else:
+                query = query.where(or_(
+                    Clan.name.icontains(text_query, autoescape=True),
+                    Clan.tag.icontains(text_query, autoescape=True)
+                ))
+        
+        sort = sort or ("relevance" if rank is not None else "members")
+        order = {
+            "members": [Clan.member_count.desc()],
+            "trophies": [Clan.total_trophies.desc()],
+            "power": [(Clan.total_attack_power + Clan.total_defense_power).desc()],
+            "level": [Clan.level.desc(), Clan.total_xp.desc()],
+            "newest": [Clan.created_at.desc()],
+        }.get(sort, [])
+        if sort == "relevance" and rank is not None:
+            order = [rank, Clan.member_count.desc()]
+        
+        query = query.order_by(*order, Clan.id).limit(limit).offset(offset)
+        return list((await db.scalars(query)).all())
+    
+    # ============================================================
+    # CLAN POWER
+    # Totals are maintained by deltas; reconcile_power() and
+    # reconcile_member_counts() repair drift.
+    # ============================================================
+    
+    async def _adjust_clan_power(self, clan_id: str, attack: float, defense: float, members: int = 0):
+        """Add a power (and member count) delta to a clan (atomic UPDATE; caller commits)."""
+        await self.db.execute(
+            update(Clan).where(Clan.id == clan_id).values(
+                total_attack_power=Clan.total_attack_power + attack,
+                total_defense_power=Clan.total_defense_power + defense,
+                member_count=Clan.member_count + members
+            )
+        )
+    
+    @staticmethod
+    async def apply_power_delta(db: AsyncSession, user_id: str, attack: float, defense: float):
+        """
+        Add a member's power change (e.g. a logged workout) to their clan,
+        if they have one. Does not commit: the caller owns the transaction.
+        """
+        if not attack and not defense:
             return
         
-        total_attack = 0.0
-        total_defense = 0.0
-        
-        members = self.db.query(ClanMember).filter(ClanMember.clan_id == clan_id).all()
-        
-        for member in members:
-            raid_engine = RaidEngine(self.db, member.user_id)
-            total_attack += raid_engine.calculate_attack_power()
-            total_defense += raid_engine.calculate_defense_power(member.user_id)
+        clan_id = select(ClanMember.clan_id).where(ClanMember.user_id == user_id).scalar_subquery()
+        await db.execute(
+            update(Clan).where(Clan.id == clan_id).values(
+                total_attack_power=Clan.total_attack_power + attack,
+                total_defense_power=Clan.total_defense_power + defense
+            )
+        )
+    
+    @staticmethod
+    async def reconcile_power(db: AsyncSession) -> Dict[str, Any]:
+        """
+        Recompute every clan's totals from the muscle ledger with one
+        aggregate query and correct the ones that drifted.
+        """
+        attack, defense = RaidEngine.power_columns()
+        member_power = (
+            select(UserMuscleVolume.user_id, attack.label("attack"), defense.label("defense"))
+            .group_by(UserMuscleVolume.user_id)
+            .subquery()
+        )
+        clan_power = (
+            select(
+                ClanMember.clan_id,
+                func.sum(member_power.c.attack).label("attack"),
+                func.sum(member_power.c.defense).label("defense")
+            )
+            .join(member_power, member_power.c.user_id == ClanMember.user_id)
+            .group_by(ClanMember.clan_id)
+            .subquery()
+        )
+        rows = (await db.execute(
+            select(
+                Clan.id,
+                Clan.total_attack_power,
+                Clan.total_defense_power,
+                func.coalesce(clan_power.c.attack, 0.0),
+                func.coalesce(clan_power.c.defense, 0.0)
+            ).outerjoin(clan_power, clan_power.c.clan_id == Clan.id)
+        )).all()
+        
+        drifted = []
+        max_drift = 0.0
+        for clan_id, stored_attack, stored_defense, actual_attack, actual_defense in rows:
+            drift = max(abs((stored_attack or 0.0) - actual_attack), abs((stored_defense or 0.0) - actual_defense))
+            if drift > ClanManager.POWER_DRIFT_TOLERANCE * max(1.0, actual_attack, actual_defense):
+                drifted.append({"b_id": clan_id, "b_attack": actual_attack, "b_defense": actual_defense})
+                max_drift = max(max_drift, drift)
+        
+        if drifted:
+            clans = Clan.__table__
+            await db.execute(
+                update(clans).where(clans.c.id == bindparam("b_id")).values(
+                    total_attack_power=bindparam("b_attack"),
+                    total_defense_power=bindparam("b_defense")
+                ),
+                drifted
+            )
+            await db.commit()
+            print(f"⚠️ Clan power drift corrected for {len(drifted)} clans (max {max_drift:.1f})")
         
-        clan.total_attack_power = total_attack
-        clan.total_defense_power = total_defense
-        self.db.commit()
+        return {"clans": len(rows), "drifted": len(drifted), "max_drift": round(max_drift, 3)}
+    
+    @staticmethod
+    async def reconcile_member_counts(db: AsyncSession) -> int:
+        """
+        Reset member_count from clan_members where it disagrees (one
+        correlated UPDATE). The column itself is added and backfilled on
+        existing databases by upgrade_schema() (app/db/migrate.py).
+        """
+        actual = (
+            select(func.count(ClanMember.id))
+            .where(ClanMember.clan_id == Clan.id)
+            .scalar_subquery()
+        )
+        fixed = (await db.scalars(
+            update(Clan).where(Clan.member_count != actual).values(member_count=actual).returning(Clan.id)
+        )).all()
+        await db.commit()
+        
+        if fixed:
+            print(f"⚠️ Clan member counts corrected for {len(fixed)} clans")
+        return len(fixed)
 
 
 class ClanWarEngine:
@@ -177,89 +359,236 @@ class ClanWarEngine:
     PREP_DURATION_HOURS = 24
     BATTLE_DURATION_HOURS = 48
     MAX_ATTACKS_PER_MEMBER = 2
+    RESOLVE_BATCH_SIZE = 500  # Ended wars resolved per commit
     
-    def __init__(self, db: Session):
+    # Matchmaking queue: power window = tolerance * max(power, floor)
+    MATCH_TOLERANCE = 0.10  # Initial window, as a fraction of power
+    MATCH_TOLERANCE_PER_MINUTE = 0.02  # Widening per minute waited
+    MATCH_TOLERANCE_MAX = 0.50
+    MATCH_POWER_FLOOR = 1000.0  # Window base for new/weak clans
+    MATCH_CANDIDATES = 10  # Nearest waiting clans tried on each side per search
+    MATCH_BATCH_SIZE = 500  # Pairs claimed per commit
+    
+    def __init__(self, db: AsyncSession):
         self.db = db
     
-    def start_war_search(self, clan_id: str) -> ClanWar:
+    async def start_war_search(self, clan_id: str, now: Optional[datetime] = None) -> ClanWar:
         """
         Start searching for a war opponent.
-        Uses K-Means-like matching on total clan power.
+        
+        The nearest waiting clans by attack power are tried first; a match is
+        claimed with a conditional UPDATE, so concurrent searches can never
+        take the same opponent. Without a match the clan joins the queue and
+        is paired later by match_queue() as its power tolerance widens.
         """
-        clan = self.db.query(Clan).filter(Clan.id == clan_id).first()
+        now = now or datetime.utcnow()
+        clan = await self.db.get(Clan, clan_id)
         if not clan:
             raise ValueError("Clan not found")
         
-        # Check if already in a war
-        active_war = self.db.query(ClanWar).filter(
-            ClanWar.clan_id == clan_id,
-            ClanWar.state.in_([WarState.MATCHMAKING, WarState.PREPARATION, WarState.BATTLE])
-        ).first()
+        # Check if already in a war (on either side)
+        active_war = await self.db.scalar(
+            select(ClanWar.id).where(
+                (ClanWar.clan_id == clan_id) | (ClanWar.opponent_clan_id == clan_id),
+                ClanWar.state.in_([WarState.MATCHMAKING, WarState.PREPARATION, WarState.BATTLE])
+            ).limit(1)
+        )
         
         if active_war:
             raise ValueError("Already in an active war")
         
-        # Find a suitable opponent
-        opponent = self._find_opponent(clan)
-        
-        if opponent:
-            # Create war
-            war = ClanWar(
-                clan_id=clan_id,
-                opponent_clan_id=opponent.id,
-                state=WarState.PREPARATION,
-                battle_start=datetime.utcnow() + timedelta(hours=self.PREP_DURATION_HOURS)
-            )
-        else:
-            # No opponent found, put in matchmaking queue
-            war = ClanWar(
-                clan_id=clan_id,
-                opponent_clan_id=None,
-                state=WarState.MATCHMAKING
-            )
+        power = clan.total_attack_power or 0.0
+        for candidate in await self._nearest_waiting(clan_id, power, now):
+            war = await self._claim(candidate, clan_id, now)
+            if war:
+                await self.db.commit()
+                await self._notify_matched([war], now)
+                return war
         
+        # No opponent found, put in matchmaking queue
+        war = ClanWar(
+            clan_id=clan_id,
+            opponent_clan_id=None,
+            state=WarState.MATCHMAKING,
+            search_power=power,
+            preparation_start=now
+        )
         self.db.add(war)
-        self.db.commit()
+        try:
+            await self.db.commit()
+        except IntegrityError:
+            # A concurrent search already queued this clan
+            await self.db.rollback()
+            raise ValueError("Already in an active war")
+        
         return war
     
-    def _find_opponent(self, clan: Clan) -> Optional[Clan]:
+    # ============================================================
+    # MATCHMAKING QUEUE
+    # ============================================================
+    
+    @classmethod
+    def match_window(cls, power: float, queued_at: Optional[datetime], now: datetime) -> float:
+        """Largest power difference a clan accepts after waiting since queued_at."""
+        waited = max(0.0, (now - queued_at).total_seconds() / 60) if queued_at else 0.0
+        tolerance = min(cls.MATCH_TOLERANCE + cls.MATCH_TOLERANCE_PER_MINUTE * waited, cls.MATCH_TOLERANCE_MAX)
+        return tolerance * max(power, cls.MATCH_POWER_FLOOR)
+    
+    async def _nearest_waiting(self, clan_id: str, power: float, now: datetime) -> List[Any]:
         """
-        Find a suitable opponent based on power level.
+        Waiting clans acceptable to either side, closest power first.
+        Two index range scans (below / above) on (state, search_power).
         """
-        # Look for other clans in matchmaking
-        matchmaking_wars = self.db.query(ClanWar).filter(
-            ClanWar.state == WarState.MATCHMAKING,
-            ClanWar.clan_id != clan.id
-        ).all()
-        
-        if matchmaking_wars:
-            # Match with the first one in queue (simple FIFO)
-            opponent_id = matchmaking_wars[0].clan_id
-            opponent = self.db.query(Clan).filter(Clan.id == opponent_id).first()
-            
-            # Remove opponent's matchmaking entry
-            self.db.delete(matchmaking_wars[0])
-            
-            return opponent
-        
-        # No one in queue, look for similar power clans
-        power_range = clan.total_attack_power * 0.3  # 30% tolerance
+        columns = (ClanWar.id, ClanWar.clan_id, ClanWar.search_power, ClanWar.preparation_start)
+        waiting = (ClanWar.state == WarState.MATCHMAKING, ClanWar.clan_id != clan_id)
+        below = (await self.db.execute(
+            select(*columns).where(*waiting, ClanWar.search_power <= power)
+            .order_by(ClanWar.search_power.desc()).limit(self.MATCH_CANDIDATES)
+        )).all()
+        above = (await self.db.execute(
+            select(*columns).where(*waiting, ClanWar.search_power > power)
+            .order_by(ClanWar.search_power).limit(self.MATCH_CANDIDATES)
+        )).all()
+        
+        own_window = self.match_window(power, now, now)
+        candidates = [
+            row for row in (*below, *above)
+            if abs(row.search_power - power) <= max(
+                own_window, self.match_window(row.search_power, row.preparation_start, now)
+            )
+        ]
+        candidates.sort(key=lambda row: (abs(row.search_power - power), row.preparation_start))
+        return candidates
+    
+    async def _claim(self, candidate: Any, clan_id: str, now: datetime) -> Optional[ClanWar]:
+        """
+        Turn a waiting clan's queue entry into a war against clan_id.
+        Only succeeds if the entry is still waiting (atomic conditional UPDATE).
+        """
+        claimed = (await self.db.execute(
+            update(ClanWar)
+            .where(ClanWar.id == candidate.id, ClanWar.state == WarState.MATCHMAKING)
+            .values(
+                opponent_clan_id=clan_id,
+                state=WarState.PREPARATION,
+                preparation_start=now,
+                battle_start=now + timedelta(hours=self.PREP_DURATION_HOURS)
+            )
+            .returning(ClanWar.id),
+            execution_options={"synchronize_session": False}
+        )).scalar()
         
-        opponent = self.db.query(Clan).filter(
-            Clan.id != clan.id,
-            Clan.total_attack_power >= clan.total_attack_power - power_range,
-            Clan.total_attack_power <= clan.total_attack_power + power_range
-        ).first()
+        if claimed is None:
+            return None
+        return await self.db.get(ClanWar, claimed, populate_existing=True)
+    
+    async def match_queue(self, now: Optional[datetime] = None) -> Dict[str, int]:
+        """
+        Background task (war_matchmaking job): pair waiting clans in bulk.
         
-        return opponent
+        The queue is read once in power order and adjacent clans are paired
+        greedily when their power gap fits the wider of their two windows.
+        Each batch claims its entries with one DELETE ... RETURNING; a pair
+        becomes a war under the longer waiter's entry id, and entries whose
+        partner was taken by a concurrent search go back into the queue.
+        """
+        now = now or datetime.utcnow()
+        queue = (await self.db.execute(
+            select(ClanWar.id, ClanWar.clan_id, ClanWar.search_power, ClanWar.preparation_start)
+            .where(ClanWar.state == WarState.MATCHMAKING)
+            .order_by(ClanWar.search_power)
+        )).all()
+        
+        pairs = []
+        i = 0
+        while i < len(queue) - 1:
+            a, b = queue[i], queue[i + 1]
+            gap = b.search_power - a.search_power
+            if gap <= max(
+                self.match_window(a.search_power, a.preparation_start, now),
+                self.match_window(b.search_power, b.preparation_start, now)
+            ):
+                # The longer waiter hosts the war
+                pairs.append((a, b) if a.preparation_start <= b.preparation_start else (b, a))
+                i += 2
+            else:
+                i += 1
+        
+        matched = 0
+        lost = 0
+        for start in range(0, len(pairs), self.MATCH_BATCH_SIZE):
+            batch = pairs[start:start + self.MATCH_BATCH_SIZE]
+            wars = await self._pair_batch(batch, now)
+            await self.db.commit()
+            await self._notify_matched(wars, now)
+            matched += len(wars)
+            lost += len(batch) - len(wars)
+        
+        return {"waiting": len(queue), "matched": matched, "lost_races": lost}
+    
+    async def _pair_batch(self, pairs: List[Tuple[Any, Any]], now: datetime) -> List[ClanWar]:
+        """Claim and pair one batch of queue entries (caller commits)."""
+        entries = [entry.id for pair in pairs for entry in pair]
+        claimed = set((await self.db.scalars(
+            delete(ClanWar)
+            .where(ClanWar.id.in_(entries), ClanWar.state == WarState.MATCHMAKING)
+            .returning(ClanWar.id),
+            execution_options={"synchronize_session": False}
+        )).all())
+        
+        battle_start = now + timedelta(hours=self.PREP_DURATION_HOURS)
+        wars = []
+        requeue = []
+        for host, guest in pairs:
+            if host.id in claimed and guest.id in claimed:
+                wars.append(ClanWar(
+                    id=host.id,
+                    clan_id=host.clan_id,
+                    opponent_clan_id=guest.clan_id,
+                    state=WarState.PREPARATION,
+                    search_power=host.search_power,
+                    preparation_start=now,
+                    battle_start=battle_start
+                ))
+            else:
+                requeue.extend(entry for entry in (host, guest) if entry.id in claimed)
+        
+        # Put back entries whose partner was claimed elsewhere, keeping their queue time
+        wars_and_requeued = wars + [
+            ClanWar(
+                id=entry.id,
+                clan_id=entry.clan_id,
+                state=WarState.MATCHMAKING,
+                search_power=entry.search_power,
+                preparation_start=entry.preparation_start
+            )
+            for entry in requeue
+        ]
+        self.db.add_all(wars_and_requeued)
+        await self.db.flush()
+        return wars
+    
+    async def _notify_matched(self, wars: List[ClanWar], now: datetime):
+        """Tell both clans (clan rooms; the guest's queue entry id is gone)."""
+        for war in wars:
+            notice = {
+                "type": "war_matched",
+                "war_id": war.id,
+                "clan_id": war.clan_id,
+                "opponent_clan_id": war.opponent_clan_id,
+                "battle_start": war.battle_start.isoformat(),
+                "timestamp": now.isoformat()
+            }
+            await manager.broadcast_to_clan(war.clan_id, notice)
+            await manager.broadcast_to_clan(war.opponent_clan_id, notice)
     
-    def execute_war_attack(
+    async def execute_war_attack(
         self, war_id: str, attacker_id: str, defender_id: str
     ) -> WarAttack:
         """
         Execute an attack in a clan war.
         """
-        war = self.db.query(ClanWar).filter(ClanWar.id == war_id).first()
+        war = await self.db.get(ClanWar, war_id)
         if not war:
             raise ValueError("War not found")
         
@@ -267,9 +596,9 @@ class ClanWarEngine:
             raise ValueError("War is not in battle phase")
         
         # Check if attacker is in the war
-        attacker_member = self.db.query(ClanMember).filter(
-            ClanMember.user_id == attacker_id
-        ).first()
+        attacker_member = await self.db.scalar(
+            select(ClanMember).where(ClanMember.user_id == attacker_id)
+        )
         
         if not attacker_member:
             raise ValueError("You are not in a clan")
@@ -278,17 +607,19 @@ class ClanWarEngine:
             raise ValueError("You are not part of this war")
         
         # Check attack limit
-        attacks_used = self.db.query(WarAttack).filter(
-            WarAttack.war_id == war_id,
-            WarAttack.attacker_id == attacker_id
-        ).count()
+        attacks_used = await self.db.scalar(
+            select(func.count(WarAttack.id)).where(
+                WarAttack.war_id == war_id,
+                WarAttack.attacker_id == attacker_id
+            )
+        )
         
         if attacks_used >= self.MAX_ATTACKS_PER_MEMBER:
             raise ValueError("No attacks remaining")
         
         # Execute attack using RaidEngine
         raid_engine = RaidEngine(self.db, attacker_id)
-        result = raid_engine.simulate_battle(defender_id)
+        result = await raid_engine.simulate_battle(defender_id)
         
         # Record attack
         attack = WarAttack(
@@ -317,67 +648,129 @@ class ClanWarEngine:
         if result["victory"]:
             attacker_member.attacks_won += 1
         
-        self.db.commit()
+        await self.db.commit()
         
         return attack
     
-    def check_and_end_wars(self):
-        """
-        Background task: Check for wars that should end and resolve them.
+    async def check_and_end_wars(self, now: Optional[datetime] = None) -> Dict[str, int]:
         """
-        now = datetime.utcnow()
+        Background task (war_lifecycle job): advance the war state machine.
         
-        # Find wars that should start battle phase
-        prep_wars = self.db.query(ClanWar).filter(
-            ClanWar.state == WarState.PREPARATION,
-            ClanWar.battle_start <= now
-        ).all()
-        
-        for war in prep_wars:
-            war.state = WarState.BATTLE
-            war.battle_end = now + timedelta(hours=self.BATTLE_DURATION_HOURS)
-        
-        # Find wars that should end
-        ending_wars = self.db.query(ClanWar).filter(
-            ClanWar.state == WarState.BATTLE,
-            ClanWar.battle_end <= now
-        ).all()
-        
-        for war in ending_wars:
-            self._resolve_war(war)
+        PREPARATION -> BATTLE is one set-based UPDATE. Ended battles are
+        resolved RESOLVE_BATCH_SIZE at a time: clan rewards are accumulated
+        per clan and written with one executemany UPDATE, then the batch
+        commits. Participants are notified via the war rooms.
+        """
+        now = now or datetime.utcnow()
+        battle_end = now + timedelta(hours=self.BATTLE_DURATION_HOURS)
+        
+        # Wars that should start battle phase
+        started_ids = (await self.db.scalars(
+            update(ClanWar)
+            .where(ClanWar.state == WarState.PREPARATION, ClanWar.battle_start <= now)
+            .values(state=WarState.BATTLE, battle_end=battle_end)
+            .returning(ClanWar.id),
+            execution_options={"synchronize_session": False}
+        )).all()
+        await self.db.commit()
+        
+        for war_id in started_ids:
+            await manager.broadcast_war_update(war_id, {
+                "type": "war_battle_started",
+                "war_id": war_id,
+                "battle_end": battle_end.isoformat(),
+                "timestamp": now.isoformat()
+            })
+        
+        # Wars that should end
+        ended = 0
+        while True:
+            ending_wars = (await self.db.scalars(
+                select(ClanWar).where(
+                    ClanWar.state == WarState.BATTLE,
+                    ClanWar.battle_end <= now
+                ).order_by(ClanWar.battle_end).limit(self.RESOLVE_BATCH_SIZE)
+            )).all()
+            
+            if not ending_wars:
+                break
+            
+            results: Dict[str, Dict[str, int]] = {}
+            for war in ending_wars:
+                self._resolve_war(war, results)
+            
+            await self._apply_war_results(results)
+            await self.db.commit()
+            ended += len(ending_wars)
+            
+            for war in ending_wars:
+                await manager.broadcast_war_update(war.id, {
+                    "type": "war_ended",
+                    "war_id": war.id,
+                    "winner_clan_id": war.winner_clan_id,
+                    "clan_stars": war.clan_stars,
+                    "opponent_stars": war.opponent_stars,
+                    "clan_destruction": war.clan_destruction,
+                    "opponent_destruction": war.opponent_destruction,
+                    "timestamp": now.isoformat()
+                })
+            
+            if len(ending_wars) < self.RESOLVE_BATCH_SIZE:
+                break
         
-        self.db.commit()
+        return {"started": len(started_ids), "ended": ended}
     
-    def _resolve_war(self, war: ClanWar):
+    def _resolve_war(self, war: ClanWar, results: Dict[str, Dict[str, int]]):
         """
-        Determine winner and apply rewards.
+        Determine winner and accumulate rewards into `results`
+        (clan id -> stat deltas, applied by _apply_war_results).
         """
         war.state = WarState.WAR_ENDED
         
         # Determine winner
         if war.clan_stars > war.opponent_stars:
             war.winner_clan_id = war.clan_id
-            winner_clan = self.db.query(Clan).filter(Clan.id == war.clan_id).first()
-            loser_clan = self.db.query(Clan).filter(Clan.id == war.opponent_clan_id).first()
         elif war.opponent_stars > war.clan_stars:
             war.winner_clan_id = war.opponent_clan_id
-            winner_clan = self.db.query(Clan).filter(Clan.id == war.opponent_clan_id).first()
-            loser_clan = self.db.query(Clan).filter(Clan.id == war.clan_id).first()
         elif war.clan_destruction > war.opponent_destruction:
             war.winner_clan_id = war.clan_id
-            winner_clan = self.db.query(Clan).filter(Clan.id == war.clan_id).first()
-            loser_clan = self.db.query(Clan).filter(Clan.id == war.opponent_clan_id).first()
         else:
             # Tie or opponent wins on destruction
             war.winner_clan_id = war.opponent_clan_id
-            winner_clan = self.db.query(Clan).filter(Clan.id == war.opponent_clan_id).first()
-            loser_clan = self.db.query(Clan).filter(Clan.id == war.clan_id).first()
         
-        if winner_clan:
-            winner_clan.war_wins += 1
-            winner_clan.war_streak += 1
-            winner_clan.total_xp += 100
+        loser_clan_id = war.opponent_clan_id if war.winner_clan_id == war.clan_id else war.clan_id
+        empty = {"wins": 0, "losses": 0, "xp": 0, "keep_streak": 1, "streak": 0}
+        
+        winner = results.setdefault(war.winner_clan_id, dict(empty))
+        winner["wins"] += 1
+        winner["streak"] += 1
+        winner["xp"] += 100
         
-        if loser_clan:
-            loser_clan.war_losses += 1
-            loser_clan.war_streak = 0
+        loser = results.setdefault(loser_clan_id, dict(empty))
+        loser["losses"] += 1
+        loser["keep_streak"] = 0
+        loser["streak"] = 0
+    
+    async def _apply_war_results(self, results: Dict[str, Dict[str, int]]):
+        """
+        Apply accumulated war results with one executemany UPDATE.
+        A loss resets the streak; wins after it count from zero.
+        """
+        if not results:
+            return
+        
+        clans = Clan.__table__
+        await self.db.execute(
+            update(clans)
+            .where(clans.c.id == bindparam("b_id"))
+            .values(
+                war_wins=clans.c.war_wins + bindparam("b_wins"),
+                war_losses=clans.c.war_losses + bindparam("b_losses"),
+                total_xp=clans.c.total_xp + bindparam("b_xp"),
+                war_streak=clans.c.war_streak * bindparam("b_keep_streak") + bindparam("b_streak")
+            ),
+            [
+                {f"b_{key}": value for key, value in {"id": clan_id, **deltas}.items()}
+                for clan_id, deltas in results.items()
+            ]
+        )
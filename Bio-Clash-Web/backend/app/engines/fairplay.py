@@ -3,15 +3,22 @@ FairPlay Engines
 1. Fatigue Oracle: Predicts recovery score, triggers shields
 2. League Clustering: Groups users for fair matchmaking
 """
-from typing import List, Tuple
-from datetime import date, timedelta
+import asyncio
+from typing import Any, Dict, List, Optional, Tuple
+from datetime import date, datetime, timedelta
 import numpy as np
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+import pandas as pd
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, update, func, bindparam
 
 from app.core.config import settings
-from app.core.enums import LeagueTier
-from app.models.user import User
+from app.core.enums import LeagueTier, ExperienceLevel
+from app.core.auth_cache import user_cache
+from app.core.roster import roster_cache
+from app.core.recovery_cache import RecoveryKey, recovery_cache
+from app.engines.matchmaking import opponent_index
+from app.models.user import User, Profile
+from app.models.game import Village
 from app.models.fitness import DailyBiometrics, WorkoutLog
 
 
@@ -33,30 +40,44 @@ class FatigueOracle:
     HRV_BASELINE = 50.0  # Average HRV in ms
     LOAD_MAX_WEEKLY = 50000.0  # Max weekly volume considered "overtraining"
     
-    def __init__(self, db: Session, user_id: str):
+    def __init__(self, db: AsyncSession, user_id: str):
         self.db = db
         self.user_id = user_id
     
-    def calculate_recovery_score(self) -> Tuple[float, str, List[str]]:
+    async def calculate_recovery_score(self) -> Tuple[float, str, List[str]]:
         """
         Calculate the user's recovery percentage.
         
+        Memoized per user until their biometrics or workouts change
+        (see app/core/recovery_cache.py).
+        
         Returns:
             Tuple of (recovery_percent, status, recommendations)
         """
+        today = date.today()
+        three_days_ago = today - timedelta(days=3)
+        seven_days_ago = today - timedelta(days=7)
+        key = await self._input_key(today, three_days_ago, seven_days_ago)
+        cached = recovery_cache.get(self.user_id, key)
+        if cached is not None:
+            return cached
+        generation = recovery_cache.generation(self.user_id)
+        
         # Get last 3 days of biometrics
-        three_days_ago = date.today() - timedelta(days=3)
-        biometrics = self.db.query(DailyBiometrics).filter(
-            DailyBiometrics.user_id == self.user_id,
-            DailyBiometrics.date >= three_days_ago
-        ).order_by(DailyBiometrics.date.desc()).all()
+        biometrics = (await self.db.scalars(
+            select(DailyBiometrics).where(
+                DailyBiometrics.user_id == self.user_id,
+                DailyBiometrics.date >= three_days_ago
+            ).order_by(DailyBiometrics.date.desc())
+        )).all()
         
         # Get last 7 days of training load
-        seven_days_ago = date.today() - timedelta(days=7)
-        weekly_volume = self.db.query(func.sum(WorkoutLog.total_volume_kg)).filter(
-            WorkoutLog.user_id == self.user_id,
-            WorkoutLog.date >= seven_days_ago
-        ).scalar() or 0.0
+        weekly_volume = await self.db.scalar(
+            select(func.sum(WorkoutLog.total_volume_kg)).where(
+                WorkoutLog.user_id == self.user_id,
+                WorkoutLog.date >= seven_days_ago
+            )
+        ) or 0.0
         
         # Calculate normalized factors
         avg_sleep = 7.0  # Default
@@ -71,20 +92,7 @@ class FatigueOracle:
             if hrv_values:
                 avg_hrv = sum(hrv_values) / len(hrv_values)
         
-        # Normalize to 0-1 scale
-        sleep_normalized = min(1.0, avg_sleep / self.SLEEP_OPTIMAL_HOURS)
-        hrv_normalized = min(1.0, avg_hrv / (self.HRV_BASELINE * 1.5))  # 75ms is excellent
-        load_normalized = min(1.0, weekly_volume / self.LOAD_MAX_WEEKLY)
-        
-        # Apply formula
-        recovery_score = (
-            (0.5 * sleep_normalized) +
-            (0.3 * hrv_normalized) -
-            (0.2 * load_normalized)
-        ) * 100
-        
-        # Clamp to 0-100
-        recovery_score = max(0, min(100, recovery_score))
+        recovery_score = float(self.score(avg_sleep, avg_hrv, weekly_volume))
         
         # Determine status
         if recovery_score < settings.FATIGUE_SHIELD_THRESHOLD:
@@ -101,7 +109,52 @@ class FatigueOracle:
             avg_sleep, avg_hrv, weekly_volume, recovery_score
         )
         
-        return recovery_score, status, recommendations
+        result = (recovery_score, status, recommendations)
+        recovery_cache.put(self.user_id, key, result, generation)
+        
+        return result
+    
+    async def _input_key(self, today: date, biometrics_since: date, workouts_since: date) -> RecoveryKey:
+        """
+        Memo key of the current inputs: row count and latest change of the
+        biometrics and workouts in the scoring windows (one query).
+        """
+        in_biometrics = (
+            DailyBiometrics.user_id == self.user_id,
+            DailyBiometrics.date >= biometrics_since
+        )
+        in_workouts = (
+            WorkoutLog.user_id == self.user_id,
+            WorkoutLog.date >= workouts_since
+        )
+        
+        row = (await self.db.execute(select(
+            select(func.count(DailyBiometrics.id)).where(*in_biometrics).scalar_subquery(),
+            select(func.max(DailyBiometrics.updated_at)).where(*in_biometrics).scalar_subquery(),
+            select(func.count(WorkoutLog.id)).where(*in_workouts).scalar_subquery(),
+            select(func.max(WorkoutLog.created_at)).where(*in_workouts).scalar_subquery()
+        ))).one()
+        return (*row, today)
+    
+    @classmethod
+    def score(cls, avg_sleep, avg_hrv, weekly_volume):
+        """
+        The recovery formula, clamped to 0-100.
+        Works element-wise on NumPy arrays as well as on scalars.
+        """
+        # Normalize to 0-1 scale
+        sleep_normalized = np.minimum(1.0, np.asarray(avg_sleep, dtype=float) / cls.SLEEP_OPTIMAL_HOURS)
+        hrv_normalized = np.minimum(1.0, np.asarray(avg_hrv, dtype=float) / (cls.HRV_BASELINE * 1.5))  # 75ms is excellent
+        load_normalized = np.minimum(1.0, np.asarray(weekly_volume, dtype=float) / cls.LOAD_MAX_WEEKLY)
+        
+        # Apply formula
+        recovery_score = (
+            (0.5 * sleep_normalized) +
+            (0.3 * hrv_normalized) -
+            (0.2 * load_normalized)
+        ) * 100
+        
+        return np.clip(recovery_score, 0, 100)
     
     def _generate_recommendations(
         self, avg_sleep: float, avg_hrv: float, 
@@ -131,12 +184,117 @@ class FatigueOracle:
         
         return recs
     
-    def should_activate_shield(self) -> bool:
+    async def should_activate_shield(self) -> bool:
         """Check if shield should be activated due to low recovery."""
-        score, _, _ = self.calculate_recovery_score()
+        score, _, _ = await self.calculate_recovery_score()
         return score < settings.FATIGUE_SHIELD_THRESHOLD
 
 
+    # ============================================================
+    # BATCH MODE
+    # ============================================================
+    
+    UPDATE_BATCH_SIZE = 5000
+    
+    @classmethod
+    async def score_all(cls, db: AsyncSession, today: Optional[date] = None) -> Dict[str, Any]:
+        """
+        Recompute every user's recovery score and enforce shields.
+        
+        Loads the 3-day biometrics window and the 7-day training volume for
+        all users (two queries), scores them with vectorized pandas/NumPy,
+        then bulk-writes User.recovery_score and the village shield flags:
+        expired shields are lifted, users under FATIGUE_SHIELD_THRESHOLD
+        without an active shield get one for SHIELD_DURATION_HOURS.
+        """
+        today = today or date.today()
+        now = datetime.utcnow()
+        
+        biometrics = pd.DataFrame(
+            (await db.execute(
+                select(DailyBiometrics.user_id, DailyBiometrics.sleep_hours, DailyBiometrics.hrv)
+                .where(DailyBiometrics.date >= today - timedelta(days=3))
+            )).all(),
+            columns=["user_id", "sleep_hours", "hrv"]
+        )
+        volume = pd.DataFrame(
+            (await db.execute(
+                select(WorkoutLog.user_id, func.sum(WorkoutLog.total_volume_kg))
+                .where(WorkoutLog.date >= today - timedelta(days=7))
+                .group_by(WorkoutLog.user_id)
+            )).all(),
+            columns=["user_id", "weekly_volume"]
+        ).set_index("user_id")["weekly_volume"]
+        
+        # Missing / zero readings fall back to the defaults (7h sleep, 50ms HRV)
+        readings = biometrics[["sleep_hours", "hrv"]].astype(float)
+        averages = readings.where(readings > 0).groupby(biometrics["user_id"]).mean()
+        
+        user_ids = averages.index.union(volume.index)
+        averages = averages.reindex(user_ids)
+        scores = cls.score(
+            averages["sleep_hours"].fillna(7.0).to_numpy(),
+            averages["hrv"].fillna(cls.HRV_BASELINE).to_numpy(),
+            volume.reindex(user_ids).fillna(0.0).to_numpy()
+        )
+        
+        # Users without data in either window get the default score
+        default_score = float(cls.score(7.0, cls.HRV_BASELINE, 0.0))
+        users = User.__table__
+        await db.execute(
+            update(users)
+            .where(
+                ~select(DailyBiometrics.id).where(
+                    DailyBiometrics.user_id == users.c.id,
+                    DailyBiometrics.date >= today - timedelta(days=3)
+                ).exists(),
+                ~select(WorkoutLog.id).where(
+                    WorkoutLog.user_id == users.c.id,
+                    WorkoutLog.date >= today - timedelta(days=7)
+                ).exists()
+            )
+            .values(recovery_score=default_score)
+        )
+        
+        stmt = update(users).where(users.c.id == bindparam("b_id")).values(recovery_score=bindparam("b_score"))
+        params = [{"b_id": user_id, "b_score": float(score)} for user_id, score in zip(user_ids, scores)]
+        for i in range(0, len(params), cls.UPDATE_BATCH_SIZE):
+            await db.execute(stmt, params[i:i + cls.UPDATE_BATCH_SIZE])
+        
+        # Shields: lift expired ones, then raise new ones
+        lifted = (await db.scalars(
+            update(Village)
+            .where(Village.shield_active == True, Village.shield_end_time <= now)
+            .values(shield_active=False, shield_end_time=None)
+            .returning(Village.user_id),
+            execution_options={"synchronize_session": False}
+        )).all()
+        
+        fatigued = [user_id for user_id, score in zip(user_ids, scores) if score < settings.FATIGUE_SHIELD_THRESHOLD]
+        shielded = []
+        for i in range(0, len(fatigued), cls.UPDATE_BATCH_SIZE):
+            shielded += (await db.scalars(
+                update(Village)
+                .where(Village.user_id.in_(fatigued[i:i + cls.UPDATE_BATCH_SIZE]), Village.shield_active == False)
+                .values(shield_active=True, shield_end_time=now + timedelta(hours=settings.SHIELD_DURATION_HOURS))
+                .returning(Village.user_id),
+                execution_options={"synchronize_session": False}
+            )).all()
+        
+        # Bulk UPDATEs bypass the ORM invalidation hooks
+        for user_id in {*lifted, *shielded}:
+            opponent_index.track(db, user_id)
+        await db.commit()
+        user_cache.clear()
+        
+        return {
+            "scored": len(user_ids),
+            "fatigued": len(fatigued),
+            "shields_raised": len(shielded),
+            "shields_lifted": len(lifted)
+        }
+
+
 class LeagueClustering:
     """
     System 2: Smart Combat Power Scaling
@@ -150,71 +308,132 @@ class LeagueClustering:
     - Experience level
     
     Leagues: Bronze, Silver, Gold, Crystal, Titan
+    
+    rebuild_leagues() clusters the whole population (league_clustering job)
+    and stores User.league_tier; endpoints read the stored tier.
     """
     
-    def __init__(self, db: Session):
+    TIERS = [LeagueTier.BRONZE, LeagueTier.SILVER, LeagueTier.GOLD, LeagueTier.CRYSTAL, LeagueTier.TITAN]
+    SCORE_THRESHOLDS = [0.2, 0.4, 0.6, 0.8]  # Fallback when there are too few distinct users
+    VOLUME_HIGH = 30000.0  # 30k weekly kg is high volume
+    EXPERIENCE_WEIGHTS = {
+        ExperienceLevel.BEGINNER: 0.2,
+        ExperienceLevel.INTERMEDIATE: 0.5,
+        ExperienceLevel.ADVANCED: 1.0
+    }
+    MINI_BATCH_MIN_USERS = 10000  # Switch to MiniBatchKMeans from here
+    UPDATE_BATCH_SIZE = 5000
+    
+    def __init__(self, db: AsyncSession):
         self.db = db
     
-    def calculate_user_features(self, user_id: str) -> np.ndarray:
-        """Extract features for a single user."""
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return np.array([0, 0, 0])
-        
-        # Get weekly volume
+    def _features_query(self):
+        """
+        One row per user: (id, current tier, weekly volume, consistency, experience).
+        Weekly volume is a grouped subquery over the last 7 days of workouts.
+        """
         seven_days_ago = date.today() - timedelta(days=7)
-        weekly_volume = self.db.query(func.sum(WorkoutLog.total_volume_kg)).filter(
-            WorkoutLog.user_id == user_id,
-            WorkoutLog.date >= seven_days_ago
-        ).scalar() or 0.0
-        
-        # Normalize features
-        volume_normalized = min(1.0, weekly_volume / 30000)  # 30k is high volume
-        consistency_normalized = user.consistency_score / 100
-        
-        # Experience from profile
-        from app.models.user import Profile
-        profile = self.db.query(Profile).filter(Profile.user_id == user_id).first()
-        exp_map = {"beginner": 0.2, "intermediate": 0.5, "advanced": 1.0}
-        exp_normalized = exp_map.get(profile.experience_level.value if profile else "beginner", 0.2)
+        weekly = (
+            select(WorkoutLog.user_id, func.sum(WorkoutLog.total_volume_kg).label("volume"))
+            .where(WorkoutLog.date >= seven_days_ago)
+            .group_by(WorkoutLog.user_id)
+            .subquery()
+        )
+        return (
+            select(
+                User.id,
+                User.league_tier,
+                func.coalesce(weekly.c.volume, 0.0),
+                func.coalesce(User.consistency_score, 0.0),
+                Profile.experience_level
+            )
+            .outerjoin(weekly, weekly.c.user_id == User.id)
+            .outerjoin(Profile, Profile.user_id == User.id)
+        )
+    
+    def _to_matrix(self, rows) -> np.ndarray:
+        """Normalize raw feature rows into an (N, 3) matrix in [0, 1]."""
+        if not rows:
+            return np.zeros((0, 3))
         
-        return np.array([volume_normalized, consistency_normalized, exp_normalized])
+        _, _, volume, consistency, experience = zip(*rows)
+        return np.column_stack([
+            np.minimum(1.0, np.asarray(volume, dtype=float) / self.VOLUME_HIGH),
+            np.clip(np.asarray(consistency, dtype=float) / 100, 0.0, 1.0),
+            np.array([self.EXPERIENCE_WEIGHTS.get(level, 0.2) for level in experience])
+        ])
     
-    def assign_league(self, user_id: str) -> LeagueTier:
+    def cluster(self, features: np.ndarray) -> np.ndarray:
         """
-        Assign a user to a league based on their features.
+        Tier index (0 = Bronze ... 4 = Titan) for each feature row.
         
-        For MVP: Simple threshold-based assignment.
-        Production: Would run K-Means on all users periodically.
+        K-Means with one cluster per league; centroids are ranked by their
+        feature average so the weakest cluster is Bronze. Populations with
+        fewer distinct users than leagues use the fixed score thresholds.
         """
-        features = self.calculate_user_features(user_id)
-        score = np.sum(features) / 3  # Simple average
+        k = len(self.TIERS)
+        if len(features) == 0:
+            return np.zeros(0, dtype=int)
+        
+        if len(np.unique(features, axis=0)) < k:
+            return np.digitize(features.mean(axis=1), self.SCORE_THRESHOLDS)
+        
+        from sklearn.cluster import KMeans, MiniBatchKMeans
         
-        if score < 0.2:
-            return LeagueTier.BRONZE
-        elif score < 0.4:
-            return LeagueTier.SILVER
-        elif score < 0.6:
-            return LeagueTier.GOLD
-        elif score < 0.8:
-            return LeagueTier.CRYSTAL
+        if len(features) >= self.MINI_BATCH_MIN_USERS:
+            model = MiniBatchKMeans(n_clusters=k, batch_size=4096, n_init=3, random_state=0)
         else:
-            return LeagueTier.TITAN
+            model = KMeans(n_clusters=k, n_init=10, random_state=0)
+        labels = model.fit_predict(features)
+        
+        # rank[c] = position of centroid c when sorted weakest -> strongest
+        rank = np.empty(k, dtype=int)
+        rank[np.argsort(model.cluster_centers_.mean(axis=1))] = np.arange(k)
+        return rank[labels]
     
-    def find_opponents(self, user_id: str, count: int = 5) -> List[str]:
+    async def rebuild_leagues(self) -> Dict[str, Any]:
         """
-        Find suitable opponents in the same league.
+        Cluster every user and store the resulting league tiers.
+        One feature query, one fit, executemany UPDATEs for changed tiers.
+        The fit is CPU-bound and runs in a worker thread, off the event loop.
+        """
+        rows = (await self.db.execute(self._features_query())).all()
+        tiers = await asyncio.to_thread(self.cluster, self._to_matrix(rows))
         
-        Returns list of user IDs.
+        changes = [
+            {"b_id": row[0], "b_tier": self.TIERS[tier]}
+            for row, tier in zip(rows, tiers)
+            if row[1] != self.TIERS[tier]
+        ]
+        
+        users = User.__table__
+        stmt = update(users).where(users.c.id == bindparam("b_id")).values(league_tier=bindparam("b_tier"))
+        for i in range(0, len(changes), self.UPDATE_BATCH_SIZE):
+            await self.db.execute(stmt, changes[i:i + self.UPDATE_BATCH_SIZE])
+        await self.db.commit()
+        
+        # Bulk UPDATE bypasses the ORM invalidation hooks
+        if changes:
+            user_cache.clear()
+            opponent_index.invalidate()
+            roster_cache.invalidate_users(change["b_id"] for change in changes)
+        
+        counts = np.bincount(tiers, minlength=len(self.TIERS))
+        return {
+            "users": len(rows),
+            "changed": len(changes),
+            "leagues": {tier.value: int(count) for tier, count in zip(self.TIERS, counts)}
+        }
+    
+    async def find_opponents(self, user_id: str, count: int = 5) -> List[str]:
         """
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user:
-            return []
+        Find suitable opponents in the same league.
         
-        # Find users in same league, excluding self
-        opponents = self.db.query(User).filter(
-            User.league_tier == user.league_tier,
-            User.id != user_id
-        ).limit(count).all()
+        Nearest defense power to the user's attack power, skipping shielded
+        players and recent targets (see opponent_index in
+        app/engines/matchmaking.py).
         
-        return [o.id for o in opponents]
+        Returns list of user IDs.
+        """
+        opponents = await opponent_index.nearest(self.db, user_id, count)
+        return [o.user_id for o in opponents]
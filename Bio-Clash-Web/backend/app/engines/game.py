@@ -2,16 +2,21 @@
 Game Engine
 Handles village resources, building upgrades, and raid mechanics.
 """
+import asyncio
+import math
 from datetime import datetime, timedelta
-from typing import Optional, Tuple, List
-from sqlalchemy.orm import Session
-from sqlalchemy import func
+from typing import Dict, Optional, Tuple, List
+from sqlalchemy import select, update, case, cast, func, or_, bindparam, text, Integer, DateTime
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
 from app.core.enums import BuildingType, MuscleGroup
+from app.core.scheduler import upgrade_scheduler
 from app.models.game import Village, Building, UpgradeQueue, BUILDING_REQUIREMENTS
-from app.models.fitness import WorkoutSet, WorkoutLog, Exercise
 from app.models.user import User
+from app.models.fitness import UserMuscleVolume
+from app.engines.volume import MuscleVolumeLedger
+from app.engines.battle import simulate
 
 
 class ResourceManager:
@@ -23,42 +28,159 @@ class ResourceManager:
     Dark Elixir = Intensity/PRs (from Dark Elixir Drills)
     """
     
-    def __init__(self, db: Session, village: Village):
+    def __init__(self, db: AsyncSession, village: Village):
         self.db = db
         self.village = village
     
-    def sync_resources(self) -> Tuple[int, int, int]:
+    def project(self, now: Optional[datetime] = None) -> Tuple[int, int, int]:
         """
-        Calculate and add resources since last sync.
-        Returns (gold_gained, elixir_gained, dark_elixir_gained).
+        Current (gold, elixir, dark_elixir) computed from last_resource_sync
+        and the per-hour rates. Read-only: nothing is written to the village.
         """
-        now = datetime.utcnow()
-        seconds_elapsed = (now - self.village.last_resource_sync).total_seconds()
-        hours_elapsed = seconds_elapsed / 3600
-        
-        # Calculate gains
-        gold_gained = int(self.village.gold_per_hour * hours_elapsed)
-        elixir_gained = int(self.village.elixir_per_hour * hours_elapsed)
-        dark_gained = int(self.village.dark_elixir_per_hour * hours_elapsed)
-        
-        # Apply to village (respect capacity)
-        self.village.gold = min(
-            self.village.gold + gold_gained,
-            self.village.gold_capacity
-        )
-        self.village.elixir = min(
-            self.village.elixir + elixir_gained,
-            self.village.elixir_capacity
-        )
-        self.village.dark_elixir = min(
-            self.village.dark_elixir + dark_gained,
-            self.village.dark_elixir_capacity
+        gold_gained, elixir_gained, dark_gained = self._gains(now or datetime.utcnow())
+        
+        return (
+            min(self.village.gold + gold_gained, self.village.gold_capacity),
+            min(self.village.elixir + elixir_gained, self.village.elixir_capacity),
+            min(self.village.dark_elixir + dark_gained, self.village.dark_elixir_capacity),
         )
+    
+    def settle(self, now: Optional[datetime] = None) -> Tuple[int, int, int]:
+        """
+        Fold generated resources into the stored balances.
+        Call before any change to balances or rates; the caller commits.
+        Returns (gold_gained, elixir_gained, dark_elixir_gained).
+        """
+        now = now or datetime.utcnow()
+        gains = self._gains(now)
         
+        self.village.gold, self.village.elixir, self.village.dark_elixir = self.project(now)
         self.village.last_resource_sync = now
-        self.db.commit()
         
-        return gold_gained, elixir_gained, dark_gained
+        return gains
+    
+    async def sync_resources(self) -> Tuple[int, int, int]:
+        """
+        Calculate and add resources since last sync, and commit.
+        Returns (gold_gained, elixir_gained, dark_elixir_gained).
+        """
+        gains = self.settle()
+        await self.db.commit()
+        
+        return gains
+    
+    @staticmethod
+    async def tick_all(
+        db: AsyncSession, now: Optional[datetime] = None, chunk_size: int = 5000
+    ) -> dict:
+        """
+        Advance every village's balances in SQL (background resource tick).
+        
+        Same arithmetic as settle(), as one UPDATE per chunk of villages
+        (chunked by id range, committed per chunk). No Village objects are
+        loaded. Villages already full on every resource are skipped: their
+        balances cannot grow, and the settle() that precedes any spend
+        clamps them to capacity whatever their last_resource_sync.
+        Returns {"villages": rows_updated, "chunks": n}.
+        """
+        now = now or datetime.utcnow()
+        villages = Village.__table__
+        dialect = db.bind.dialect.name
+        now_hours = _epoch_hours(bindparam("now", now, type_=DateTime), dialect)
+        last_hours = _epoch_hours(villages.c.last_resource_sync, dialect)
+        
+        def accrue(balance, rate, capacity):
+            gained = _floor(rate * now_hours, dialect) - _floor(rate * last_hours, dialect)
+            new_balance = balance + gained
+            return case((new_balance < capacity, new_balance), else_=capacity)
+        
+        updated = 0
+        chunks = 0
+        lower_id = None
+        while True:
+            # Upper id of this chunk (None = last chunk)
+            boundary = select(villages.c.id).order_by(villages.c.id).offset(chunk_size - 1).limit(1)
+            if lower_id is not None:
+                boundary = boundary.where(villages.c.id > lower_id)
+            upper_id = await db.scalar(boundary)
+            
+            stmt = update(villages).where(
+                villages.c.last_resource_sync < bindparam("now", now, type_=DateTime),
+                or_(
+                    villages.c.gold < villages.c.gold_capacity,
+                    villages.c.elixir < villages.c.elixir_capacity,
+                    villages.c.dark_elixir < villages.c.dark_elixir_capacity
+                )
+            ).values(
+                gold=accrue(villages.c.gold, villages.c.gold_per_hour, villages.c.gold_capacity),
+                elixir=accrue(villages.c.elixir, villages.c.elixir_per_hour, villages.c.elixir_capacity),
+                dark_elixir=accrue(
+                    villages.c.dark_elixir, villages.c.dark_elixir_per_hour, villages.c.dark_elixir_capacity
+                ),
+                last_resource_sync=bindparam("now", now, type_=DateTime)
+            )
+            if lower_id is not None:
+                stmt = stmt.where(villages.c.id > lower_id)
+            if upper_id is not None:
+                stmt = stmt.where(villages.c.id <= upper_id)
+            
+            result = await db.execute(stmt)
+            await db.commit()
+            updated += result.rowcount
+            chunks += 1
+            
+            if upper_id is None:
+                break
+            lower_id = upper_id
+        
+        return {"villages": updated, "chunks": chunks}
+    
+    def _gains(self, now: datetime) -> Tuple[int, int, int]:
+        """
+        Whole units generated between last_resource_sync and now.
+        
+        Counted on an absolute clock, floor(rate * t_now) - floor(rate * t_last),
+        so frequent syncs/ticks never lose the fractional remainder.
+        """
+        last = self.village.last_resource_sync
+        if now <= last:
+            return 0, 0, 0
+        
+        now_hours = _hours_since_epoch(now)
+        last_hours = _hours_since_epoch(last)
+        
+        return tuple(
+            math.floor(rate * now_hours) - math.floor(rate * last_hours)
+            for rate in (
+                self.village.gold_per_hour,
+                self.village.elixir_per_hour,
+                self.village.dark_elixir_per_hour,
+            )
+        )
+
+
+# Absolute clock for resource generation (see ResourceManager._gains)
+RESOURCE_EPOCH = datetime(1970, 1, 1)
+
+
+def _hours_since_epoch(moment: datetime) -> float:
+    return (moment - RESOURCE_EPOCH).total_seconds() / 3600
+
+
+def _epoch_hours(expr, dialect: str):
+    """SQL expression: hours between RESOURCE_EPOCH and a naive UTC datetime."""
+    if dialect == "sqlite":
+        return (func.julianday(expr) - 2440587.5) * 24  # julianday('1970-01-01')
+    if dialect == "mysql":
+        return func.timestampdiff(text("MICROSECOND"), RESOURCE_EPOCH, expr) / 3600e6
+    return func.extract("epoch", expr) / 3600
+
+
+def _floor(expr, dialect: str):
+    """SQL floor() of a non-negative float (SQLite may lack math functions)."""
+    if dialect == "sqlite":
+        return cast(expr, Integer)  # CAST truncates, same as floor for x >= 0
+    return cast(func.floor(expr), Integer)
 
 
 class UpgradeManager:
@@ -84,32 +206,16 @@ class UpgradeManager:
         BuildingType.AIR_DEFENSE: MuscleGroup.TRAPS,
     }
     
-    def __init__(self, db: Session, user_id: str, village: Village):
+    def __init__(self, db: AsyncSession, user_id: str, village: Village):
         self.db = db
         self.user_id = user_id
         self.village = village
     
-    def get_user_muscle_volume(self, muscle: MuscleGroup) -> float:
+    async def get_user_muscle_volume(self, muscle: MuscleGroup) -> float:
         """Get user's total volume for a specific muscle group."""
-        # Get all exercises for this muscle
-        exercise_ids = [e.id for e in self.db.query(Exercise).filter(
-            Exercise.primary_muscle == muscle
-        ).all()]
-        
-        if not exercise_ids:
-            return 0.0
-        
-        # Sum volume from all sets
-        volume = self.db.query(func.sum(WorkoutSet.volume)).filter(
-            WorkoutSet.exercise_id.in_(exercise_ids),
-            WorkoutSet.workout_log_id.in_(
-                self.db.query(WorkoutLog.id).filter(WorkoutLog.user_id == self.user_id)
-            )
-        ).scalar() or 0.0
-        
-        return volume
+        return await MuscleVolumeLedger(self.db, self.user_id).get_volume(muscle)
     
-    def check_upgrade_requirements(
+    async def check_upgrade_requirements(
         self, building: Building
     ) -> Tuple[bool, Optional[str], dict]:
         """
@@ -142,19 +248,20 @@ class UpgradeManager:
         if target_level > self.village.town_hall_level + 2:
             return False, f"Upgrade Town Hall first (Current: {self.village.town_hall_level})", requirements
         
-        # Check resource costs
-        if self.village.gold < requirements["gold_cost"]:
+        # Check resource costs (against projected balances)
+        gold, elixir, dark_elixir = ResourceManager(self.db, self.village).project()
+        if gold < requirements["gold_cost"]:
             return False, f"Need {requirements['gold_cost']} Gold", requirements
-        if self.village.elixir < requirements["elixir_cost"]:
+        if elixir < requirements["elixir_cost"]:
             return False, f"Need {requirements['elixir_cost']} Elixir", requirements
-        if self.village.dark_elixir < requirements["dark_elixir_cost"]:
+        if dark_elixir < requirements["dark_elixir_cost"]:
             return False, f"Need {requirements['dark_elixir_cost']} Dark Elixir", requirements
         
         # Check fitness requirement (THE CODEX)
         if building_type in self.BUILDING_TO_MUSCLE:
             required_muscle = self.BUILDING_TO_MUSCLE[building_type]
             required_volume = level_reqs.get("volume_kg", 0)
-            current_volume = self.get_user_muscle_volume(required_muscle)
+            current_volume = await self.get_user_muscle_volume(required_muscle)
             
             requirements["required_muscle"] = required_muscle.value
             requirements["required_volume_kg"] = required_volume
@@ -165,7 +272,7 @@ class UpgradeManager:
         
         # Special: Town Hall requires consistency
         if building_type == BuildingType.TOWN_HALL:
-            user = self.db.query(User).filter(User.id == self.user_id).first()
+            user = await self.db.get(User, self.user_id)
             required_consistency = level_reqs.get("consistency_score", 0)
             
             requirements["required_consistency"] = required_consistency
@@ -176,17 +283,18 @@ class UpgradeManager:
         
         return True, None, requirements
     
-    def start_upgrade(self, building: Building) -> Optional[UpgradeQueue]:
+    async def start_upgrade(self, building: Building) -> Optional[UpgradeQueue]:
         """
         Start an upgrade for a building.
         Deducts resources and creates queue entry.
         """
-        can_upgrade, reason, reqs = self.check_upgrade_requirements(building)
+        can_upgrade, reason, reqs = await self.check_upgrade_requirements(building)
         
         if not can_upgrade:
             return None
         
-        # Deduct resources
+        # Deduct resources from the settled balance
+        ResourceManager(self.db, self.village).settle()
         self.village.gold -= reqs.get("gold_cost", 0)
         self.village.elixir -= reqs.get("elixir_cost", 0)
         self.village.dark_elixir -= reqs.get("dark_elixir_cost", 0)
@@ -211,7 +319,9 @@ class UpgradeManager:
         building.is_upgrading = True
         
         self.db.add(upgrade)
-        self.db.commit()
+        await self.db.commit()
+        
+        upgrade_scheduler.schedule(upgrade.id, upgrade.finish_time)
         
         return upgrade
 
@@ -224,88 +334,132 @@ class RaidEngine:
     Defense Power = Core + Legs + Back
     """
     
-    def __init__(self, db: Session, attacker_id: str):
+    ATTACK_MUSCLES = [MuscleGroup.CHEST, MuscleGroup.SHOULDERS, MuscleGroup.TRICEPS, MuscleGroup.BICEPS]
+    DEFENSE_MUSCLES = [MuscleGroup.CORE, MuscleGroup.LEGS, MuscleGroup.BACK]
+    
+    def __init__(self, db: AsyncSession, attacker_id: str):
         self.db = db
         self.attacker_id = attacker_id
     
-    def calculate_attack_power(self) -> float:
+    async def calculate_attack_power(self) -> float:
         """Calculate attacker's offensive power."""
-        attack_muscles = [MuscleGroup.CHEST, MuscleGroup.SHOULDERS, MuscleGroup.TRICEPS, MuscleGroup.BICEPS]
-        
-        total = 0.0
-        for muscle in attack_muscles:
-            exercise_ids = [e.id for e in self.db.query(Exercise).filter(
-                Exercise.primary_muscle == muscle
-            ).all()]
-            
-            if exercise_ids:
-                volume = self.db.query(func.sum(WorkoutSet.volume)).filter(
-                    WorkoutSet.exercise_id.in_(exercise_ids),
-                    WorkoutSet.workout_log_id.in_(
-                        self.db.query(WorkoutLog.id).filter(WorkoutLog.user_id == self.attacker_id)
-                    )
-                ).scalar() or 0.0
-                total += volume
-        
-        return total
+        volumes = await MuscleVolumeLedger(self.db, self.attacker_id).get_volumes(self.ATTACK_MUSCLES)
+        return sum(volumes.values())
     
-    def calculate_defense_power(self, defender_id: str) -> float:
+    async def calculate_defense_power(self, defender_id: str) -> float:
         """Calculate defender's defensive power."""
-        defense_muscles = [MuscleGroup.CORE, MuscleGroup.LEGS, MuscleGroup.BACK]
+        volumes = await MuscleVolumeLedger(self.db, defender_id).get_volumes(self.DEFENSE_MUSCLES)
+        return sum(volumes.values())
+    
+    @classmethod
+    def power_columns(cls):
+        """SUM expressions over UserMuscleVolume rows: (attack power, defense power)."""
+        return (
+            func.sum(case(
+                (UserMuscleVolume.muscle.in_(cls.ATTACK_MUSCLES), UserMuscleVolume.total_volume),
+                else_=0.0
+            )),
+            func.sum(case(
+                (UserMuscleVolume.muscle.in_(cls.DEFENSE_MUSCLES), UserMuscleVolume.total_volume),
+                else_=0.0
+            ))
+        )
+    
+    @classmethod
+    def split_power(cls, volumes: Dict[MuscleGroup, float]) -> Tuple[float, float]:
+        """(attack, defense) contribution of per-muscle volumes, e.g. one workout."""
+        attack = sum(volume for muscle, volume in volumes.items() if muscle in cls.ATTACK_MUSCLES)
+        defense = sum(volume for muscle, volume in volumes.items() if muscle in cls.DEFENSE_MUSCLES)
+        return attack, defense
+    
+    async def calculate_power(self, user_id: str) -> Tuple[float, float]:
+        """(attack power, defense power) of a user in one query."""
+        attack, defense = (await self.db.execute(
+            select(*self.power_columns()).where(UserMuscleVolume.user_id == user_id)
+        )).one()
+        return attack or 0.0, defense or 0.0
+    
+    async def check_target(self, defender_id: str, now: Optional[datetime] = None) -> Village:
+        """
+        Raise ValueError unless the defender may be raided: not the attacker,
+        has a village, and is not shielded. Returns the defender's village.
+        """
+        now = now or datetime.utcnow()
+        if defender_id == self.attacker_id:
+            raise ValueError("You cannot raid yourself")
         
-        total = 0.0
-        for muscle in defense_muscles:
-            exercise_ids = [e.id for e in self.db.query(Exercise).filter(
-                Exercise.primary_muscle == muscle
-            ).all()]
-            
-            if exercise_ids:
-                volume = self.db.query(func.sum(WorkoutSet.volume)).filter(
-                    WorkoutSet.exercise_id.in_(exercise_ids),
-                    WorkoutSet.workout_log_id.in_(
-                        self.db.query(WorkoutLog.id).filter(WorkoutLog.user_id == defender_id)
-                    )
-                ).scalar() or 0.0
-                total += volume
-        
-        return total
+        defender_village = await self.db.scalar(select(Village).where(Village.user_id == defender_id))
+        if not defender_village:
+            raise ValueError("Opponent has no village")
+        
+        if defender_village.shield_active and (
+            defender_village.shield_end_time is None or defender_village.shield_end_time > now
+        ):
+            raise ValueError("Opponent is protected by a shield")
+        
+        return defender_village
     
-    def simulate_battle(self, defender_id: str) -> dict:
+    async def start_raid(self, defender_id: str, now: Optional[datetime] = None):
         """
-        Simulate a raid battle.
+        check_target(), then claim the attacker's raid cooldown and commit.
         
-        Returns battle result with loot.
+        The claim is one conditional UPDATE of the attacker's last_raid_at,
+        so two raids started at once (other tab, other worker) cannot both
+        pass it. Raises ValueError while the cooldown runs.
         """
-        attack_power = self.calculate_attack_power()
-        defense_power = self.calculate_defense_power(defender_id)
-        
-        # Simple combat formula
-        power_ratio = attack_power / max(defense_power, 1)
-        
-        # Determine stars and damage
-        if power_ratio >= 2.0:
-            stars = 3
-            damage_percent = 100.0
-        elif power_ratio >= 1.5:
-            stars = 2
-            damage_percent = 75.0
-        elif power_ratio >= 1.0:
-            stars = 1
-            damage_percent = 50.0
-        else:
-            stars = 0
-            damage_percent = power_ratio * 30
+        now = now or datetime.utcnow()
+        await self.check_target(defender_id, now)
+        
+        cooldown = timedelta(seconds=settings.RAID_COOLDOWN_SECONDS)
+        claimed = await self.db.execute(
+            update(Village).where(
+                Village.user_id == self.attacker_id,
+                or_(Village.last_raid_at.is_(None), Village.last_raid_at <= now - cooldown)
+            ).values(last_raid_at=now)
+        )
+        if claimed.rowcount == 0:
+            raise ValueError(f"You can start one raid every {settings.RAID_COOLDOWN_SECONDS} seconds")
+        await self.db.commit()
+    
+    async def simulate_battle(self, defender_id: str, deployments: Optional[List[dict]] = None) -> dict:
+        """
+        Resolve a raid server-side with the battle simulator
+        (app/engines/battle.py) against the defender's buildings.
+        
+        deployments: validated troop plan (BattleSimulator.validate_deployments);
+        None sends the default army for the attacker's power.
+        Raises ValueError if the defender has nothing to raid (no buildings
+        besides walls), which would otherwise be a free 3-star win.
         
+        The simulation runs in a worker thread, so other requests and
+        sockets on this worker keep being served meanwhile.
+        
+        Returns battle result with loot and the battle's event stream.
+        """
+        attack_power = await self.calculate_attack_power()
+        defense_power = await self.calculate_defense_power(defender_id)
+        
+        defender_village = await self.db.scalar(select(Village).where(Village.user_id == defender_id))
+        buildings = []
+        if defender_village:
+            buildings = (await self.db.scalars(
+                select(Building).where(Building.village_id == defender_village.id)
+            )).all()
+        if not any(b.building_type != BuildingType.WALLS for b in buildings):
+            raise ValueError("Opponent has no buildings to raid")
+        
+        # CPU-bound (~0.1 s for a full base): keep it off the event loop
+        battle = await asyncio.to_thread(simulate, buildings, deployments, attack_power, defense_power)
+        stars = battle["stars"]
         victory = stars > 0
         
         # Calculate loot
-        defender_village = self.db.query(Village).filter(Village.user_id == defender_id).first()
-        
         if defender_village and victory:
             loot_percent = 0.1 + (stars * 0.05)  # 15-25% loot
-            gold_stolen = int(defender_village.gold * loot_percent)
-            elixir_stolen = int(defender_village.elixir * loot_percent)
-            dark_stolen = int(defender_village.dark_elixir * loot_percent * 0.5)
+            gold, elixir, dark_elixir = ResourceManager(self.db, defender_village).project()
+            gold_stolen = int(gold * loot_percent)
+            elixir_stolen = int(elixir * loot_percent)
+            dark_stolen = int(dark_elixir * loot_percent * 0.5)
         else:
             gold_stolen = 0
             elixir_stolen = 0
@@ -314,11 +468,50 @@ class RaidEngine:
         return {
             "victory": victory,
             "stars": stars,
-            "damage_percent": damage_percent,
+            "damage_percent": battle["destruction_percent"],
             "gold_stolen": gold_stolen,
             "elixir_stolen": elixir_stolen,
             "dark_elixir_stolen": dark_stolen,
             "attack_power_used": attack_power,
             "defense_power_faced": defense_power,
-            "trophies_gained": stars * 10 if victory else -5
+            "trophies_gained": stars * 10 if victory else -5,
+            "duration_seconds": battle["duration_seconds"],
+            "troops_deployed": battle["troops_deployed"],
+            "troops_lost": battle["troops_lost"],
+            "events": battle["events"]
         }
+    
+    async def apply_loot(self, defender_id: str, result: dict):
+        """Move a won raid's loot between the settled village balances and commit."""
+        if not result["victory"]:
+            return
+        
+        attacker_village = await self.db.scalar(select(Village).where(Village.user_id == self.attacker_id))
+        defender_village = await self.db.scalar(select(Village).where(Village.user_id == defender_id))
+        if not attacker_village or not defender_village:
+            return
+        
+        # Transfer from settled balances
+        ResourceManager(self.db, attacker_village).settle()
+        ResourceManager(self.db, defender_village).settle()
+        
+        # Take from defender
+        defender_village.gold -= result["gold_stolen"]
+        defender_village.elixir -= result["elixir_stolen"]
+        defender_village.dark_elixir -= result["dark_elixir_stolen"]
+        
+        # Give to attacker
+        attacker_village.gold = min(
+            attacker_village.gold + result["gold_stolen"],
+            attacker_village.gold_capacity
+        )
+        attacker_village.elixir = min(
+            attacker_village.elixir + result["elixir_stolen"],
+            attacker_village.elixir_capacity
+        )
+        attacker_village.dark_elixir = min(
+            attacker_village.dark_elixir + result["dark_elixir_stolen"],
+            attacker_village.dark_elixir_capacity
+        )
+        
+        await self.db.commit()
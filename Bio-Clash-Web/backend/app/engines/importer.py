@@ -0,0 +1,294 @@
+"""
+Workout Import Engine
+Streams historical sets (NDJSON or CSV) into WorkoutLog / WorkoutSet.
+"""
+import codecs
+import csv
+import json
+import time
+import uuid
+from datetime import datetime
+from typing import Any, AsyncIterator, Dict, List, Optional
+
+from pydantic import ValidationError
+from sqlalchemy import select, insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.catalog import exercise_catalog
+from app.core.recovery_cache import recovery_cache
+from app.models.user import User
+from app.models.game import Village
+from app.models.fitness import WorkoutLog, WorkoutSet
+from app.engines.volume import MuscleVolumeLedger
+from app.engines.game import ResourceManager, RaidEngine
+from app.engines.clan import ClanManager
+from app.schemas.fitness import WorkoutImportRow, WorkoutImportReport
+
+
+class WorkoutImporter:
+    """
+    Bulk importer for a user's training history.
+
+    Each input row is one set. Consecutive rows with the same (date, session)
+    form one workout. Rows are validated against the exercise catalog and
+    written with chunked executemany INSERTs, so memory stays bounded by
+    CHUNK_SIZE rather than the size of the upload. Per-user aggregates
+    (muscle ledger, resources, consistency) are recomputed once at the end,
+    for the committed chunks only: also when the upload breaks off (client
+    disconnect, database error), so imported rows never miss their ledger
+    and rewards.
+    """
+
+    CHUNK_SIZE = 1000  # Sets per INSERT batch (and per commit)
+    MAX_ERRORS = 20    # Rejected rows reported back in detail
+
+    def __init__(self, db: AsyncSession, user: User):
+        self.db = db
+        self.user = user
+        self.report = WorkoutImportReport()
+        self._pending_logs: List[Dict[str, Any]] = []
+        self._pending_sets: List[Dict[str, Any]] = []
+        self._workout: Optional[Dict[str, Any]] = None
+        self._workout_sets: List[Dict[str, Any]] = []
+        self._workout_key = None
+        self._total_volume = 0.0
+
+    async def run(self, chunks: AsyncIterator[bytes], fmt: str) -> WorkoutImportReport:
+        """Import a byte stream in "ndjson" or "csv" format."""
+        started = time.perf_counter()
+        catalog = await exercise_catalog.ensure_loaded(self.db)
+
+        parse = _parse_csv if fmt == "csv" else _parse_ndjson
+        parser = parse()
+        next(parser)  # Prime the generator-based parser
+
+        finished = False
+        try:
+            # Rows are handled one received chunk at a time
+            async for lines in _iter_line_batches(chunks):
+                for line_number, record in (parser.send(line) for line in lines):
+                    if record is None:
+                        continue
+                    self.report.rows_read += 1
+
+                    if isinstance(record, str):
+                        self._reject(line_number, record)
+                        continue
+
+                    try:
+                        row = WorkoutImportRow.model_validate(record)
+                    except ValidationError as e:
+                        error = e.errors()[0]
+                        self._reject(line_number, f"{'.'.join(map(str, error['loc']))}: {error['msg']}")
+                        continue
+
+                    exercise = catalog.get(row.exercise_id) if row.exercise_id else catalog.get_by_name(row.exercise_name or "")
+                    if not exercise:
+                        self._reject(line_number, f"Unknown exercise {row.exercise_id or row.exercise_name!r}")
+                        continue
+
+                    self._add_set(row, exercise.id)
+
+                if len(self._pending_sets) >= self.CHUNK_SIZE:
+                    await self._flush()
+
+            self._close_workout()
+            await self._flush()
+            finished = True
+        finally:
+            if not finished:
+                # Drop the chunk in flight; the committed ones still get their aggregates
+                await self.db.rollback()
+                await self.db.refresh(self.user)
+            await self._apply_aggregates()
+
+        self.report.elapsed_seconds = round(time.perf_counter() - started, 3)
+        if self.report.elapsed_seconds > 0:
+            self.report.rows_per_second = round(self.report.rows_read / self.report.elapsed_seconds, 1)
+
+        return self.report
+
+    # ============================================================
+    # BATCHING
+    # ============================================================
+
+    def _add_set(self, row: WorkoutImportRow, exercise_id: str):
+        key = (row.date, row.session)
+        if key != self._workout_key:
+            self._close_workout()
+            self._workout_key = key
+            self._workout = {
+                "id": str(uuid.uuid4()),
+                "user_id": self.user.id,
+                "date": row.date,
+                "notes": f"Imported session {row.session}" if row.session else "Imported",
+                "total_volume_kg": 0.0,
+                "total_sets": 0,
+                "avg_rpe": None,
+                "created_at": datetime.utcnow()
+            }
+
+        volume = (row.weight_kg or 0) * (row.reps or 0)
+        self._workout_sets.append({
+            "id": str(uuid.uuid4()),
+            "workout_log_id": self._workout["id"],
+            "exercise_id": exercise_id,
+            "set_number": row.set_number or len(self._workout_sets) + 1,
+            "reps": row.reps,
+            "weight_kg": row.weight_kg,
+            "distance_km": row.distance_km,
+            "duration_seconds": row.duration_seconds,
+            "rpe": row.rpe,
+            "rir": row.rir,
+            "tempo": row.tempo,
+            "volume": volume
+        })
+        self._workout["total_volume_kg"] += volume
+
+    def _close_workout(self):
+        """Finalize the open workout's aggregates and queue it for insert."""
+        if self._workout is None:
+            return
+
+        rpes = [s["rpe"] for s in self._workout_sets if s["rpe"]]
+        self._workout["total_sets"] = len(self._workout_sets)
+        self._workout["avg_rpe"] = (sum(rpes) / len(rpes)) if rpes else None
+
+        self._pending_logs.append(self._workout)
+        self._pending_sets.extend(self._workout_sets)
+
+        self._workout = None
+        self._workout_sets = []
+        self._workout_key = None
+
+    async def _flush(self):
+        """Write queued workouts then their sets (executemany) and commit."""
+        if not self._pending_logs:
+            return
+
+        await self.db.execute(insert(WorkoutLog.__table__), self._pending_logs)
+        await self.db.execute(insert(WorkoutSet.__table__), self._pending_sets)
+        await self.db.commit()
+
+        # Counted once committed: the aggregates cover exactly these rows
+        self.report.workouts_created += len(self._pending_logs)
+        self.report.sets_imported += len(self._pending_sets)
+        self._total_volume += sum(log["total_volume_kg"] for log in self._pending_logs)
+
+        self._pending_logs = []
+        self._pending_sets = []
+
+    def _reject(self, line_number: int, message: str):
+        self.report.rows_rejected += 1
+        if len(self.report.errors) < self.MAX_ERRORS:
+            self.report.errors.append(f"line {line_number}: {message}")
+
+    # ============================================================
+    # AGGREGATES
+    # ============================================================
+
+    async def _apply_aggregates(self):
+        """Rebuild the muscle ledger and grant rewards once for every committed workout."""
+        if self.report.workouts_created == 0:
+            return
+
+        # Same reward rates as a single logged workout
+        self.report.gold_earned = int(self._total_volume / 10)
+        self.report.elixir_earned = self.report.sets_imported * 5
+
+        village = await self.db.scalar(select(Village).where(Village.user_id == self.user.id))
+        if village:
+            ResourceManager(self.db, village).settle()
+            village.gold = min(village.gold + self.report.gold_earned, village.gold_capacity)
+            village.elixir = min(village.elixir + self.report.elixir_earned, village.elixir_capacity)
+
+        self.user.consistency_score = User.raised_consistency(2 * self.report.workouts_created)
+
+        # Power before the ledger rebuild, for the clan total delta
+        raid_engine = RaidEngine(self.db, self.user.id)
+        attack_before, defense_before = await raid_engine.calculate_power(self.user.id)
+        
+        # Commits the reward updates together with the ledger
+        await MuscleVolumeLedger.rebuild(self.db, user_id=self.user.id)
+        
+        attack_after, defense_after = await raid_engine.calculate_power(self.user.id)
+        await ClanManager.apply_power_delta(
+            self.db, self.user.id, attack_after - attack_before, defense_after - defense_before
+        )
+        await self.db.commit()
+        
+        # Core INSERTs bypass the recovery memo's flush hooks
+        recovery_cache.invalidate(self.user.id)
+
+
+# ============================================================
+# STREAM PARSING
+# ============================================================
+
+async def _iter_line_batches(chunks: AsyncIterator[bytes]):
+    """
+    Split a UTF-8 byte stream into lines without buffering it whole.
+    Yields the complete lines of each received chunk as one list.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    buffer = ""
+
+    async for chunk in chunks:
+        buffer += decoder.decode(chunk)
+        *lines, buffer = buffer.split("\n")
+        if lines:
+            yield lines
+
+    buffer += decoder.decode(b"", final=True)
+    if buffer:
+        yield [buffer]
+
+
+def _parse_ndjson():
+    """
+    Coroutine parser: send() a line, get back (line_number, record).
+    record is a dict, an error string, or None for blank lines.
+    """
+    line_number = 0
+    result = None
+    while True:
+        line = yield result
+        line_number += 1
+        if not line.strip():
+            result = (line_number, None)
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            result = (line_number, f"Invalid JSON ({e.msg})")
+            continue
+        if not isinstance(record, dict):
+            result = (line_number, "Expected a JSON object")
+            continue
+        result = (line_number, record)
+
+
+def _parse_csv():
+    """
+    Coroutine parser for CSV with a header row (see _parse_ndjson).
+    Empty cells are treated as missing fields.
+    """
+    line_number = 0
+    header = None
+    result = None
+    while True:
+        line = yield result
+        line_number += 1
+        result = (line_number, None)
+        if not line.strip():
+            continue
+        values = next(csv.reader([line.rstrip("\r")]))
+        if header is None:
+            header = [name.strip() for name in values]
+            continue
+        if len(values) != len(header):
+            result = (line_number, f"Expected {len(header)} columns, got {len(values)}")
+            continue
+        result = (line_number, {
+            name: value.strip() for name, value in zip(header, values) if value.strip() != ""
+        })
@@ -0,0 +1,302 @@
+"""
+Matchmaking Engine
+In-process nearest-neighbour opponent index for raid matchmaking.
+
+Each league keeps its players sorted by defense power. A search bisects to
+the attacker's attack power and walks outwards, skipping shielded players,
+the attacker and their recent targets, so a lookup costs O(log n + k)
+instead of a table scan.
+
+The index is built with one aggregate query and refreshed incrementally:
+committed changes to a User, Village or UserMuscleVolume row mark that
+user dirty, and the next search reloads only the dirty users. Bulk
+statements that bypass the ORM call track() or invalidate() themselves.
+Those hooks only see this process's commits, so the index is also rebuilt
+once it is OPPONENT_INDEX_TTL_SECONDS old, which bounds how stale another
+worker's shields, leagues and powers can get.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import deque
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Any, Deque, Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.core.invalidation import on_commit
+from app.core.enums import LeagueTier
+from app.models.user import User
+from app.models.game import Village
+from app.models.fitness import UserMuscleVolume
+from app.engines.game import RaidEngine
+
+
+@dataclass(frozen=True)
+class OpponentEntry:
+    """Matchmaking snapshot of one player."""
+    user_id: str
+    league: LeagueTier
+    attack_power: float
+    defense_power: float
+    shield_until: Optional[datetime]
+
+    def is_shielded(self, now: datetime) -> bool:
+        return self.shield_until is not None and self.shield_until > now
+
+
+class OpponentIndex:
+    """
+    Per-league lists of (defense_power, user_id), kept sorted.
+
+    - entries: user_id -> OpponentEntry
+    - recent targets: per attacker, the last `recent_targets` opponents
+      (found or attacked) within `recent_target_seconds`
+
+    A build expires after `ttl_seconds`.
+    """
+
+    def __init__(self, recent_targets: int, recent_target_seconds: float, ttl_seconds: float):
+        self.recent_targets = recent_targets
+        self.recent_target_seconds = recent_target_seconds
+        self.ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._expires_at = 0.0
+        self._entries: Dict[str, OpponentEntry] = {}
+        self._keys: Dict[LeagueTier, List[Tuple[float, str]]] = {}
+        self._dirty: Set[str] = set()
+        self._recent: Dict[str, Deque[Tuple[float, str]]] = {}
+        self.builds = 0
+        self.refreshed_users = 0
+        self.searches = 0
+        self.scanned = 0
+        self.total_search_seconds = 0.0
+
+    # ============================================================
+    # LOADING
+    # ============================================================
+
+    async def _load(self, db: AsyncSession, user_ids: Optional[List[str]] = None) -> List[OpponentEntry]:
+        """
+        Snapshot players with one query: users LEFT JOIN per-user attack /
+        defense sums from the muscle ledger LEFT JOIN villages (shield).
+        """
+        attack, defense = RaidEngine.power_columns()
+        power = select(
+            UserMuscleVolume.user_id, attack.label("attack"), defense.label("defense")
+        ).group_by(UserMuscleVolume.user_id)
+
+        query = select(User.id, User.league_tier, Village.shield_active, Village.shield_end_time)
+
+        if user_ids is not None:
+            power = power.where(UserMuscleVolume.user_id.in_(user_ids))
+            query = query.where(User.id.in_(user_ids))
+
+        power = power.subquery()
+        query = (
+            query.add_columns(func.coalesce(power.c.attack, 0.0), func.coalesce(power.c.defense, 0.0))
+            .outerjoin(power, power.c.user_id == User.id)
+            .outerjoin(Village, Village.user_id == User.id)
+        )
+
+        return [
+            OpponentEntry(
+                user_id=user_id,
+                league=league or LeagueTier.BRONZE,
+                attack_power=float(attack or 0.0),
+                defense_power=float(defense or 0.0),
+                shield_until=(shield_end or datetime.max) if shield_active else None
+            )
+            for user_id, league, shield_active, shield_end, attack, defense in await db.execute(query)
+        ]
+
+    async def ensure_loaded(self, db: AsyncSession) -> "OpponentIndex":
+        """Build the index if needed or expired, otherwise reload only the dirty users."""
+        if not self._loaded or time.monotonic() >= self._expires_at:
+            with self._lock:
+                self._dirty.clear()
+            expires_at = time.monotonic() + self.ttl_seconds
+            entries = await self._load(db)
+
+            keys: Dict[LeagueTier, List[Tuple[float, str]]] = {league: [] for league in LeagueTier}
+            for entry in entries:
+                keys[entry.league].append((entry.defense_power, entry.user_id))
+            for league_keys in keys.values():
+                league_keys.sort()
+
+            with self._lock:
+                self._entries = {entry.user_id: entry for entry in entries}
+                self._keys = keys
+                self._loaded = True
+                self._expires_at = expires_at
+                self.builds += 1
+            return self
+
+        with self._lock:
+            dirty, self._dirty = self._dirty, set()
+        if dirty:
+            await self.refresh(db, list(dirty))
+        return self
+
+    async def refresh(self, db: AsyncSession, user_ids: List[str]):
+        """Reload the given users and move them to their new sorted positions."""
+        entries = {entry.user_id: entry for entry in await self._load(db, user_ids)}
+
+        with self._lock:
+            for user_id in user_ids:
+                self._remove(user_id)
+                entry = entries.get(user_id)
+                if entry is not None:
+                    self._entries[user_id] = entry
+                    insort(self._keys.setdefault(entry.league, []), (entry.defense_power, user_id))
+            self.refreshed_users += len(user_ids)
+
+    def _remove(self, user_id: str):
+        entry = self._entries.pop(user_id, None)
+        if entry is None:
+            return
+        keys = self._keys.get(entry.league, [])
+        i = bisect_left(keys, (entry.defense_power, user_id))
+        if i < len(keys) and keys[i][1] == user_id:
+            del keys[i]
+
+    def mark_dirty(self, user_ids):
+        with self._lock:
+            self._dirty.update(user_ids)
+
+    def invalidate(self):
+        """Drop the whole index; it is rebuilt on next ensure_loaded()."""
+        with self._lock:
+            self._loaded = False
+
+    def track(self, session, user_id: Optional[str] = None):
+        """
+        Refresh a user (or everyone, if user_id is None) once `session` commits.
+        For Core statements that the flush hooks cannot see.
+        """
+        _opponent_changes.add(session, (user_id,))
+
+    # ============================================================
+    # SEARCH
+    # ============================================================
+
+    def record_target(self, attacker_id: str, target_id: str):
+        """Remember an opponent so the next searches skip it for a while."""
+        with self._lock:
+            recent = self._recent.setdefault(attacker_id, deque(maxlen=self.recent_targets))
+            recent.append((time.monotonic(), target_id))
+
+    def _recent_targets(self, attacker_id: str) -> Set[str]:
+        cutoff = time.monotonic() - self.recent_target_seconds
+        with self._lock:
+            recent = self._recent.get(attacker_id)
+            if not recent:
+                return set()
+            while recent and recent[0][0] < cutoff:
+                recent.popleft()
+            if not recent:
+                del self._recent[attacker_id]
+                return set()
+            return {target_id for _, target_id in recent}
+
+    async def nearest(self, db: AsyncSession, user_id: str, count: int = 5) -> List[OpponentEntry]:
+        """
+        The `count` same-league players whose defense power is closest to
+        this user's attack power, excluding shielded players, the user and
+        their recent targets. Recent targets are allowed again when there
+        is nobody else.
+        """
+        await self.ensure_loaded(db)
+        me = self._entries.get(user_id)
+        if me is None:
+            await self.refresh(db, [user_id])
+            me = self._entries.get(user_id)
+            if me is None:
+                return []
+
+        started = time.perf_counter()
+        now = datetime.utcnow()
+        recent = self._recent_targets(user_id)
+
+        result = self._walk(me, count, now, recent)
+        if not result and recent:
+            result = self._walk(me, count, now, set())
+
+        self.searches += 1
+        self.total_search_seconds += time.perf_counter() - started
+        return result
+
+    def _walk(self, me: OpponentEntry, count: int, now: datetime, skip: Set[str]) -> List[OpponentEntry]:
+        """Two-pointer walk outwards from the attacker's power in their league."""
+        with self._lock:
+            keys = self._keys.get(me.league, [])
+            hi = bisect_left(keys, (me.attack_power, ""))
+            lo = hi - 1
+            result = []
+
+            while len(result) < count and (lo >= 0 or hi < len(keys)):
+                if hi >= len(keys) or (lo >= 0 and me.attack_power - keys[lo][0] <= keys[hi][0] - me.attack_power):
+                    _, candidate_id = keys[lo]
+                    lo -= 1
+                else:
+                    _, candidate_id = keys[hi]
+                    hi += 1
+
+                self.scanned += 1
+                if candidate_id == me.user_id or candidate_id in skip:
+                    continue
+                candidate = self._entries[candidate_id]
+                if candidate.is_shielded(now):
+                    continue
+                result.append(candidate)
+
+            return result
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "loaded": self._loaded,
+                "entries": len(self._entries),
+                "leagues": {league.value: len(keys) for league, keys in self._keys.items()},
+                "dirty": len(self._dirty),
+                "builds": self.builds,
+                "refreshed_users": self.refreshed_users,
+                "searches": self.searches,
+                "avg_scanned": round(self.scanned / self.searches, 2) if self.searches else 0.0,
+                "avg_search_us": round(self.total_search_seconds / self.searches * 1e6, 1) if self.searches else 0.0,
+            }
+
+
+# Global opponent index
+opponent_index = OpponentIndex(
+    recent_targets=settings.OPPONENT_RECENT_TARGETS,
+    recent_target_seconds=settings.OPPONENT_RECENT_TARGET_SECONDS,
+    ttl_seconds=settings.OPPONENT_INDEX_TTL_SECONDS
+)
+
+
+# ============================================================
+# INVALIDATION
+# Committed changes to a player's league, shield or ledger mark them dirty.
+# ============================================================
+
+def _changed_player(session, obj):
+    if isinstance(obj, User):
+        return (obj.id,)
+    if isinstance(obj, (Village, UserMuscleVolume)):
+        return (obj.user_id,)
+    return ()
+
+
+def _refresh_opponents(user_ids):
+    # None (from track()) stands for everyone
+    if None in user_ids:
+        opponent_index.invalidate()
+    opponent_index.mark_dirty(user_ids - {None})
+
+
+_opponent_changes = on_commit("opponent_index_user_ids", _changed_player, _refresh_opponents)
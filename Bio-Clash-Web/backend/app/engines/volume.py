@@ -0,0 +1,162 @@
+"""
+Volume Ledger Engine
+Maintains the materialized per-user muscle volume totals (UserMuscleVolume).
+"""
+from datetime import date
+from typing import Dict, Iterable, List, Optional, Tuple
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, insert, delete, func, case, or_
+
+from app.core.enums import MuscleGroup
+from app.models.fitness import Exercise, WorkoutLog, WorkoutSet, UserMuscleVolume
+
+
+class MuscleVolumeLedger:
+    """
+    Reads and updates a user's running volume per muscle group.
+
+    Workout logging calls record_sets() inside its own transaction;
+    everything else reads the ledger instead of summing WorkoutSet rows.
+    """
+
+    def __init__(self, db: AsyncSession, user_id: str):
+        self.db = db
+        self.user_id = user_id
+
+    async def get_volume(self, muscle: MuscleGroup) -> float:
+        """Get user's total volume for a single muscle group (primary key lookup)."""
+        row = await self.db.get(UserMuscleVolume, (self.user_id, muscle))
+        return row.total_volume if row else 0.0
+
+    async def get_volumes(self, muscles: Iterable[MuscleGroup]) -> Dict[MuscleGroup, float]:
+        """Get user's total volume for several muscle groups in one query."""
+        muscles = list(muscles)
+        volumes = {muscle: 0.0 for muscle in muscles}
+
+        rows = await self.db.execute(
+            select(UserMuscleVolume.muscle, UserMuscleVolume.total_volume).where(
+                UserMuscleVolume.user_id == self.user_id,
+                UserMuscleVolume.muscle.in_(muscles)
+            )
+        )
+
+        for muscle, volume in rows:
+            volumes[muscle] = volume or 0.0
+
+        return volumes
+
+    async def get_rows(self) -> List[UserMuscleVolume]:
+        """Get all ledger rows for the user."""
+        rows = await self.db.scalars(
+            select(UserMuscleVolume).where(UserMuscleVolume.user_id == self.user_id)
+        )
+        return rows.all()
+
+    async def record_sets(
+        self, muscle_totals: Dict[MuscleGroup, Tuple[float, int]], workout_date: date
+    ):
+        """
+        Add a workout's (volume, set_count) per muscle to the ledger.
+        Does not commit: the caller owns the transaction.
+
+        One upsert: the increments are applied by the database, so
+        concurrent workouts of the same user neither lose an update nor
+        collide on a muscle's first row.
+        """
+        if not muscle_totals:
+            return
+
+        ledger = UserMuscleVolume.__table__
+        rows = [
+            {
+                "user_id": self.user_id,
+                "muscle": muscle,
+                "total_volume": volume,
+                "set_count": set_count,
+                "last_date": workout_date
+            }
+            for muscle, (volume, set_count) in muscle_totals.items()
+        ]
+
+        dialect = self.db.bind.dialect.name
+        if dialect == "mysql":
+            from sqlalchemy.dialects.mysql import insert as upsert
+            stmt = upsert(ledger)
+            new = stmt.inserted
+        else:
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as upsert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as upsert
+            stmt = upsert(ledger)
+            new = stmt.excluded
+
+        totals = {
+            "total_volume": func.coalesce(ledger.c.total_volume, 0.0) + new.total_volume,
+            "set_count": func.coalesce(ledger.c.set_count, 0) + new.set_count,
+            "last_date": case(
+                (or_(ledger.c.last_date.is_(None), new.last_date > ledger.c.last_date), new.last_date),
+                else_=ledger.c.last_date
+            ),
+        }
+        if dialect == "mysql":
+            stmt = stmt.on_duplicate_key_update(**totals)
+        else:
+            stmt = stmt.on_conflict_do_update(index_elements=[ledger.c.user_id, ledger.c.muscle], set_=totals)
+
+        await self.db.execute(stmt, rows)
+
+        # Core statement: the opponent index's flush hook cannot see it
+        from app.engines.matchmaking import opponent_index
+        opponent_index.track(self.db, self.user_id)
+
+    @staticmethod
+    async def rebuild(db: AsyncSession, user_id: Optional[str] = None) -> int:
+        """
+        Recompute the ledger from WorkoutSet history (backfill / repair).
+        Rebuilds a single user if user_id is given, otherwise everyone.
+
+        Returns the number of ledger rows written.
+        """
+        query = select(
+            WorkoutLog.user_id,
+            Exercise.primary_muscle,
+            func.sum(WorkoutSet.volume),
+            func.count(WorkoutSet.id),
+            func.max(WorkoutLog.date)
+        ).join(
+            WorkoutSet, WorkoutSet.workout_log_id == WorkoutLog.id
+        ).join(
+            Exercise, Exercise.id == WorkoutSet.exercise_id
+        )
+
+        delete_stmt = delete(UserMuscleVolume)
+
+        if user_id is not None:
+            query = query.where(WorkoutLog.user_id == user_id)
+            delete_stmt = delete_stmt.where(UserMuscleVolume.user_id == user_id)
+
+        rows = (await db.execute(
+            query.group_by(WorkoutLog.user_id, Exercise.primary_muscle)
+        )).all()
+
+        await db.execute(delete_stmt)
+        if rows:
+            await db.execute(insert(UserMuscleVolume), [
+                {
+                    "user_id": row_user_id,
+                    "muscle": muscle,
+                    "total_volume": volume or 0.0,
+                    "set_count": set_count or 0,
+                    "last_date": last_date
+                }
+                for row_user_id, muscle, volume, set_count, last_date in rows
+            ])
+
+        # Core DELETE/INSERT bypass the flush hooks of the opponent index
+        from app.engines.matchmaking import opponent_index
+        opponent_index.track(db, user_id)
+
+        await db.commit()
+
+        return len(rows)
@@ -0,0 +1,61 @@
+"""
+Background Jobs
+Periodic jobs run by the task runner (app/core/tasks.py).
+
+Each job opens its own session and returns a small result dict that is
+reported under "jobs" in GET /metrics.
+"""
+from app.core.config import settings
+from app.core.tasks import TaskRunner, task_runner
+from app.db.session import AsyncSessionLocal
+from app.engines.game import ResourceManager
+from app.engines.clan import ClanManager, ClanWarEngine
+from app.engines.fairplay import FatigueOracle, LeagueClustering
+
+
+async def tick_resources() -> dict:
+    """Advance all village balances (set-based UPDATE)."""
+    async with AsyncSessionLocal() as db:
+        return await ResourceManager.tick_all(db)
+
+
+async def war_lifecycle() -> dict:
+    """Start due battles and resolve ended wars."""
+    async with AsyncSessionLocal() as db:
+        return await ClanWarEngine(db).check_and_end_wars()
+
+
+async def war_matchmaking() -> dict:
+    """Pair clans waiting in the war matchmaking queue."""
+    async with AsyncSessionLocal() as db:
+        return await ClanWarEngine(db).match_queue()
+
+
+async def reconcile_clan_power() -> dict:
+    """Correct drift in the incrementally maintained clan power totals and member counts."""
+    async with AsyncSessionLocal() as db:
+        result = await ClanManager.reconcile_power(db)
+        result["member_counts_fixed"] = await ClanManager.reconcile_member_counts(db)
+        return result
+
+
+async def score_recovery() -> dict:
+    """Score every user's recovery and enforce fatigue shields."""
+    async with AsyncSessionLocal() as db:
+        return await FatigueOracle.score_all(db)
+
+
+async def cluster_leagues() -> dict:
+    """Re-cluster every user into leagues (K-Means)."""
+    async with AsyncSessionLocal() as db:
+        return await LeagueClustering(db).rebuild_leagues()
+
+
+def register_jobs(runner: TaskRunner = task_runner):
+    """Register every periodic job with its interval from Settings."""
+    runner.add("resource_tick", settings.RESOURCE_SYNC_INTERVAL_SECONDS, tick_resources)
+    runner.add("war_lifecycle", settings.WAR_LIFECYCLE_INTERVAL_SECONDS, war_lifecycle)
+    runner.add("war_matchmaking", settings.WAR_MATCHMAKING_INTERVAL_SECONDS, war_matchmaking)
+    runner.add("clan_power_reconcile", settings.CLAN_POWER_RECONCILE_INTERVAL_SECONDS, reconcile_clan_power)
+    runner.add("fatigue_scoring", settings.FATIGUE_SCORING_INTERVAL_SECONDS, score_recovery)
+    runner.add("league_clustering", settings.LEAGUE_CLUSTERING_INTERVAL_SECONDS, cluster_leagues)
@@ -12,8 +12,16 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 from app.core.config import settings
-from app.db.session import Base, engine, SessionLocal
+from app.db.session import Base, engine, SessionLocal, async_engine
+from app.db.search import ensure_search_index
+from app.db.migrate import upgrade_schema
 from app.api.api_v1.api import api_router
+from app.core.tasks import task_runner
+from app.core.scheduler import upgrade_scheduler
+from app.core.websocket import manager
+from app.core.pubsub import create_broker
+from app.core.chat import chat_writer, chat_history
+from app.jobs import register_jobs
 
 
 @asynccontextmanager
@@ -25,17 +33,43 @@ async def lifespan(app: FastAPI):
     # Startup
     print("🚀 Starting Bio-Clash API...")
     
-    # Create all tables
+    # Create all tables, then upgrade tables that already existed
     Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    ensure_search_index(engine)
     print("✅ Database tables created")
     
     # Seed exercise data if empty
     seed_exercises()
     
+    # Load the exercise catalog into memory
+    load_exercise_catalog()
+    
+    # Build the raid opponent index before the first search
+    await load_opponent_index()
+    
+    # Room pub/sub across workers
+    await manager.use_broker(create_broker(manager.dispatch))
+    print(f"📡 WebSocket pub/sub backend: {settings.PUBSUB_BACKEND}")
+    chat_writer.start()
+    
+    # Periodic background jobs
+    register_jobs()
+    if settings.BACKGROUND_JOBS_ENABLED:
+        task_runner.start()
+        print(f"⏱️ Background jobs started ({', '.join(task_runner.tasks)})")
+        pending = await upgrade_scheduler.start()
+        print(f"🔨 Upgrade scheduler started ({pending} pending)")
+    
     yield
     
     # Shutdown
     print("👋 Shutting down Bio-Clash API...")
+    await task_runner.stop()
+    await upgrade_scheduler.stop()
+    await manager.close_all()
+    await chat_writer.stop()
+    await async_engine.dispose()
 
 
 def seed_exercises():
@@ -82,6 +116,28 @@ def seed_exercises():
         db.close()
 
 
+def load_exercise_catalog():
+    """Load the in-process exercise catalog (id/name/muscle lookups)."""
+    from app.core.catalog import exercise_catalog
+    
+    db = SessionLocal()
+    try:
+        exercise_catalog.load(db)
+        print(f"📚 Exercise catalog cached ({len(exercise_catalog.all())} exercises)")
+    finally:
+        db.close()
+
+
+async def load_opponent_index():
+    """Build the in-process raid opponent index (one aggregate query)."""
+    from app.engines.matchmaking import opponent_index
+    from app.db.session import AsyncSessionLocal
+    
+    async with AsyncSessionLocal() as db:
+        await opponent_index.ensure_loaded(db)
+    print(f"🎯 Opponent index built ({opponent_index.stats()['entries']} players)")
+
+
 # Create FastAPI app
 app = FastAPI(
     title=settings.APP_NAME,
@@ -117,6 +173,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 # Include API router
@@ -134,6 +191,29 @@ async def root():
     }
 
 
+@app.get("/metrics", tags=["Health"])
+async def metrics():
+    """Runtime counters (connection pool checkout waits, cache hit rates, job timings, WebSocket delivery, chat writes)."""
+    from app.db.profile import pool_stats
+    from app.core.auth_cache import user_cache
+    from app.engines.matchmaking import opponent_index
+    from app.core.recovery_cache import recovery_cache
+    from app.core.roster import roster_cache
+    
+    return {
+        "db_pool": {name: stats.stats() for name, stats in pool_stats.items()},
+        "auth_cache": user_cache.stats(),
+        "recovery_cache": recovery_cache.stats(),
+        "roster_cache": roster_cache.stats(),
+        "jobs": task_runner.stats(),
+        "upgrade_scheduler": upgrade_scheduler.stats(),
+        "websocket": manager.stats(),
+        "chat_writer": chat_writer.stats(),
+        "chat_history": chat_history.stats(),
+        "opponent_index": opponent_index.stats()
+    }
+
+
 @app.get("/health", tags=["Health"])
 async def health_check():
     """Detailed health check."""
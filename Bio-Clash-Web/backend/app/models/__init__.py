@@ -1,5 +1,5 @@
 # Models package - Import all models for easy access and Alembic discovery
 from app.models.user import User, Profile
-from app.models.fitness import Exercise, WorkoutLog, WorkoutSet, DailyBiometrics
+from app.models.fitness import Exercise, WorkoutLog, WorkoutSet, DailyBiometrics, UserMuscleVolume
 from app.models.game import Village, Building, UpgradeQueue, BUILDING_REQUIREMENTS
 from app.models.clan import Clan, ClanMember, ClanWar, WarAttack, ClanMessage
@@ -4,7 +4,7 @@ Handles clans, membership, and clan wars.
 """
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, Float, Boolean, DateTime, Text, ForeignKey, Enum as SQLEnum
+from sqlalchemy import Column, String, Integer, Float, Boolean, DateTime, Text, ForeignKey, Index, Enum as SQLEnum, text
 from sqlalchemy.orm import relationship
 
 from app.db.session import Base
@@ -16,6 +16,11 @@ class Clan(Base):
     Clan/Legion - A group of players competing together.
     """
     __tablename__ = "clans"
+    __table_args__ = (
+        # Clan search: public clans sorted by size or trophies
+        Index("ix_clans_public_member_count", "is_public", "member_count"),
+        Index("ix_clans_public_trophies", "is_public", "total_trophies"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     
@@ -39,6 +44,9 @@ class Clan(Base):
     min_trophies_required = Column(Integer, default=0)
     max_members = Column(Integer, default=50)
     
+    # Maintained on join/leave (ClanManager); reconcile_member_counts() repairs drift
+    member_count = Column(Integer, default=0, nullable=False)
+    
     # Aggregate biological power (sum of all members)
     total_attack_power = Column(Float, default=0)
     total_defense_power = Column(Float, default=0)
@@ -55,6 +63,12 @@ class ClanMember(Base):
     Clan membership - Links users to clans with roles.
     """
     __tablename__ = "clan_members"
+    __table_args__ = (
+        # A user belongs to at most one clan
+        Index("uq_clan_members_user_id", "user_id", unique=True),
+        # Clan roster
+        Index("ix_clan_members_clan_id", "clan_id"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     
@@ -82,17 +96,33 @@ class ClanWar(Base):
     Total biological power determines the winner.
     """
     __tablename__ = "clan_wars"
+    __table_args__ = (
+        # War lifecycle runner: due PREPARATION -> BATTLE and BATTLE -> WAR_ENDED
+        Index("ix_clan_wars_state_battle_start", "state", "battle_start"),
+        Index("ix_clan_wars_state_battle_end", "state", "battle_end"),
+        # War matchmaking queue: waiting clans ordered by power
+        Index("ix_clan_wars_state_search_power", "state", "search_power"),
+        # At most one queue entry per clan
+        Index(
+            "uq_clan_wars_matchmaking_clan", "clan_id", unique=True,
+            sqlite_where=text("state = 'MATCHMAKING'"),
+            postgresql_where=text("state = 'MATCHMAKING'")
+        ),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     
     # Participating clans
     clan_id = Column(String, ForeignKey("clans.id"), nullable=False)
-    opponent_clan_id = Column(String, ForeignKey("clans.id"), nullable=False)
+    opponent_clan_id = Column(String, ForeignKey("clans.id"), nullable=True)  # None while matchmaking
     
     # War state
     state = Column(SQLEnum(WarState), default=WarState.PREPARATION)
     
-    # Timing
+    # Matchmaking: clan attack power when queued
+    search_power = Column(Float, nullable=True)
+    
+    # Timing (preparation_start is the queue time while matchmaking)
     preparation_start = Column(DateTime, default=datetime.utcnow)
     battle_start = Column(DateTime, nullable=True)
     battle_end = Column(DateTime, nullable=True)
@@ -149,6 +179,10 @@ class ClanMessage(Base):
     Clan chat message for real-time communication.
     """
     __tablename__ = "clan_messages"
+    __table_args__ = (
+        # History pages: newest first, keyset on (created_at, id)
+        Index("ix_clan_messages_clan_created_id", "clan_id", "created_at", "id"),
+    )
     
     id = Column(String, primary_key=True, default=lambda: str(uuid.uuid4()))
     
@@ -4,10 +4,11 @@ Fitness Domain Models
 - WorkoutLog: A single workout session
 - WorkoutSet: Individual sets within a workout
 - DailyBiometrics: Sleep, HRV, Steps tracking
+- UserMuscleVolume: Materialized per-user muscle volume ledger
 """
 import uuid
 from datetime import datetime, date
-from sqlalchemy import Column, String, Integer, Float, DateTime, Date, ForeignKey, Enum as SQLEnum, Text
+from sqlalchemy import Column, String, Integer, Float, DateTime, Date, ForeignKey, Enum as SQLEnum, Text, Index
 from sqlalchemy.orm import relationship
 
 from app.db.session import Base
@@ -46,6 +47,10 @@ class WorkoutLog(Base):
     Contains multiple WorkoutSets.
     """
     __tablename__ = "workout_logs"
+    __table_args__ = (
+        # Keyset pagination of a user's history: ORDER BY date DESC, id DESC
+        Index("ix_workout_logs_user_date_id", "user_id", "date", "id"),
+    )
     
     id = Column(String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     user_id = Column(String(36), ForeignKey("users.id"), nullable=False, index=True)
@@ -136,8 +141,26 @@ class DailyBiometrics(Base):
     # Hydration
     water_liters = Column(Float, nullable=True)
     
-    # Timestamps
+    # Timestamps (updated_at keys the recovery score memo)
     created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     # Relationship
     user = relationship("User", back_populates="daily_biometrics")
+
+
+class UserMuscleVolume(Base):
+    """
+    Materialized per-user volume ledger (one row per muscle group).
+    Updated in the same transaction as workout logging, so upgrade checks
+    and combat power never re-sum the full WorkoutSet history.
+    """
+    __tablename__ = "user_muscle_volume"
+    
+    user_id = Column(String(36), ForeignKey("users.id"), primary_key=True)
+    muscle = Column(SQLEnum(MuscleGroup), primary_key=True)
+    
+    # Running totals
+    total_volume = Column(Float, default=0.0)
+    set_count = Column(Integer, default=0)
+    last_date = Column(Date, nullable=True)
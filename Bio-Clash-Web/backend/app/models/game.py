@@ -44,6 +44,9 @@ class Village(Base):
     shield_active = Column(Boolean, default=False)
     shield_end_time = Column(DateTime, nullable=True)
     
+    # Last raid this village's owner started (RAID_COOLDOWN_SECONDS)
+    last_raid_at = Column(DateTime, nullable=True)
+    
     # Timestamps for resource sync
     last_resource_sync = Column(DateTime, default=datetime.utcnow)
     
@@ -110,7 +113,7 @@ class UpgradeQueue(Base):
     # Timing
     start_time = Column(DateTime, default=datetime.utcnow)
     duration_seconds = Column(Integer, nullable=False)  # Base duration
-    finish_time = Column(DateTime, nullable=False)
+    finish_time = Column(DateTime, nullable=False, index=True)  # Scheduler heap rebuild
     
     # FairPlay: Paused if fatigued
     is_paused = Column(Boolean, default=False)
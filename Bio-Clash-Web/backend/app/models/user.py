@@ -5,7 +5,7 @@ User Domain Models
 """
 import uuid
 from datetime import datetime
-from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey, Enum as SQLEnum
+from sqlalchemy import Column, String, Integer, Float, DateTime, ForeignKey, Enum as SQLEnum, case
 from sqlalchemy.dialects.sqlite import JSON
 from sqlalchemy.orm import relationship
 
@@ -39,6 +39,16 @@ class User(Base):
     village = relationship("Village", back_populates="user", uselist=False)
     workout_logs = relationship("WorkoutLog", back_populates="user")
     daily_biometrics = relationship("DailyBiometrics", back_populates="user")
+    
+    @classmethod
+    def raised_consistency(cls, points: float):
+        """
+        consistency_score + points, capped at 100, as a SQL expression.
+        Assigned to user.consistency_score it is evaluated by the UPDATE
+        against the stored row, not the (possibly cached) loaded value.
+        """
+        raised = cls.consistency_score + points
+        return case((raised > 100, 100.0), else_=raised)
 
 
 class Profile(Base):
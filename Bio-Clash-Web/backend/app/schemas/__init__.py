@@ -8,6 +8,7 @@ from app.schemas.fitness import (
     ExerciseBase, ExerciseCreate, ExerciseResponse, ExerciseListResponse,
     WorkoutSetCreate, WorkoutSetResponse,
     WorkoutLogCreate, WorkoutLogResponse, WorkoutSummary,
+    WorkoutImportRow, WorkoutImportReport,
     BiometricsCreate, BiometricsResponse,
     MuscleVolumeStats, UserFitnessStats
 )
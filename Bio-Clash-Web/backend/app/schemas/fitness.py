@@ -119,6 +119,35 @@ class WorkoutSummary(BaseModel):
     buildings_unlocked: List[str]  # Building types that can now be upgraded
 
 
+class WorkoutImportRow(BaseModel):
+    """One imported set (NDJSON object or CSV row)."""
+    date: date
+    exercise_id: Optional[str] = None
+    exercise_name: Optional[str] = None  # Used when exercise_id is absent
+    session: Optional[str] = None  # Splits several workouts on the same date
+    set_number: Optional[int] = Field(None, ge=1)  # Defaults to position in the workout
+    reps: Optional[int] = Field(None, ge=0)
+    weight_kg: Optional[float] = Field(None, ge=0)
+    distance_km: Optional[float] = Field(None, ge=0)
+    duration_seconds: Optional[int] = Field(None, ge=0)
+    rpe: Optional[int] = Field(None, ge=1, le=10)
+    rir: Optional[int] = Field(None, ge=0, le=10)
+    tempo: Optional[str] = None
+
+
+class WorkoutImportReport(BaseModel):
+    """Outcome and throughput of a bulk import."""
+    rows_read: int = 0
+    rows_rejected: int = 0
+    sets_imported: int = 0
+    workouts_created: int = 0
+    gold_earned: int = 0
+    elixir_earned: int = 0
+    elapsed_seconds: float = 0.0
+    rows_per_second: float = 0.0
+    errors: List[str] = []  # First rejected rows ("line N: reason")
+
+
 # ============================================================
 # BIOMETRICS SCHEMAS
 # ============================================================